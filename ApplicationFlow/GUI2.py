@@ -9,8 +9,39 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                              QFileDialog, QDialog, QGridLayout, QMessageBox, QSpacerItem, QSizePolicy, QComboBox,
                              QLineEdit, QFormLayout)
 from PyQt5.QtGui import QPixmap, QFont, QMovie
-from PyQt5.QtCore import Qt
-from application_flow import return_final_pictures, return_final_pictures_avatar
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from application_flow import run_tryon_stream
+from tryon_pipeline import image_to_png_bytes
+
+
+class TryOnWorker(QThread):
+    """
+    Runs a try-on off the GUI thread, passing on the rough previews of the
+    denoising loop as PNG bytes, then the finished TryOnRequest.
+    """
+    preview_ready = pyqtSignal(int, bytes)
+    tryon_finished = pyqtSignal(object)
+    tryon_failed = pyqtSignal(str)
+
+    def __init__(self, model_path, garment_path, is_avatar):
+        super().__init__()
+        self.model_path = model_path
+        self.garment_path = garment_path
+        self.is_avatar = is_avatar
+
+    def run(self):
+        try:
+            events = run_tryon_stream(self.model_path, self.garment_path, is_avatar=self.is_avatar)
+            while True:
+                try:
+                    step, image = next(events)
+                except StopIteration as stop:
+                    self.tryon_finished.emit(stop.value)
+                    return
+                self.preview_ready.emit(step, image_to_png_bytes(image))
+        except Exception as e:
+            self.tryon_failed.emit(str(e))
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -23,6 +54,8 @@ class MainWindow(QMainWindow):
         self.setStyleSheet("background-color: #ffffff;")  # Soft gray background
 
         self.loading_text_label = QLabel("Your output is loading...")
+        self.tryon_worker = None
+        self.output_image_path = None
 
         # Tab widget
         self.tabs = QTabWidget()
@@ -391,41 +424,53 @@ class MainWindow(QMainWindow):
         output_image_name = f"{name1}_{name2}.png"
         output_image_path = os.path.join(self.output_dir, output_image_name)
 
-        output_path_to_show = "OutPut/out_dc_0.png"
-
         # Execute the process_images.py script and save output to the output_images folder
       #  try:
       #      subprocess.run(
        #         ["python", "process_images.py", self.image_1_path, self.image_2_path, output_image_path],
         #        check=True
          #   )
+        # The try-on runs in a worker thread, the window shows its previews meanwhile
+        self.output_image_path = output_image_path
+        self.run_script_button.setEnabled(False)
+        self.tryon_worker = TryOnWorker(self.image_1_path, self.image_2_path, self.is_avatar)
+        self.tryon_worker.preview_ready.connect(self.show_preview)
+        self.tryon_worker.tryon_finished.connect(self.show_output)
+        self.tryon_worker.tryon_failed.connect(self.show_tryon_error)
+        self.tryon_worker.start()
+
+    def show_preview(self, step, png_bytes):
+        pixmap = QPixmap()
+        pixmap.loadFromData(png_bytes)
+        self.output_image_label.setPixmap(pixmap.scaled(300, 400, Qt.KeepAspectRatio))
+        self.loading_text_label.setText(f"Your output is loading... (step {step})")
+
+    def show_output(self, request):
         try:
-            if self.is_avatar:
-                output_path_from_script = return_final_pictures_avatar(self.image_1_path, self.image_2_path)
-                print("we're using avatars function")
-            else:
-                output_path_from_script = return_final_pictures(self.image_1_path, self.image_2_path)
-                print("we're using the normal function")
-
-            print(f"Output path from script: {output_path_from_script}")
-            print(f"Output path to show: {output_path_to_show}")
-
-            if not os.path.exists(output_path_to_show):
-                raise FileNotFoundError(f"Output file not found: {output_path_to_show}")
-
-            #pixmap = QPixmap(output_path_from_script).scaled(300, 400, Qt.KeepAspectRatio)
-            pixmap = QPixmap(output_path_to_show).scaled(300, 400, Qt.KeepAspectRatio)
-            self.output_image_label.setPixmap(pixmap)
-            #shutil.copy(output_path_to_show, self.output_dir)
-            shutil.copy(output_path_to_show, output_image_path)
-            # Add the output image to the "Output Images" tab
-            #output_label = QLabel()
-            #output_label.setPixmap(QPixmap(output_path_from_script).scaled(200, 200, Qt.KeepAspectRatio))
-            #self.output_images_layout.addWidget(output_label)
+            if not request.output_images:
+                raise RuntimeError("The try-on returned no picture")
+            output_image = request.output_images[0]
+
+            # Show the result straight from memory
+            pixmap = QPixmap()
+            pixmap.loadFromData(image_to_png_bytes(output_image))
+            self.output_image_label.setPixmap(pixmap.scaled(300, 400, Qt.KeepAspectRatio))
+            # Keep a copy of every result in the output_images folder
+            output_image.save(self.output_image_path)
+            print(f"Output saved to: {self.output_image_path}")
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"An error occurred while processing images: {e}")
-        finally:
-            self.loading_text_label.setVisible(False)
+            self.show_tryon_error(str(e))
+            return
+        self.finish_tryon()
+
+    def show_tryon_error(self, message):
+        QMessageBox.critical(self, "Error", f"An error occurred while processing images: {message}")
+        self.finish_tryon()
+
+    def finish_tryon(self):
+        self.loading_text_label.setText("Your output is loading...")
+        self.loading_text_label.setVisible(False)
+        self.run_script_button.setEnabled(True)
 
 
    # def setup_avatar_tab(self):
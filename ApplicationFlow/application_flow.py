@@ -1,75 +1,60 @@
-from run_prepro_flow import run_prepro
-from run_ootd_flow import run_ootd
-from os_functions import move_first_images_by_date, move_first_images_by_date_ootd, clear_directory, find_image_path
-from category_number import category_number
+from tryon_pipeline import TryOnRequest
+from os_functions import clear_directory
 
-from generics import OOTD_OUTPUT_PATH, OUTPUT_GENERAL, PREPRO_OUTPUT_PATH, OOTD_INPUT_MODEL_PATH
+from generics import OUTPUT_GENERAL
 from generics import EXAMPLE_MODEL_PATH, EXAMPLE_GARMENT_PATH, EXAMPLE_MODEL_PATH2_topwear, EXAMPLE_PREPRO_MODEL
 
 
-def return_final_pictures(model_path, garment_path):
-    
-
-    #WITH GUI UNCOMMENT THE CODE BELOW!
-    model_path = "/home/user/AI_Personal_Shopper/AI_Personal_Shopper/ApplicationFlow/" + model_path
-    # garment_path = "/home/user/AI_Personal_Shopper/AI_Personal_Shopper/ApplicationFlow/" + garment_path
-
-    clear_directory(OUTPUT_GENERAL)
-    clear_directory(OOTD_INPUT_MODEL_PATH)
+APPLICATION_FLOW_PATH = "/home/user/AI_Personal_Shopper/AI_Personal_Shopper/ApplicationFlow/"
 
-    run_prepro(model_path)
-    print("PREPRO finished working")
 
-    move_first_images_by_date(PREPRO_OUTPUT_PATH, OOTD_INPUT_MODEL_PATH, 1)
+def run_tryon(model_path, garment_path, is_avatar=False):
+    """
+    Run a try-on for the GUI, keeping every picture in memory.
 
-    ootd_input_model_path = find_image_path(OOTD_INPUT_MODEL_PATH)
+    Returns:
+    TryOnRequest: The finished request, with the output pictures in `output_images`.
+    """
+    #WITH GUI UNCOMMENT THE CODE BELOW!
+    model_path = APPLICATION_FLOW_PATH + model_path
+    # garment_path = APPLICATION_FLOW_PATH + garment_path
 
-    numb_cat = category_number(garment_path)
-    print(f"Category number of cloth: {numb_cat}")
+    request = TryOnRequest(model_path, garment_path, is_avatar=is_avatar, sample_number="1")
+    request.run()
+    return request
 
-    run_ootd(model_path=ootd_input_model_path, cloth_path=garment_path, category_number=numb_cat, sample_number="1")
-    print("OTTD finished work")
 
-    move_first_images_by_date_ootd(OOTD_OUTPUT_PATH, OUTPUT_GENERAL, 1)
+def run_tryon_stream(model_path, garment_path, is_avatar=False, preview_interval=4):
+    """
+    Run a try-on for the GUI like run_tryon, giving rough previews while it denoises.
 
-    # output_path = find_image_path(OUTPUT_GENERAL)
-    # print(f"Path of the image: {output_path}")
-    # return output_path
+    Yields:
+    tuple: (step, PIL image) for every preview.
 
-    return OUTPUT_GENERAL + "/out_dc_0.jpg"
+    Returns:
+    TryOnRequest: The finished request, as the value of the StopIteration.
+    """
+    model_path = APPLICATION_FLOW_PATH + model_path
 
+    request = TryOnRequest(model_path, garment_path, is_avatar=is_avatar, sample_number="1")
+    yield from request.run_ootd_stream(preview_interval)
+    return request
 
-def return_final_pictures_avatar(model_path, garment_path):
 
-    #WITH GUI UNCOMMENT THE CODE BELOW!
-    model_path = "/home/user/AI_Personal_Shopper/AI_Personal_Shopper/ApplicationFlow/" + model_path
-    # garment_path = "/home/user/AI_Personal_Shopper/AI_Personal_Shopper/ApplicationFlow/" + garment_path
+def return_final_pictures(model_path, garment_path):
+    request = run_tryon(model_path, garment_path)
 
     clear_directory(OUTPUT_GENERAL)
-    # clear_directory(OOTD_INPUT_MODEL_PATH)
+    paths = request.save(OUTPUT_GENERAL)
+    return paths[0]
 
-    # run_prepro(model_path)
-    # print("PREPRO finished working")
 
-    # move_first_images_by_date(PREPRO_OUTPUT_PATH, OOTD_INPUT_MODEL_PATH, 1)
-
-    # ootd_input_model_path = find_image_path(OOTD_INPUT_MODEL_PATH)
-
-    ootd_input_model_path = model_path
-
-    numb_cat = category_number(garment_path)
-    print(f"Category number of cloth: {numb_cat}")
-
-    run_ootd(model_path=ootd_input_model_path, cloth_path=garment_path, category_number=numb_cat, sample_number="1")
-    print("OTTD finished work")
-
-    move_first_images_by_date_ootd(OOTD_OUTPUT_PATH, OUTPUT_GENERAL, 1)
-
-    # output_path = find_image_path(OUTPUT_GENERAL)
-    # print(f"Path of the image: {output_path}")
-    # return output_path
+def return_final_pictures_avatar(model_path, garment_path):
+    request = run_tryon(model_path, garment_path, is_avatar=True)
 
-    return OUTPUT_GENERAL + "/out_dc_0.png"
+    clear_directory(OUTPUT_GENERAL)
+    paths = request.save(OUTPUT_GENERAL)
+    return paths[0]
 
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
 RUN_OOTD_PATH = "/home/user/OOTDiffusion/run"
 RUN_PREPRO_PATH = "/home/user/PreProcessing"
 
+OOTD_SERVER_PORT = 7866
+OOTD_SERVER_URL = f"http://127.0.0.1:{OOTD_SERVER_PORT}"
+OOTD_SERVER_START_TIMEOUT = 600
+
 DRESSES_PATH = "/home/user/AI_Personal_Shopper/AI_Personal_Shopper/ApplicationFlow/garment_database/dresses"
 BOTTOMWEAR_PATH = "/home/user/AI_Personal_Shopper/AI_Personal_Shopper/ApplicationFlow/garment_database/bottomwear"
 TOPWEAR_PATH = "/home/user/AI_Personal_Shopper/AI_Personal_Shopper/ApplicationFlow/garment_database/topwear"
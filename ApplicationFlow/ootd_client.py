@@ -0,0 +1,182 @@
+import base64
+import json
+import subprocess
+import time
+import urllib.error
+import urllib.request
+
+from generics import RUN_OOTD_PATH, OOTD_SERVER_URL, OOTD_SERVER_PORT, OOTD_SERVER_START_TIMEOUT
+
+
+def is_ootd_server_running():
+    try:
+        with urllib.request.urlopen(OOTD_SERVER_URL + "/health", timeout=2) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def start_ootd_server():
+    """
+    Start the try-on server in the ootd environment and wait until it answers.
+    The server keeps running after the GUI exits, so later sessions skip the model load too.
+    """
+    command = f"""conda run -n ootd --cwd {RUN_OOTD_PATH} python tryon_server.py --port {OOTD_SERVER_PORT}"""
+    subprocess.Popen(command, shell=True, start_new_session=True)
+
+    deadline = time.time() + OOTD_SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if is_ootd_server_running():
+            print("OOTD server is up")
+            return True
+        time.sleep(2)
+
+    print(f"OOTD server did not start within {OOTD_SERVER_START_TIMEOUT} seconds")
+    return False
+
+
+def ensure_ootd_server():
+    if is_ootd_server_running():
+        return True
+    return start_ootd_server()
+
+
+def encode_image_file(path):
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("ascii")
+
+
+def build_request(model_path, cloth_path, model_bytes, cloth_bytes, **fields):
+    request = dict(fields)
+    if model_bytes is not None:
+        request["model_image"] = base64.b64encode(model_bytes).decode("ascii")
+    else:
+        request["model_image"] = encode_image_file(model_path)
+    if cloth_bytes is not None:
+        request["cloth_image"] = base64.b64encode(cloth_bytes).decode("ascii")
+    else:
+        request["cloth_image"] = encode_image_file(cloth_path)
+    return request
+
+
+def post_request(path, request):
+    """
+    Send a JSON request to the try-on server.
+
+    Returns:
+    list: The PNG bytes of every generated sample.
+    dict: The headers of the answer.
+    """
+    if not ensure_ootd_server():
+        raise RuntimeError("The OOTD server is not available")
+
+    http_request = urllib.request.Request(
+        OOTD_SERVER_URL + path,
+        data=json.dumps(request).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            body = response.read()
+            headers = dict(response.headers)
+            lengths = [int(length) for length in response.headers["X-Image-Lengths"].split(",")]
+            print(f"OOTD server answered {path} in {response.headers.get('X-Elapsed-Seconds')} seconds")
+            if response.headers.get("X-Timings") is not None:
+                print(f"Timings of {path}: {response.headers['X-Timings']}")
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"The OOTD server failed: {e.read().decode('utf-8', 'replace')}")
+
+    images = []
+    offset = 0
+    for length in lengths:
+        images.append(body[offset:offset + length])
+        offset += length
+    return images, headers
+
+
+def request_tryon(model_path=None, cloth_path=None, category_number="0", sample_number="1", model_type="dc",
+                  scale=2.0, step=20, seed=-1, model_bytes=None, cloth_bytes=None, scheduler="unipc"):
+    """
+    Ask the try-on server for the output pictures.
+
+    The person and the garment are given either as paths or as encoded image bytes.
+    `scheduler` names one of the schedulers the server lists on /health.
+
+    Returns:
+    list: The PNG bytes of every generated sample.
+    """
+    request = build_request(model_path, cloth_path, model_bytes, cloth_bytes,
+                            model_type=model_type, category=int(category_number), scale=scale, step=step,
+                            sample=int(sample_number), seed=seed, scheduler=scheduler)
+    images, _ = post_request("/tryon", request)
+    return images
+
+
+def request_tryon_stream(model_path=None, cloth_path=None, category_number="0", sample_number="1", model_type="dc",
+                         scale=2.0, step=20, seed=-1, model_bytes=None, cloth_bytes=None, scheduler="unipc",
+                         preview_interval=4):
+    """
+    Ask the try-on server for the output pictures, with rough previews of the
+    latents every `preview_interval` steps while it denoises.
+
+    Yields:
+    tuple: ("preview", step, PNG bytes of every sample) for every preview, then
+    ("images", None, PNG bytes of every sample) for the output pictures.
+    """
+    request = build_request(model_path, cloth_path, model_bytes, cloth_bytes,
+                            model_type=model_type, category=int(category_number), scale=scale, step=step,
+                            sample=int(sample_number), seed=seed, scheduler=scheduler,
+                            preview_interval=preview_interval)
+    if not ensure_ootd_server():
+        raise RuntimeError("The OOTD server is not available")
+
+    http_request = urllib.request.Request(
+        OOTD_SERVER_URL + "/tryon_stream",
+        data=json.dumps(request).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            # One JSON line per message, followed by its PNG files
+            for line in iter(response.readline, b""):
+                message = json.loads(line)
+                if message["kind"] == "error":
+                    raise RuntimeError(f"The OOTD server failed: {message['error']}")
+                images = [response.read(length) for length in message["lengths"]]
+                yield message["kind"], message["step"], images
+                if message["kind"] == "images":
+                    return
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"The OOTD server failed: {e.read().decode('utf-8', 'replace')}")
+    raise RuntimeError("The OOTD server closed the stream before the output pictures")
+
+
+def request_preview(model_path=None, cloth_path=None, category_number="0", sample_number="1", model_type="dc",
+                    scale=2.0, step=8, seed=-1, model_bytes=None, cloth_bytes=None, scheduler="unipc"):
+    """
+    Ask the try-on server for a fast low resolution preview, kept there for request_refine.
+
+    Returns:
+    str: The id of the preview.
+    list: The PNG bytes of every preview sample.
+    dict: The seconds of every phase on the server.
+    """
+    request = build_request(model_path, cloth_path, model_bytes, cloth_bytes,
+                            model_type=model_type, category=int(category_number), scale=scale, step=step,
+                            sample=int(sample_number), seed=seed, scheduler=scheduler)
+    images, headers = post_request("/preview", request)
+    return headers["X-Preview-Id"], images, json.loads(headers["X-Timings"])
+
+
+def request_refine(preview_id, step=20, strength=0.6, scheduler="unipc"):
+    """
+    Ask the try-on server for the full resolution pictures of a preview.
+    `strength` is the share of the steps run from the preview, None for a fresh run.
+
+    Returns:
+    list: The PNG bytes of every generated sample.
+    dict: The seconds of every phase on the server.
+    """
+    request = {"preview_id": preview_id, "step": step, "strength": strength, "scheduler": scheduler}
+    images, headers = post_request("/refine", request)
+    return images, json.loads(headers["X-Timings"])
@@ -1,4 +1,5 @@
 import os
+import sys
 from generics import RUN_PREPRO_PATH
 
 
@@ -8,6 +9,21 @@ def run_prepro(user_img_path):
     os.system(command)
 
 
+def run_prepro_in_process(user_img_path):
+    """
+    Run the pre-processing inside this process, so the YOLO model is loaded once per session.
+
+    Needs the packages of the prepro environment; raises ImportError when they are missing.
+
+    Returns:
+    PIL.Image: The segmented person on a white 3:4 background, or None when no person is detected.
+    """
+    if RUN_PREPRO_PATH not in sys.path:
+        sys.path.insert(0, RUN_PREPRO_PATH)
+    from image_processing import preprocess_person
+    return preprocess_person(user_img_path)
+
+
 
 if __name__ == '__main__':
     # Define the command
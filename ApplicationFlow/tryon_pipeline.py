@@ -0,0 +1,195 @@
+import io
+import os
+import time
+from PIL import Image
+
+from run_prepro_flow import run_prepro, run_prepro_in_process
+from ootd_client import request_tryon, request_tryon_stream, request_preview, request_refine
+from category_number import category_number
+
+from generics import PREPRO_OUTPUT_PATH
+
+
+def image_to_png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TryOnRequest:
+    """
+    One try-on, carried in memory from the user picture to the output pictures.
+
+    Every stage keeps its result on the object instead of in the shared folders,
+    so two requests never see each other's files. Nothing is written to disk
+    unless save() is called.
+
+    run_preview() gives a fast low resolution try-on first, and run_refine()
+    then renders it at full resolution on the server, without sending the
+    pictures again. `timings` keeps the server seconds of every phase.
+    """
+
+    def __init__(self, model_path, garment_path, is_avatar=False, sample_number="1", model_type="dc",
+                 step=20, scheduler="unipc"):
+        self.model_path = model_path
+        self.garment_path = garment_path
+        self.is_avatar = is_avatar
+        self.sample_number = sample_number
+        self.model_type = model_type
+        self.step = step
+        self.scheduler = scheduler
+
+        self.person_image = None
+        self.category_number = None
+        self.output_images = []
+        self.preview_id = None
+        self.preview_images = []
+        self.timings = {}
+
+    def run_prepro(self):
+        """
+        Segment the person of the user picture. Avatars are already pre-processed and used as they are.
+        """
+        if self.is_avatar:
+            self.person_image = Image.open(self.model_path)
+            return self.person_image
+
+        try:
+            self.person_image = run_prepro_in_process(self.model_path)
+        except ImportError as e:
+            # The prepro packages are not importable here, go through the prepro environment
+            print(f"In-process pre-processing unavailable: {e}")
+            run_prepro(self.model_path)
+            self.person_image = self.read_prepro_output()
+
+        if self.person_image is None:
+            raise RuntimeError("No person was detected in the picture")
+        print("PREPRO finished working")
+        return self.person_image
+
+    def read_prepro_output(self):
+        # run.py names its output after the input picture, so no need to look for the newest file
+        name = os.path.splitext(os.path.basename(self.model_path))[0]
+        output_path = os.path.join(PREPRO_OUTPUT_PATH, name + ".jpg")
+        if not os.path.exists(output_path):
+            return None
+        with Image.open(output_path) as image:
+            return image.copy()
+
+    def run_ootd(self):
+        if self.person_image is None:
+            self.run_prepro()
+
+        self.category_number = category_number(self.garment_path)
+        print(f"Category number of cloth: {self.category_number}")
+
+        images = request_tryon(
+            cloth_path=self.garment_path,
+            category_number=self.category_number,
+            sample_number=self.sample_number,
+            model_type=self.model_type,
+            step=self.step,
+            scheduler=self.scheduler,
+            model_bytes=image_to_png_bytes(self.person_image),
+        )
+        self.output_images = [Image.open(io.BytesIO(image)) for image in images]
+        print("OTTD finished work")
+        return self.output_images
+
+    def run_ootd_stream(self, preview_interval=4):
+        """
+        Run the try-on like run_ootd, giving rough previews while the server denoises.
+
+        Yields:
+        tuple: (step, PIL image of the first sample) for every preview. The output
+        pictures are in `output_images` once the generator is exhausted.
+        """
+        if self.person_image is None:
+            self.run_prepro()
+
+        self.category_number = category_number(self.garment_path)
+        print(f"Category number of cloth: {self.category_number}")
+
+        events = request_tryon_stream(
+            cloth_path=self.garment_path,
+            category_number=self.category_number,
+            sample_number=self.sample_number,
+            model_type=self.model_type,
+            step=self.step,
+            scheduler=self.scheduler,
+            model_bytes=image_to_png_bytes(self.person_image),
+            preview_interval=preview_interval,
+        )
+        for kind, step, images in events:
+            if kind == "preview":
+                yield step, Image.open(io.BytesIO(images[0]))
+            else:
+                self.output_images = [Image.open(io.BytesIO(image)) for image in images]
+        print("OTTD finished work")
+
+    def run_preview(self, step=8):
+        if self.person_image is None:
+            self.run_prepro()
+
+        self.category_number = category_number(self.garment_path)
+        print(f"Category number of cloth: {self.category_number}")
+
+        start_time = time.time()
+        self.preview_id, images, self.timings["preview"] = request_preview(
+            cloth_path=self.garment_path,
+            category_number=self.category_number,
+            sample_number=self.sample_number,
+            model_type=self.model_type,
+            step=step,
+            scheduler=self.scheduler,
+            model_bytes=image_to_png_bytes(self.person_image),
+        )
+        self.timings["preview_request"] = time.time() - start_time
+        self.preview_images = [Image.open(io.BytesIO(image)) for image in images]
+        print("OOTD preview finished")
+        return self.preview_images
+
+    def run_refine(self, strength=0.6):
+        """
+        Render the preview at full resolution, from the preview latents with `strength`
+        below 1, or as a fresh run with the same person, garment and seed otherwise.
+        """
+        if self.preview_id is None:
+            self.run_preview()
+
+        start_time = time.time()
+        images, self.timings["refine"] = request_refine(
+            self.preview_id,
+            step=self.step,
+            strength=strength,
+            scheduler=self.scheduler,
+        )
+        self.timings["refine_request"] = time.time() - start_time
+        self.output_images = [Image.open(io.BytesIO(image)) for image in images]
+        print("OOTD refine finished")
+        return self.output_images
+
+    def run(self):
+        """
+        Run every stage.
+
+        Returns:
+        list: The output PIL images.
+        """
+        self.run_prepro()
+        return self.run_ootd()
+
+    def save(self, directory):
+        """
+        Write the output pictures the way run_ootd.py names them.
+
+        Returns:
+        list: The paths of the saved pictures.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for image_idx, image in enumerate(self.output_images):
+            path = os.path.join(directory, f"out_{self.model_type}_{image_idx}.png")
+            image.save(path)
+            paths.append(path)
+        return paths
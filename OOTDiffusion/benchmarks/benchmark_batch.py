@@ -0,0 +1,75 @@
+from pathlib import Path
+import sys
+import os
+import time
+import argparse
+import torch
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / "run"))
+
+from tryon_service import TryOnService, category_dict, category_dict_utils
+from ootd.batching import MemoryBudget
+
+
+# Throughput of K garments on one person: K sequential try-ons against one batched call.
+# Run from OOTDiffusion/benchmarks, like run_ootd.py from OOTDiffusion/run, for the checkpoint paths.
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark batched multi-garment try-on')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--model_type', type=str, default="dc", required=False)
+    parser.add_argument('--model_path', type=str, default=str(PROJECT_ROOT / "run/examples/model/01008_00.jpg"), required=False)
+    parser.add_argument('--garment_dir', type=str, default=str(PROJECT_ROOT / "run/examples/garment"), required=False)
+    parser.add_argument('--n_garments', '-k', type=int, nargs='+', default=[1, 2, 4, 8], required=False)
+    parser.add_argument('--step', type=int, default=20, required=False)
+    parser.add_argument('--scale', type=float, default=2.0, required=False)
+    parser.add_argument('--budget_gb', type=float, default=None, required=False)
+    args = parser.parse_args()
+
+    service = TryOnService(args.gpu_id, preload=[args.model_type], garment_cache_bytes=0)
+    model = service.get_model(args.model_type)
+    category = 0
+
+    model_img = Image.open(args.model_path).resize((768, 1024))
+    avatar = service.analyze_person(model_img)
+    mask, mask_gray = service.add_mask(avatar, args.model_type, category_dict_utils[category])
+    masked_vton_img = Image.composite(mask_gray, model_img, mask)
+
+    files = sorted(os.listdir(args.garment_dir))
+    budget = MemoryBudget(None if args.budget_gb is None else int(args.budget_gb * 1024 ** 3))
+
+    # Warm up kernels and allocator before timing
+    model(model_type=args.model_type, category=category_dict[category], image_garm=Image.open(os.path.join(args.garment_dir, files[0])).resize((768, 1024)),
+          image_vton=masked_vton_img, mask=mask, image_ori=model_img, num_steps=2, image_scale=args.scale, seed=0)
+
+    print(f"{'K':>3} {'sequential (s)':>15} {'batched (s)':>12} {'img/s seq':>10} {'img/s batch':>12} {'speedup':>8}")
+    for n_garments in args.n_garments:
+        garments = [Image.open(os.path.join(args.garment_dir, file)).resize((768, 1024)) for file in files[:n_garments]]
+
+        synchronize()
+        start_time = time.time()
+        for idx, garment in enumerate(garments):
+            model(model_type=args.model_type, category=category_dict[category], image_garm=garment,
+                  image_vton=masked_vton_img, mask=mask, image_ori=model_img,
+                  num_steps=args.step, image_scale=args.scale, seed=idx)
+        synchronize()
+        sequential_time = time.time() - start_time
+
+        start_time = time.time()
+        model.batch(model_type=args.model_type, category=category_dict[category], image_garm=garments,
+                    image_vton=masked_vton_img, mask=mask, image_ori=model_img,
+                    num_steps=args.step, image_scale=args.scale, seed=0, memory_budget=budget)
+        synchronize()
+        batched_time = time.time() - start_time
+
+        print(f"{len(garments):>3} {sequential_time:>15.2f} {batched_time:>12.2f} {len(garments) / sequential_time:>10.3f} "
+              f"{len(garments) / batched_time:>12.3f} {sequential_time / batched_time:>7.2f}x")
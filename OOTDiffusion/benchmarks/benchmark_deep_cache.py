@@ -0,0 +1,117 @@
+from pathlib import Path
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+from skimage.metrics import structural_similarity, peak_signal_noise_ratio
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT / "ootd"))
+
+from pipelines_ootd.pipeline_ootd import OotdPipeline
+from pipelines_ootd.unet_garm_2d_condition import UNetGarm2DConditionModel
+from pipelines_ootd.unet_vton_2d_condition import UNetVton2DConditionModel
+from diffusers import UniPCMultistepScheduler
+from transformers import AutoProcessor, CLIPVisionModelWithProjection, CLIPTextModel, CLIPTokenizer
+
+
+# Step time and fidelity of the deep feature cache of unet_vton, on CPU in float32 by default. The
+# half-body model tries the example garment on the example person for every interval and depth, with
+# the same seed, against the run without cache. The mask is a fixed box over the torso so that no
+# preprocessing model is needed. Run from OOTDiffusion/benchmarks for the checkpoint paths.
+
+VIT_PATH = "../checkpoints/clip-vit-large-patch14"
+MODEL_PATH = "../checkpoints/ootd"
+UNET_PATH = "../checkpoints/ootd/ootd_hd/checkpoint-36000"
+
+
+def load_pipeline(device):
+    unet_garm = UNetGarm2DConditionModel.from_pretrained(UNET_PATH, subfolder="unet_garm", use_safetensors=True)
+    unet_vton = UNetVton2DConditionModel.from_pretrained(UNET_PATH, subfolder="unet_vton", use_safetensors=True)
+    pipe = OotdPipeline.from_pretrained(
+        MODEL_PATH,
+        unet_garm=unet_garm,
+        unet_vton=unet_vton,
+        use_safetensors=True,
+        safety_checker=None,
+        requires_safety_checker=False,
+    ).to(device)
+    pipe.scheduler = UniPCMultistepScheduler.from_config(pipe.scheduler.config)
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def encode_prompt(image_garm, device):
+    # Half-body prompt: empty caption, its second token replaced by the CLIP image embedding of the garment
+    auto_processor = AutoProcessor.from_pretrained(VIT_PATH)
+    image_encoder = CLIPVisionModelWithProjection.from_pretrained(VIT_PATH).to(device)
+    tokenizer = CLIPTokenizer.from_pretrained(MODEL_PATH, subfolder="tokenizer")
+    text_encoder = CLIPTextModel.from_pretrained(MODEL_PATH, subfolder="text_encoder").to(device)
+    with torch.no_grad():
+        prompt_image = auto_processor(images=image_garm, return_tensors="pt").to(device)
+        prompt_image = image_encoder(prompt_image.data['pixel_values']).image_embeds.unsqueeze(1)
+        input_ids = tokenizer([""], max_length=2, padding="max_length", truncation=True, return_tensors="pt").input_ids
+        prompt_embeds = text_encoder(input_ids.to(device))[0]
+        prompt_embeds[:, 1:] = prompt_image[:]
+    return prompt_embeds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the deep feature cache of unet_vton')
+    parser.add_argument('--device', type=str, default="cpu", required=False)
+    parser.add_argument('--model_path', type=str, default=str(PROJECT_ROOT / "run/examples/model/01008_00.jpg"), required=False)
+    parser.add_argument('--cloth_path', type=str, default=str(PROJECT_ROOT / "run/examples/garment/00055_00.jpg"), required=False)
+    parser.add_argument('--height', type=int, default=1024, required=False)
+    parser.add_argument('--width', type=int, default=768, required=False)
+    parser.add_argument('--intervals', type=int, nargs='+', default=[2, 3, 5], required=False)
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 2], required=False)
+    parser.add_argument('--step', type=int, default=20, required=False)
+    parser.add_argument('--scale', type=float, default=2.0, required=False)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    pipe = load_pipeline(device)
+    model_img = Image.open(args.model_path).resize((args.width, args.height))
+    cloth_img = Image.open(args.cloth_path).resize((args.width, args.height))
+    prompt_embeds = encode_prompt(cloth_img, device)
+
+    mask = np.zeros((args.height, args.width), dtype=np.uint8)
+    mask[args.height // 5: 3 * args.height // 5, args.width // 5: 4 * args.width // 5] = 255
+    mask = Image.fromarray(mask)
+    masked_vton_img = Image.composite(Image.new("RGB", model_img.size, (128, 128, 128)), model_img, mask)
+
+    def try_on(**kwargs):
+        step_ends = []
+
+        def record_step_end(pipe, i, t, callback_kwargs):
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            step_ends.append(time.time())
+            return {}
+
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start_time = time.time()
+        image = pipe(
+            prompt_embeds=prompt_embeds, image_garm=cloth_img, image_vton=masked_vton_img, mask=mask,
+            image_ori=model_img, num_inference_steps=args.step, image_guidance_scale=args.scale,
+            generator=torch.manual_seed(0), callback_on_step_end=record_step_end, **kwargs,
+        ).images[0]
+        # The first step also includes the VAE encoding and unet_garm
+        step_times = np.diff(step_ends)
+        return np.array(image), step_times.mean(), time.time() - start_time
+
+    with torch.no_grad():
+        reference, reference_step, reference_total = try_on()
+        print(f"{args.width}x{args.height}, {args.step} steps on {device}")
+        print(f"{'interval':>8} {'depth':>5} {'ms/step':>8} {'total (s)':>9} {'speedup':>8} {'SSIM':>6} {'PSNR':>6}")
+        print(f"{1:>8} {'-':>5} {1000 * reference_step:>8.0f} {reference_total:>9.1f} {1:>7.2f}x {1:>6.3f} {'inf':>6}")
+        for depth in args.depths:
+            for interval in args.intervals:
+                image, step_time, total = try_on(deep_cache_interval=interval, deep_cache_depth=depth)
+                ssim = structural_similarity(reference, image, channel_axis=2)
+                psnr = peak_signal_noise_ratio(reference, image)
+                print(f"{interval:>8} {depth:>5} {1000 * step_time:>8.0f} {total:>9.1f} "
+                      f"{reference_total / total:>7.2f}x {ssim:>6.3f} {psnr:>6.1f}")
@@ -0,0 +1,81 @@
+from pathlib import Path
+import sys
+import os
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+from skimage.metrics import structural_similarity
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / "run"))
+
+from tryon_service import TryOnService, category_dict, category_dict_utils
+
+
+# Guidance truncation: wall time and SSIM against the full-guidance picture, averaged over the
+# run/examples people with one garment, for several guidance_stop_fraction values and adaptive
+# thresholds. Run from OOTDiffusion/benchmarks for the checkpoint paths.
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark classifier free guidance truncation')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--model_type', type=str, default="hd", required=False)
+    parser.add_argument('--category', '-c', type=int, default=0, required=False)
+    parser.add_argument('--model_dir', type=str, default=str(PROJECT_ROOT / "run/examples/model"), required=False)
+    parser.add_argument('--cloth_path', type=str, default=str(PROJECT_ROOT / "run/examples/garment/00055_00.jpg"), required=False)
+    parser.add_argument('--n_models', type=int, default=4, required=False)
+    parser.add_argument('--fractions', type=float, nargs='+', default=[0.8, 0.6, 0.5, 0.4, 0.2], required=False)
+    parser.add_argument('--thresholds', type=float, nargs='*', default=[0.05, 0.1], required=False)
+    parser.add_argument('--step', type=int, default=20, required=False)
+    parser.add_argument('--scale', type=float, default=2.0, required=False)
+    args = parser.parse_args()
+
+    service = TryOnService(args.gpu_id, preload=[args.model_type])
+    model = service.get_model(args.model_type)
+    category = args.category
+    cloth_img = Image.open(args.cloth_path).resize((768, 1024))
+
+    people = []
+    for file in sorted(os.listdir(args.model_dir))[:args.n_models]:
+        model_img = Image.open(os.path.join(args.model_dir, file)).resize((768, 1024))
+        avatar = service.analyze_person(model_img)
+        mask, mask_gray = service.add_mask(avatar, args.model_type, category_dict_utils[category])
+        people.append((model_img, Image.composite(mask_gray, model_img, mask), mask))
+
+    def try_on(model_img, masked_vton_img, mask, **kwargs):
+        synchronize()
+        start_time = time.time()
+        image = model(model_type=args.model_type, category=category_dict[category], image_garm=cloth_img,
+                      image_vton=masked_vton_img, mask=mask, image_ori=model_img,
+                      num_steps=args.step, image_scale=args.scale, seed=0, **kwargs)[0]
+        synchronize()
+        return np.array(image), time.time() - start_time, model.pipe.num_guided_steps
+
+    # Warm up kernels and allocator before timing
+    try_on(*people[0])
+    references = [try_on(*person) for person in people]
+    full_time = np.mean([elapsed for _, elapsed, _ in references])
+
+    settings = [("full", {})]
+    settings += [(f"fraction {fraction}", {"guidance_stop_fraction": fraction}) for fraction in args.fractions]
+    settings += [(f"threshold {threshold}", {"guidance_stop_threshold": threshold}) for threshold in args.thresholds]
+
+    print(f"{'setting':>16} {'guided':>7} {'time (s)':>9} {'speedup':>8} {'SSIM':>6}")
+    for name, kwargs in settings:
+        times, guided, ssims = [], [], []
+        for person, (reference, _, _) in zip(people, references):
+            image, elapsed, num_guided_steps = try_on(*person, **kwargs)
+            times.append(elapsed)
+            guided.append(num_guided_steps)
+            ssims.append(structural_similarity(reference, image, channel_axis=2))
+        print(f"{name:>16} {np.mean(guided):>7.1f} {np.mean(times):>9.2f} {full_time / np.mean(times):>7.2f}x "
+              f"{np.mean(ssims):>6.3f}")
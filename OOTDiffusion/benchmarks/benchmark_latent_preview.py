@@ -0,0 +1,96 @@
+from pathlib import Path
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / "run"))
+
+from tryon_service import TryOnService
+from ootd.latent_preview import LatentPreviewer
+
+
+# Cost of the live latent previews: wall time of a try-on streamed with a preview every K
+# steps against the same try-on without previews, and the time spent in the previews
+# themselves per preview and as a share of the step time. Run from OOTDiffusion/benchmarks
+# for the checkpoint paths.
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the live latent previews')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--model_type', type=str, default="hd", required=False)
+    parser.add_argument('--category', '-c', type=int, default=0, required=False)
+    parser.add_argument('--model_path', type=str, default=str(PROJECT_ROOT / "run/examples/model/01008_00.jpg"), required=False)
+    parser.add_argument('--cloth_path', type=str, default=str(PROJECT_ROOT / "run/examples/garment/00055_00.jpg"), required=False)
+    parser.add_argument('--intervals', type=int, nargs='+', default=[1, 2, 4, 8], required=False)
+    parser.add_argument('--step', type=int, default=20, required=False)
+    parser.add_argument('--scale', type=float, default=2.0, required=False)
+    parser.add_argument('--repeat', type=int, default=3, required=False)
+    args = parser.parse_args()
+
+    service = TryOnService(args.gpu_id, preload=[args.model_type])
+    model_img = Image.open(args.model_path)
+    cloth_img = Image.open(args.cloth_path)
+    arguments = dict(model_type=args.model_type, category=args.category, image_scale=args.scale,
+                     n_steps=args.step, seed=0)
+
+    def step_times(callback_on_step_end=None):
+        # Seconds between the ends of consecutive steps; the first step also holds the encodings
+        step_ends = []
+
+        def record_step_end(pipe, i, t, callback_kwargs):
+            outputs = callback_on_step_end(pipe, i, t, callback_kwargs) if callback_on_step_end else {}
+            synchronize()
+            step_ends.append(time.time())
+            return outputs
+
+        return record_step_end, step_ends
+
+    def run_plain():
+        callback, step_ends = step_times()
+        synchronize()
+        start_time = time.time()
+        service(model_img, cloth_img, callback_on_step_end=callback, **arguments)
+        return time.time() - start_time, np.diff(step_ends).mean()
+
+    def run_streamed(interval):
+        previewer = LatentPreviewer(interval)
+        step_ends = []
+
+        def run(callback_on_step_end):
+            callback, ends = step_times(callback_on_step_end)
+            step_ends.append(ends)
+            return service(model_img, cloth_img, callback_on_step_end=callback, **arguments)
+
+        synchronize()
+        start_time = time.time()
+        for _ in previewer.stream(run):
+            pass
+        return time.time() - start_time, np.diff(step_ends[0]).mean(), previewer
+
+    # Warm up kernels and allocator before timing
+    run_plain()
+    plain = [run_plain() for _ in range(args.repeat)]
+    plain_total = np.mean([total for total, _ in plain])
+    plain_step = np.mean([step for _, step in plain])
+
+    print(f"{args.step} steps, {args.repeat} runs per setting")
+    print(f"{'interval':>8} {'total (s)':>9} {'ms/step':>8} {'overhead':>9} {'ms/preview':>10} {'preview/step':>12}")
+    print(f"{'none':>8} {plain_total:>9.2f} {1000 * plain_step:>8.1f} {0:>8.1f}% {'-':>10} {'-':>12}")
+    for interval in args.intervals:
+        runs = [run_streamed(interval) for _ in range(args.repeat)]
+        total = np.mean([total for total, _, _ in runs])
+        step = np.mean([step for _, step, _ in runs])
+        preview_seconds = np.mean([previewer.seconds / max(previewer.num_previews, 1) for _, _, previewer in runs])
+        print(f"{interval:>8} {total:>9.2f} {1000 * step:>8.1f} {100 * (total / plain_total - 1):>8.1f}% "
+              f"{1000 * preview_seconds:>10.2f} {100 * preview_seconds / plain_step:>11.2f}%")
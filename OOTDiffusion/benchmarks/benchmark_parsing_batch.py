@@ -0,0 +1,67 @@
+from pathlib import Path
+import sys
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from preprocess.humanparsing.run_parsing import Parsing
+
+
+# Throughput of the parsing of N people: N Parsing calls on picture files, each read through
+# SimpleFolderDataset and the torch DataLoader, against one Parsing.parse_batch call on the
+# pictures in memory, and how many parse maps differ between the two.
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the batched parsing of in-memory images')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--model_dir', type=str, default=str(PROJECT_ROOT / "run/examples/model"), required=False)
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4, 16], required=False)
+    parser.add_argument('--repeat', type=int, default=3, required=False)
+    args = parser.parse_args()
+
+    parsing_model = Parsing(args.gpu_id)
+    files = sorted(os.listdir(args.model_dir))
+    people = [Image.open(os.path.join(args.model_dir, file)).convert("RGB").resize((384, 512)) for file in files]
+
+    # The dataset reads the baseline pictures from files, as the original pipeline did
+    temp_dir = tempfile.TemporaryDirectory()
+    paths = []
+    for idx, person in enumerate(people):
+        path = os.path.join(temp_dir.name, f"person_{idx}.png")
+        person.save(path)
+        paths.append(path)
+
+    def run_dataset(image_paths):
+        return [parsing_model(path) for path in image_paths]
+
+    # Warm up the sessions before timing
+    run_dataset(paths[:1])
+    parsing_model.parse_batch(people[:1])
+
+    print(f"{'batch':>5} {'dataset (img/s)':>15} {'parse_batch (img/s)':>19} {'speedup':>7} {'differing maps':>14}")
+    for batch_size in args.batch_sizes:
+        images = [people[idx % len(people)] for idx in range(batch_size)]
+        image_paths = [paths[idx % len(paths)] for idx in range(batch_size)]
+        dataset_times, batch_times = [], []
+        for _ in range(args.repeat):
+            start_time = time.time()
+            expected = run_dataset(image_paths)
+            dataset_times.append(time.time() - start_time)
+            start_time = time.time()
+            results = parsing_model.parse_batch(images)
+            batch_times.append(time.time() - start_time)
+        differing = sum(not np.array_equal(np.array(parse), np.array(reference))
+                        for (parse, _), (reference, _) in zip(results, expected))
+        dataset_rate = batch_size / np.median(dataset_times)
+        batch_rate = batch_size / np.median(batch_times)
+        print(f"{batch_size:>5} {dataset_rate:>15.2f} {batch_rate:>19.2f} {batch_rate / dataset_rate:>6.2f}x "
+              f"{differing:>14}")
+
+    temp_dir.cleanup()
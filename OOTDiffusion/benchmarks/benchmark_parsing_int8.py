@@ -0,0 +1,85 @@
+from pathlib import Path
+import sys
+import os
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+# utils/miou.py imports utils.transforms from the humanparsing directory
+sys.path.insert(1, str(PROJECT_ROOT / "preprocess/humanparsing"))
+
+from preprocess.humanparsing.run_parsing import Parsing
+from preprocess.humanparsing.utils.miou import get_confusion_matrix
+
+
+# Accuracy and speed of the int8 parsing models of quantize_parsing.py against the fp32 ones:
+# the parse maps of Parsing(precision="int8") are scored against the fp32 maps, taken as the
+# ground truth, with the confusion matrix of utils/miou.py. The mIoU is over the classes in the
+# fp32 maps; with --min_miou the run fails below it, for a regression check before shipping.
+
+# label_map of run/utils_ootd.py, and the neck that Parsing takes from the LIP model
+LABELS = ['Background', 'Hat', 'Hair', 'Sunglasses', 'Upper-clothes', 'Skirt', 'Pants', 'Dress', 'Belt',
+          'Left-shoe', 'Right-shoe', 'Head', 'Left-leg', 'Right-leg', 'Left-arm', 'Right-arm', 'Bag', 'Scarf',
+          'Neck']
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+
+def parse_all(parsing_model, images, batch_size):
+    parses, seconds = [], 0.0
+    for start in range(0, len(images), batch_size):
+        start_time = time.time()
+        results = parsing_model.parse_batch(images[start:start + batch_size])
+        seconds += time.time() - start_time
+        parses.extend(np.array(parse) for parse, _ in results)
+    return parses, seconds / len(images)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare the int8 parsing models with the fp32 ones')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--image_dir', type=str, default=str(PROJECT_ROOT / "run/examples/model"), required=False)
+    parser.add_argument('--n_images', type=int, default=None, required=False)
+    parser.add_argument('--batch_size', type=int, default=4, required=False)
+    parser.add_argument('--min_miou', type=float, default=None, required=False)
+    args = parser.parse_args()
+
+    files = sorted(file for file in os.listdir(args.image_dir) if file.lower().endswith(IMAGE_EXTENSIONS))
+    images = [Image.open(os.path.join(args.image_dir, file)).convert("RGB").resize((384, 512))
+              for file in files[:args.n_images]]
+
+    results = {}
+    for precision in ("fp32", "int8"):
+        parsing_model = Parsing(args.gpu_id, precision=precision)
+        # Warm up the sessions before timing
+        parsing_model.parse_batch(images[:1])
+        results[precision] = parse_all(parsing_model, images, args.batch_size)
+    references, fp32_seconds = results["fp32"]
+    parses, int8_seconds = results["int8"]
+
+    num_classes = len(LABELS)
+    confusion_matrix = np.zeros((num_classes, num_classes))
+    for reference, parse in zip(references, parses):
+        # int32 as in utils/miou.py, the uint8 maps would overflow in the confusion index
+        confusion_matrix += get_confusion_matrix(np.asarray(reference, dtype=np.int32).ravel(),
+                                                 np.asarray(parse, dtype=np.int32).ravel(), num_classes)
+
+    pos = confusion_matrix.sum(1)
+    res = confusion_matrix.sum(0)
+    tp = np.diag(confusion_matrix)
+    pixel_accuracy = (tp.sum() / pos.sum()) * 100
+    IoU_array = (tp / np.maximum(1.0, pos + res - tp)) * 100
+    present = pos > 0
+    mean_IoU = IoU_array[present].mean()
+
+    print(f"{len(images)} people, batches of {args.batch_size}")
+    print(f"fp32: {1000 * fp32_seconds:.1f} ms/image, int8: {1000 * int8_seconds:.1f} ms/image, "
+          f"speedup {fp32_seconds / int8_seconds:.2f}x")
+    for label, iou, pixels in zip(LABELS, IoU_array, pos):
+        if pixels > 0:
+            print(f"{label:>14} {iou:>6.2f}")
+    print(f"pixel agreement: {pixel_accuracy:.2f}%, mIoU against fp32: {mean_IoU:.2f} (delta {100 - mean_IoU:.2f})")
+    if args.min_miou is not None and mean_IoU < args.min_miou:
+        sys.exit(f"mIoU {mean_IoU:.2f} below {args.min_miou}")
@@ -0,0 +1,95 @@
+from pathlib import Path
+import sys
+import time
+import json
+import argparse
+import resource
+import subprocess
+import numpy as np
+import cv2
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT / "preprocess/humanparsing"))
+
+from utils.transforms import get_affine_transform, upsample_transform_argmax
+
+
+# Postprocessing of the parsing logits, before and after the fused stage: torch.nn.Upsample,
+# permute, one cv2.warpAffine per channel and np.argmax against upsample_transform_argmax, on
+# random logits of the ATR and LIP output sizes warped back to a width x height person. Every
+# variant runs in its own process so that its peak RSS is its own; the growth of the peak over
+# the RSS before the first run is reported with the latency and the share of differing labels.
+
+
+def postprocess_before(logits, center, scale, width, height, input_size):
+    import torch
+    upsample = torch.nn.Upsample(size=input_size, mode='bilinear', align_corners=True)
+    upsample_output = upsample(torch.from_numpy(logits).unsqueeze(0))
+    upsample_output = upsample_output.squeeze()
+    upsample_output = upsample_output.permute(1, 2, 0).data.cpu().numpy()  # CHW -> HWC
+    trans = get_affine_transform(center, scale, 0, input_size, inv=1)
+    target_logits = []
+    for i in range(upsample_output.shape[2]):
+        target_logits.append(cv2.warpAffine(upsample_output[:, :, i], trans, (int(width), int(height)),
+                                            flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=(0)))
+    return np.argmax(np.stack(target_logits, axis=2), axis=2)
+
+
+def postprocess_fused(logits, center, scale, width, height, input_size):
+    return upsample_transform_argmax(logits, center, scale, width, height, input_size)
+
+
+def run_variant(args):
+    rng = np.random.default_rng(0)
+    logits = rng.standard_normal((args.channels, args.logit_size, args.logit_size), dtype=np.float32)
+    w, h = args.width, args.height
+    center = np.array([(w - 1) * 0.5, (h - 1) * 0.5], dtype=np.float32)
+    scale = np.array([max(w, h) - 1] * 2, dtype=np.float32)
+    input_size = [args.input_size, args.input_size]
+    function = postprocess_before if args.variant == "before" else postprocess_fused
+    if args.variant == "before":
+        import torch
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    labels = function(logits, center, scale, w, h, input_size)
+    start_time = time.time()
+    for _ in range(args.repeat):
+        function(logits, center, scale, w, h, input_size)
+    seconds = (time.time() - start_time) / args.repeat
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start
+    np.save(args.labels_path, labels)
+    print(json.dumps({"seconds": seconds, "peak_kb": peak}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the fused postprocessing of the parsing logits')
+    parser.add_argument('--width', type=int, default=384, required=False)
+    parser.add_argument('--height', type=int, default=512, required=False)
+    parser.add_argument('--channels', type=int, default=20, required=False)
+    parser.add_argument('--repeat', type=int, default=20, required=False)
+    parser.add_argument('--variant', type=str, default=None, choices=["before", "fused"], required=False)
+    parser.add_argument('--input_size', type=int, default=512, required=False)
+    parser.add_argument('--logit_size', type=int, default=128, required=False)
+    parser.add_argument('--labels_path', type=str, default="/tmp/parsing_labels.npy", required=False)
+    args = parser.parse_args()
+
+    if args.variant is not None:
+        run_variant(args)
+        sys.exit(0)
+
+    print(f"{args.width}x{args.height} person, {args.channels} classes, {args.repeat} runs")
+    print(f"{'input':>5} {'variant':>7} {'ms':>7} {'peak RSS (MB)':>13} {'differing labels':>16}")
+    # ATR and LIP: input size and logits at a quarter of it
+    for input_size, logit_size in ((512, 128), (473, 119)):
+        labels = {}
+        for variant in ("before", "fused"):
+            labels_path = f"/tmp/parsing_labels_{variant}.npy"
+            output = subprocess.run([sys.executable, __file__, "--variant", variant, "--width", str(args.width),
+                                     "--height", str(args.height), "--channels", str(args.channels),
+                                     "--repeat", str(args.repeat), "--input_size", str(input_size),
+                                     "--logit_size", str(logit_size), "--labels_path", labels_path],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            labels[variant] = np.load(labels_path)
+            differing = np.mean(labels[variant] != labels["before"])
+            print(f"{input_size:>5} {variant:>7} {1000 * result['seconds']:>7.2f} {result['peak_kb'] / 1024:>13.1f} "
+                  f"{100 * differing:>15.4f}%")
@@ -0,0 +1,59 @@
+from pathlib import Path
+import sys
+import os
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from preprocess.humanparsing.run_parsing import Parsing
+
+
+# Latency of Parsing (ATR then LIP, or both at once) against the onnxruntime thread settings on
+# this machine: the models in sequence with the default threads, in sequence with all the cores,
+# and concurrent with several intra-op splits, with the parallel executor and without spinning.
+# The parse maps of every setting are checked against the first one.
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the thread settings of the parsing models')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--model_path', type=str, default=str(PROJECT_ROOT / "run/examples/model/01008_00.jpg"), required=False)
+    parser.add_argument('--repeat', type=int, default=10, required=False)
+    args = parser.parse_args()
+
+    n_cores = os.cpu_count()
+    half = max(1, n_cores // 2)
+    settings = [
+        ("sequential, default threads", dict(concurrent=False)),
+        (f"sequential, {n_cores} threads", dict(concurrent=False, intra_op_num_threads=n_cores)),
+        ("sequential, parallel executor", dict(concurrent=False, execution_mode="parallel")),
+        (f"concurrent, {half}+{half} threads", dict(concurrent=True)),
+        (f"concurrent, {half}+{half} no spinning", dict(concurrent=True, allow_spinning=False)),
+        (f"concurrent, {n_cores}+{n_cores} threads", dict(concurrent=True, intra_op_num_threads=n_cores)),
+        (f"concurrent, {max(1, half // 2)}+{max(1, half // 2)} threads",
+         dict(concurrent=True, intra_op_num_threads=max(1, half // 2))),
+        (f"concurrent, {half}+{half} parallel executor", dict(concurrent=True, execution_mode="parallel")),
+    ]
+
+    model_img = Image.open(args.model_path).resize((384, 512))
+    reference = None
+    print(f"{n_cores} cores, {args.repeat} runs per setting")
+    print(f"{'setting':>40} {'median (ms)':>11} {'min (ms)':>9} {'same parse':>10}")
+    for name, options in settings:
+        parsing_model = Parsing(args.gpu_id, **options)
+        # Warm up the sessions and their thread pools before timing
+        parse, _ = parsing_model(model_img)
+        parse = np.array(parse)
+        if reference is None:
+            reference = parse
+        times = []
+        for _ in range(args.repeat):
+            start_time = time.time()
+            parsing_model(model_img)
+            times.append(time.time() - start_time)
+        print(f"{name:>40} {1000 * np.median(times):>11.1f} {1000 * np.min(times):>9.1f} "
+              f"{str(np.array_equal(parse, reference)):>10}")
@@ -0,0 +1,90 @@
+from pathlib import Path
+import sys
+import os
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+from skimage.metrics import structural_similarity, peak_signal_noise_ratio
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / "run"))
+
+from tryon_service import TryOnService, category_dict, category_dict_utils
+
+
+# Speed and quality of the mask-bounded denoising: every example person is tried on with the whole
+# frame and with crop_to_mask, with the same seed. SSIM and PSNR are of the cropped run against the
+# full one, over the whole picture. Run from OOTDiffusion/benchmarks for the checkpoint paths.
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark mask-bounded region denoising')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--model_type', type=str, default="dc", required=False)
+    parser.add_argument('--category', '-c', type=int, default=1, required=False)
+    parser.add_argument('--model_dir', type=str, default=str(PROJECT_ROOT / "run/examples/model"), required=False)
+    parser.add_argument('--cloth_path', type=str, default=str(PROJECT_ROOT / "run/examples/garment/048554_1.jpg"), required=False)
+    parser.add_argument('--n_models', type=int, default=8, required=False)
+    parser.add_argument('--crop_margin', type=int, nargs='+', default=[4, 8, 16], required=False)
+    parser.add_argument('--step', type=int, default=20, required=False)
+    parser.add_argument('--scale', type=float, default=2.0, required=False)
+    parser.add_argument('--output_dir', type=str, default=None, required=False)
+    args = parser.parse_args()
+
+    service = TryOnService(args.gpu_id, preload=[args.model_type])
+    model = service.get_model(args.model_type)
+    category = args.category
+    cloth_img = Image.open(args.cloth_path).resize((768, 1024))
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    print(f"{'model':>14} {'margin':>6} {'area':>6} {'full (s)':>9} {'crop (s)':>9} {'speedup':>8} {'SSIM':>6} {'PSNR':>6}")
+    for file in sorted(os.listdir(args.model_dir))[:args.n_models]:
+        model_img = Image.open(os.path.join(args.model_dir, file)).resize((768, 1024))
+        avatar = service.analyze_person(model_img)
+        mask, mask_gray = service.add_mask(avatar, args.model_type, category_dict_utils[category])
+        masked_vton_img = Image.composite(mask_gray, model_img, mask)
+
+        def try_on(crop_to_mask, crop_margin=8):
+            synchronize()
+            start_time = time.time()
+            image = model.pipe(
+                prompt_embeds=model.encode_prompt(args.model_type, category_dict[category], cloth_img),
+                image_garm=cloth_img, image_vton=masked_vton_img, mask=mask, image_ori=model_img,
+                num_inference_steps=args.step, image_guidance_scale=args.scale, generator=torch.manual_seed(0),
+                crop_to_mask=crop_to_mask, crop_margin=crop_margin,
+            ).images[0]
+            synchronize()
+            return image, time.time() - start_time
+
+        with torch.no_grad():
+            full_img, full_time = try_on(False)
+            full = np.array(full_img)
+            # Share of the latent frame the UNet runs on
+            mask_latents = torch.nn.functional.interpolate(
+                torch.tensor(np.array(mask) >= 127, dtype=torch.float32)[None, None], size=(128, 96)
+            )
+            for crop_margin in args.crop_margin:
+                region = model.pipe.mask_region(mask_latents, crop_margin)
+                area = 1.0 if region is None else (
+                    (region[0].stop - region[0].start) * (region[1].stop - region[1].start) / (128 * 96)
+                )
+                crop_img, crop_time = try_on(True, crop_margin)
+                crop = np.array(crop_img)
+                ssim = structural_similarity(full, crop, channel_axis=2)
+                psnr = peak_signal_noise_ratio(full, crop)
+                print(f"{file:>14} {crop_margin:>6} {area:>6.2f} {full_time:>9.2f} {crop_time:>9.2f} "
+                      f"{full_time / crop_time:>7.2f}x {ssim:>6.3f} {psnr:>6.1f}")
+                if args.output_dir is not None:
+                    side_by_side = Image.new("RGB", (2 * full_img.width, full_img.height))
+                    side_by_side.paste(full_img, (0, 0))
+                    side_by_side.paste(crop_img, (full_img.width, 0))
+                    side_by_side.save(os.path.join(args.output_dir, f"{Path(file).stem}_margin{crop_margin}.jpg"))
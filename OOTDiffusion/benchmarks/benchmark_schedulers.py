@@ -0,0 +1,94 @@
+from pathlib import Path
+import sys
+import os
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+from skimage.metrics import structural_similarity, peak_signal_noise_ratio
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / "run"))
+
+from tryon_service import TryOnService, SCHEDULERS, category_dict, category_dict_utils
+
+
+# Schedulers against step counts: wall time, SSIM and PSNR against a 50-step picture of the
+# reference scheduler, averaged over the run/examples people with one garment and fixed seeds.
+# The fastest setting above the wanted similarity is the candidate for production. Run from
+# OOTDiffusion/benchmarks for the checkpoint paths.
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the schedulers against the number of steps')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--model_type', type=str, default="hd", required=False)
+    parser.add_argument('--category', '-c', type=int, default=0, required=False)
+    parser.add_argument('--model_dir', type=str, default=str(PROJECT_ROOT / "run/examples/model"), required=False)
+    parser.add_argument('--cloth_path', type=str, default=str(PROJECT_ROOT / "run/examples/garment/00055_00.jpg"), required=False)
+    parser.add_argument('--n_models', type=int, default=4, required=False)
+    parser.add_argument('--schedulers', type=str, nargs='+', default=sorted(SCHEDULERS), choices=sorted(SCHEDULERS), required=False)
+    parser.add_argument('--steps', type=int, nargs='+', default=[4, 6, 8, 10, 12, 15, 20, 25, 30], required=False)
+    parser.add_argument('--reference_scheduler', type=str, default="unipc", choices=sorted(SCHEDULERS), required=False)
+    parser.add_argument('--reference_step', type=int, default=50, required=False)
+    parser.add_argument('--min_ssim', type=float, default=0.9, required=False)
+    parser.add_argument('--scale', type=float, default=2.0, required=False)
+    parser.add_argument('--seed', type=int, default=0, required=False)
+    args = parser.parse_args()
+
+    service = TryOnService(args.gpu_id, preload=[args.model_type])
+    model = service.get_model(args.model_type)
+    category = args.category
+    cloth_img = Image.open(args.cloth_path).resize((768, 1024))
+
+    people = []
+    for file in sorted(os.listdir(args.model_dir))[:args.n_models]:
+        model_img = Image.open(os.path.join(args.model_dir, file)).resize((768, 1024))
+        avatar = service.analyze_person(model_img)
+        mask, mask_gray = service.add_mask(avatar, args.model_type, category_dict_utils[category])
+        people.append((model_img, Image.composite(mask_gray, model_img, mask), mask))
+
+    def try_on(model_img, masked_vton_img, mask, scheduler, step, seed):
+        synchronize()
+        start_time = time.time()
+        image = model(model_type=args.model_type, category=category_dict[category], image_garm=cloth_img,
+                      image_vton=masked_vton_img, mask=mask, image_ori=model_img, num_steps=step,
+                      image_scale=args.scale, seed=seed, scheduler=scheduler)[0]
+        synchronize()
+        return np.array(image), time.time() - start_time
+
+    # Warm up kernels and allocator before timing
+    try_on(*people[0], args.reference_scheduler, 2, args.seed)
+    # Every person has its own seed, the same for all the settings
+    seeds = [args.seed + idx for idx in range(len(people))]
+    references = [
+        try_on(*person, args.reference_scheduler, args.reference_step, seed)[0] for person, seed in zip(people, seeds)
+    ]
+
+    print(f"reference: {args.reference_scheduler} at {args.reference_step} steps, {len(people)} people")
+    print(f"{'scheduler':>16} {'steps':>5} {'time (s)':>9} {'SSIM':>6} {'PSNR':>6}")
+    results = []
+    for scheduler in args.schedulers:
+        for step in args.steps:
+            times, ssims, psnrs = [], [], []
+            for person, seed, reference in zip(people, seeds, references):
+                image, elapsed = try_on(*person, scheduler, step, seed)
+                times.append(elapsed)
+                ssims.append(structural_similarity(reference, image, channel_axis=2))
+                psnrs.append(peak_signal_noise_ratio(reference, image))
+            results.append((scheduler, step, np.mean(times), np.mean(ssims)))
+            print(f"{scheduler:>16} {step:>5} {np.mean(times):>9.2f} {np.mean(ssims):>6.3f} {np.mean(psnrs):>6.1f}")
+
+    acceptable = [result for result in results if result[3] >= args.min_ssim]
+    if acceptable:
+        scheduler, step, elapsed, ssim = min(acceptable, key=lambda result: result[2])
+        print(f"fastest with SSIM >= {args.min_ssim}: {scheduler} at {step} steps, {elapsed:.2f} s, SSIM {ssim:.3f}")
+    else:
+        print(f"no setting reaches SSIM {args.min_ssim}")
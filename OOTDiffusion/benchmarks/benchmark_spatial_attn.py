@@ -0,0 +1,138 @@
+from pathlib import Path
+import sys
+import time
+import argparse
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from diffusers.models.attention_processor import AttnProcessor2_0
+from ootd.pipelines_ootd.attention_vton import BasicTransformerBlock, SpatialAttnBuffers, GarmentKVAttnProcessor
+
+
+# Spatial attention of one unet_vton transformer block over a denoising loop: the garment features
+# concatenated at every step, the reused SpatialAttnBuffers, and the garment queries, keys and values
+# projected once (GarmentKVAttnProcessor). Then attn1 alone, queried by the whole sequence as before, against
+# the vton tokens only. Random weights, no checkpoint needed.
+
+HANDOFFS = {
+    # name: (reused buffers, processor of attn1)
+    "concat": (False, AttnProcessor2_0),
+    "buffers": (True, AttnProcessor2_0),
+    "projections": (True, GarmentKVAttnProcessor),
+}
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def run_steps(block, hidden_states, spatial_attn_outputs, encoder_hidden_states, steps, buffered):
+    spatial_attn_inputs = SpatialAttnBuffers(spatial_attn_outputs) if buffered else None
+    for _ in range(steps):
+        if not buffered:
+            spatial_attn_inputs = spatial_attn_outputs.copy()
+        output, _, _ = block(hidden_states, spatial_attn_inputs, 0, encoder_hidden_states=encoder_hidden_states)
+    return output
+
+
+def measure(block, inputs, steps, buffered, device):
+    # Seconds for `steps` steps, allocations and bytes requested over them, peak memory on CUDA
+    synchronize(device)
+    start_time = time.time()
+    run_steps(block, *inputs, steps, buffered)
+    synchronize(device)
+    elapsed = time.time() - start_time
+
+    # Bytes requested from the allocator over the loop, whether or not they were freed right away
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        stats = torch.cuda.memory_stats(device)
+        allocations, allocated_bytes = stats["allocation.all.allocated"], stats["allocated_bytes.all.allocated"]
+        baseline_bytes = torch.cuda.memory_allocated(device)
+        run_steps(block, *inputs, steps, buffered)
+        stats = torch.cuda.memory_stats(device)
+        allocations = stats["allocation.all.allocated"] - allocations
+        allocated_bytes = stats["allocated_bytes.all.allocated"] - allocated_bytes
+        peak_bytes = torch.cuda.max_memory_allocated(device) - baseline_bytes
+    else:
+        with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+            run_steps(block, *inputs, steps, buffered)
+        events = [event for event in prof.events() if event.cpu_memory_usage > 0]
+        allocations = len(events)
+        allocated_bytes = sum(event.cpu_memory_usage for event in events)
+        peak_bytes = None
+    return elapsed, allocations, allocated_bytes, peak_bytes
+
+
+def measure_queries(attn, norm_hidden_states, seq_len, steps, device):
+    # Seconds for `steps` calls of attn1 queried by the first `seq_len` tokens, and the peak memory on CUDA
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        baseline_bytes = torch.cuda.memory_allocated(device)
+    synchronize(device)
+    start_time = time.time()
+    for _ in range(steps):
+        output = attn(norm_hidden_states[:, :seq_len], encoder_hidden_states=norm_hidden_states)
+    synchronize(device)
+    elapsed = time.time() - start_time
+    peak_bytes = torch.cuda.max_memory_allocated(device) - baseline_bytes if device.type == "cuda" else None
+    return output, elapsed, peak_bytes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the spatial attention feature handoff of unet_vton')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--height', type=int, default=1024, required=False)
+    parser.add_argument('--width', type=int, default=768, required=False)
+    parser.add_argument('--step', type=int, default=20, required=False)
+    parser.add_argument('--batch', type=int, default=2, required=False)
+    # First down block of SD 1.5: 320 channels at 1/8 of the picture
+    parser.add_argument('--dim', type=int, default=320, required=False)
+    parser.add_argument('--downscale', type=int, default=8, required=False)
+    parser.add_argument('--fp16', action='store_true')
+    args = parser.parse_args()
+
+    device = torch.device(f"cuda:{args.gpu_id}" if torch.cuda.is_available() else "cpu")
+    dtype = torch.float16 if args.fp16 else torch.float32
+    seq_len = (args.height // args.downscale) * (args.width // args.downscale)
+
+    block = BasicTransformerBlock(args.dim, 8, args.dim // 8, cross_attention_dim=768).to(device, dtype).eval()
+    hidden_states = torch.randn(args.batch, seq_len, args.dim, device=device, dtype=dtype)
+    spatial_attn_outputs = [torch.randn(args.batch, seq_len, args.dim, device=device, dtype=dtype)]
+    encoder_hidden_states = torch.randn(args.batch, 2, 768, device=device, dtype=dtype)
+    inputs = (hidden_states, spatial_attn_outputs, encoder_hidden_states)
+
+    with torch.no_grad():
+        block.attn1.set_processor(AttnProcessor2_0())
+        reference = run_steps(block, *inputs, 1, buffered=False)
+
+        print(f"{seq_len} tokens, batch {args.batch}, {args.step} steps on {device}, {dtype}")
+        print(f"{'handoff':>12} {'ms/step':>8} {'allocs':>7} {'allocated (MB)':>15} {'peak (MB)':>10} {'max diff':>9}")
+        for name, (buffered, processor) in HANDOFFS.items():
+            block.attn1.set_processor(processor())
+            output = run_steps(block, *inputs, 1, buffered)
+            difference = (reference - output).abs().max().item()
+            # Warm up kernels and allocator before timing
+            run_steps(block, *inputs, 2, buffered)
+
+            elapsed, allocations, allocated_bytes, peak_bytes = measure(block, inputs, args.step, buffered, device)
+            peak = "-" if peak_bytes is None else f"{peak_bytes / 1024 ** 2:.1f}"
+            print(f"{name:>12} {1000 * elapsed / args.step:>8.1f} {allocations:>7} "
+                  f"{allocated_bytes / 1024 ** 2:>15.1f} {peak:>10} {difference:>9.3g}")
+
+        attn = block.attn1
+        attn.set_processor(AttnProcessor2_0())
+        norm_hidden_states = block.norm1(torch.cat([hidden_states, spatial_attn_outputs[0]], dim=1))
+        print(f"attn1 over {2 * seq_len} tokens")
+        print(f"{'queries':>12} {'ms/step':>8} {'peak (MB)':>10} {'max diff':>9}")
+        reference, _, _ = measure_queries(attn, norm_hidden_states, 2 * seq_len, 1, device)
+        for name, query_len in (("all", 2 * seq_len), ("vton", seq_len)):
+            measure_queries(attn, norm_hidden_states, query_len, 1, device)
+            output, elapsed, peak_bytes = measure_queries(attn, norm_hidden_states, query_len, args.step, device)
+            difference = (reference[:, :seq_len] - output[:, :seq_len]).abs().max().item()
+            peak = "-" if peak_bytes is None else f"{peak_bytes / 1024 ** 2:.1f}"
+            print(f"{name:>12} {1000 * elapsed / args.step:>8.1f} {peak:>10} {difference:>9.3g}")
@@ -0,0 +1,69 @@
+from pathlib import Path
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import cv2
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT / "preprocess/humanparsing"))
+
+from utils.transforms import transform_logits, get_affine_transform
+
+
+# The inverse warp of the parsing logits: one cv2.warpAffine per channel (the former
+# transform_logits), the grouped warps and the argmax_only variant, on random logits of the
+# ATR and LIP sizes warped back to a 384x512 person. Time, peak of the NumPy allocations and
+# whether the labels match the per-channel warp.
+
+
+def transform_logits_per_channel(logits, center, scale, width, height, input_size):
+    trans = get_affine_transform(center, scale, 0, input_size, inv=1)
+    target_logits = []
+    for i in range(logits.shape[2]):
+        target_logits.append(cv2.warpAffine(logits[:, :, i], trans, (int(width), int(height)),
+                                            flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=(0)))
+    return np.stack(target_logits, axis=2)
+
+
+def measure(function, repeat):
+    tracemalloc.start()
+    labels = function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start_time = time.time()
+    for _ in range(repeat):
+        function()
+    return labels, (time.time() - start_time) / repeat, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the inverse warp of the parsing logits')
+    parser.add_argument('--width', type=int, default=384, required=False)
+    parser.add_argument('--height', type=int, default=512, required=False)
+    parser.add_argument('--channels', type=int, default=20, required=False)
+    parser.add_argument('--repeat', type=int, default=20, required=False)
+    args = parser.parse_args()
+
+    w, h = args.width, args.height
+    center = np.array([(w - 1) * 0.5, (h - 1) * 0.5], dtype=np.float32)
+    scale = np.array([max(w, h) - 1] * 2, dtype=np.float32)
+    rng = np.random.default_rng(0)
+
+    print(f"{'input':>7} {'variant':>12} {'ms':>7} {'peak (MB)':>9} {'same labels':>11}")
+    for size in (512, 473):
+        input_size = [size, size]
+        logits = rng.standard_normal((size, size, args.channels), dtype=np.float32)
+        variants = [
+            ("per channel", lambda: np.argmax(transform_logits_per_channel(logits, center, scale, w, h, input_size), axis=2)),
+            ("grouped", lambda: np.argmax(transform_logits(logits, center, scale, w, h, input_size), axis=2)),
+            ("argmax_only", lambda: transform_logits(logits, center, scale, w, h, input_size, argmax_only=True)),
+        ]
+        reference = None
+        for name, function in variants:
+            labels, seconds, peak = measure(function, args.repeat)
+            if reference is None:
+                reference = labels
+            print(f"{size:>7} {name:>12} {1000 * seconds:>7.2f} {peak / 1024 ** 2:>9.1f} "
+                  f"{str(np.array_equal(labels, reference)):>11}")
@@ -0,0 +1,183 @@
+import torch
+from PIL import Image
+from diffusers.utils.torch_utils import randn_tensor
+
+
+# Starting guess of the device memory one try-on takes in a batch at 768x1024 with guidance,
+# replaced by the measured peak after the first chunk
+DEFAULT_ITEM_BYTES = 3 * 1024 ** 3
+
+
+class MemoryBudget:
+    """
+    Decides how many try-ons of a batch run together.
+
+    With `budget_bytes` None, the budget is the free memory of the device when
+    the batch starts (no limit on CPU). The memory of one item is learned from
+    the peak of the chunks that ran, per resolution.
+    """
+
+    def __init__(self, budget_bytes=None, item_bytes=DEFAULT_ITEM_BYTES):
+        self.budget_bytes = budget_bytes
+        self.default_item_bytes = item_bytes
+        self.item_bytes = {}
+
+    def available(self, device):
+        if self.budget_bytes is not None:
+            return self.budget_bytes
+        if torch.device(device).type != "cuda":
+            return None
+        free_bytes, _ = torch.cuda.mem_get_info(device)
+        return free_bytes
+
+    def chunk_size(self, n_items, device, resolution):
+        available = self.available(device)
+        if available is None:
+            return n_items
+        item_bytes = self.item_bytes.get(resolution, self.default_item_bytes)
+        return max(1, min(n_items, int(available // item_bytes)))
+
+    def record(self, n_items, peak_bytes, resolution):
+        # 10% margin over the measured peak, allocator fragmentation varies between runs
+        self.item_bytes[resolution] = int(1.1 * peak_bytes / n_items)
+
+
+def stack_garments(garments, do_classifier_free_guidance):
+    """
+    Batch the features of several garments the way the denoising loop expects them:
+    every garment, then every empty garment when guidance is on.
+    """
+    prompt_embeds = torch.cat([garment.prompt_embeds for garment in garments])
+    spatial_attn_outputs = []
+    for idx in range(len(garments[0].spatial_attn_outputs)):
+        features = [garment.spatial_attn_outputs[idx][:1] for garment in garments]
+        if do_classifier_free_guidance:
+            features += [garment.spatial_attn_outputs[idx][1:] for garment in garments]
+        spatial_attn_outputs.append(torch.cat(features))
+    return prompt_embeds, spatial_attn_outputs
+
+
+def select(items, start, end):
+    # A single person or garment is shared by the whole batch, the pipeline broadcasts it
+    if isinstance(items, list):
+        items = items[start:end]
+        if isinstance(items[0], torch.Tensor):
+            return torch.cat(items)
+    return items
+
+
+def try_on_batch(model,
+                 model_type='hd',
+                 category='upperbody',
+                 image_garm=None,
+                 image_vton=None,
+                 mask=None,
+                 image_ori=None,
+                 num_steps=20,
+                 image_scale=1.0,
+                 seed=0,
+                 memory_budget=None,
+                 deep_cache_interval=1,
+                 deep_cache_depth=1,
+):
+    """
+    Try K garments on one person, or one garment on K persons.
+
+    `image_garm`, `image_vton`, `mask` and `image_ori` are each either a single
+    picture shared by all items or a list of K. The person may also be given as
+    VAE latents, as for the pipeline. Item k uses the seed `seed + k` and gives
+    the picture a call of `model` with that seed and one sample would.
+
+    The items run in as few pipeline calls as `memory_budget` allows. A chunk
+    that still runs out of memory is halved and retried.
+
+    Returns:
+    list: The K generated PIL images.
+    """
+    sizes = {len(items) for items in (image_garm, image_vton, mask, image_ori) if isinstance(items, list)}
+    if len(sizes) != 1:
+        raise ValueError("A batch needs the garments or the persons as lists, all of the same length")
+    n_items = sizes.pop()
+    memory_budget = memory_budget if memory_budget is not None else MemoryBudget()
+
+    pipe = model.pipe
+    device = pipe._execution_device
+    dtype = pipe.text_encoder.dtype
+    do_classifier_free_guidance = image_scale >= 1.0
+
+    images_garm = image_garm if isinstance(image_garm, list) else [image_garm]
+    with torch.no_grad():
+        garments = encode_garments(model, model_type, category, images_garm)
+    if not isinstance(image_garm, list):
+        garments = garments * n_items
+
+    # The initial noise of every item comes from its own seed, as in a single try-on
+    first_vton = image_vton[0] if isinstance(image_vton, list) else image_vton
+    if isinstance(first_vton, Image.Image):
+        height, width = first_vton.height // pipe.vae_scale_factor, first_vton.width // pipe.vae_scale_factor
+    else:
+        height, width = first_vton.shape[-2:]
+    noise = torch.cat([
+        randn_tensor((1, pipe.vae.config.latent_channels, height, width), generator=torch.manual_seed(seed + idx),
+                     device=device, dtype=dtype)
+        for idx in range(n_items)
+    ])
+
+    images = []
+    chunk_size = memory_budget.chunk_size(n_items, device, (height, width))
+    start = 0
+    while start < n_items:
+        end = min(start + chunk_size, n_items)
+        prompt_embeds, spatial_attn_outputs = stack_garments(garments[start:end], do_classifier_free_guidance)
+        try:
+            if torch.device(device).type == "cuda":
+                torch.cuda.reset_peak_memory_stats(device)
+                baseline_bytes = torch.cuda.memory_allocated(device)
+            images += pipe(prompt_embeds=prompt_embeds,
+                           spatial_attn_outputs=spatial_attn_outputs,
+                           image_vton=select(image_vton, start, end),
+                           mask=select(mask, start, end),
+                           image_ori=select(image_ori, start, end),
+                           num_inference_steps=num_steps,
+                           image_guidance_scale=image_scale,
+                           latents=noise[start:end],
+                           deep_cache_interval=deep_cache_interval,
+                           deep_cache_depth=deep_cache_depth,
+            ).images
+        except torch.cuda.OutOfMemoryError:
+            if chunk_size == 1:
+                raise
+            torch.cuda.empty_cache()
+            chunk_size = max(1, chunk_size // 2)
+            print(f"Out of memory, retrying with batches of {chunk_size}")
+            continue
+
+        if torch.device(device).type == "cuda":
+            peak_bytes = torch.cuda.max_memory_allocated(device) - baseline_bytes
+            memory_budget.record(end - start, peak_bytes, (height, width))
+        start = end
+
+    return images
+
+
+def encode_garments(model, model_type, category, images_garm):
+    """
+    GarmentFeatures of every garment, from the garment cache of `model` when it
+    has one. The garments it misses are encoded together.
+    """
+    cache = model.garment_cache
+    garments = [None] * len(images_garm)
+    keys = [None] * len(images_garm)
+    if cache is not None:
+        for idx, image in enumerate(images_garm):
+            keys[idx] = cache.make_key(image, model_type, category, model.shared_uncond)
+            garments[idx] = cache.get(keys[idx], model.gpu_id)
+
+    missing = [idx for idx, garment in enumerate(garments) if garment is None]
+    if missing:
+        encoded = model.encode_garments(model_type, [category] * len(missing), [images_garm[idx] for idx in missing])
+        for idx, garment in zip(missing, encoded):
+            garments[idx] = garment
+            if cache is not None:
+                cache.put(keys[idx], garment)
+    return garments
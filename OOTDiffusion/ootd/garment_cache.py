@@ -0,0 +1,175 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+from safetensors.torch import load_file, save_file
+
+
+class GarmentFeatures:
+    """
+    Everything the try-on computes from the garment alone: the prompt embeddings
+    (CLIP image embedding plus the category text), the garment VAE latents and
+    the `unet_garm` features for the garment and for the empty garment of
+    classifier free guidance.
+    """
+
+    def __init__(self, prompt_embeds, spatial_attn_outputs, garm_latents=None):
+        self.prompt_embeds = prompt_embeds
+        # Batch of 2 per tensor: the garment, then the empty garment
+        self.spatial_attn_outputs = spatial_attn_outputs
+        self.garm_latents = garm_latents
+
+    def tensors(self):
+        tensors = [self.prompt_embeds] + list(self.spatial_attn_outputs)
+        if self.garm_latents is not None:
+            tensors.append(self.garm_latents)
+        return tensors
+
+    @property
+    def nbytes(self):
+        return sum(tensor.numel() * tensor.element_size() for tensor in self.tensors())
+
+    def expand(self, num_images, do_classifier_free_guidance=True):
+        """
+        Lay the features out the way the denoising loop of OotdPipeline batches them:
+        `num_images` copies of the garment, then as many of the empty garment.
+        """
+        spatial_attn_outputs = []
+        for features in self.spatial_attn_outputs:
+            cond = features[:1]
+            uncond = features[1:]
+            if num_images > 1:
+                cond = cond.repeat_interleave(num_images, dim=0)
+                uncond = uncond.repeat_interleave(num_images, dim=0)
+            if do_classifier_free_guidance:
+                spatial_attn_outputs.append(torch.cat([cond, uncond]) if num_images > 1 else features)
+            else:
+                spatial_attn_outputs.append(cond)
+        return spatial_attn_outputs
+
+    def to(self, device):
+        return GarmentFeatures(
+            self.prompt_embeds.to(device),
+            [features.to(device) for features in self.spatial_attn_outputs],
+            None if self.garm_latents is None else self.garm_latents.to(device),
+        )
+
+    def state_dict(self):
+        tensors = {"prompt_embeds": self.prompt_embeds.contiguous().cpu()}
+        for idx, features in enumerate(self.spatial_attn_outputs):
+            tensors[f"spatial_attn_{idx}"] = features.contiguous().cpu()
+        if self.garm_latents is not None:
+            tensors["garm_latents"] = self.garm_latents.contiguous().cpu()
+        return tensors
+
+    @classmethod
+    def from_state_dict(cls, tensors):
+        n_features = sum(name.startswith("spatial_attn_") for name in tensors)
+        return cls(
+            tensors["prompt_embeds"],
+            [tensors[f"spatial_attn_{idx}"] for idx in range(n_features)],
+            tensors.get("garm_latents"),
+        )
+
+
+class GarmentCache:
+    """
+    Garment features by content hash, so repeat try-ons of a catalog item skip
+    the CLIP encoders, the garment VAE encoding and `unet_garm`.
+
+    Entries live in an in-memory LRU bounded by `max_bytes`. With `cache_dir`,
+    every entry is also written there as a safetensors file and read back when
+    it is no longer in memory, including after a restart.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_garm, model_type, category, shared_uncond=False):
+        """
+        Hash of the decoded garment pixels, so a re-encoded file with the same
+        pixels still hits. The resolution is part of the pixels' shape, the model
+        type and the category select different weights and prompts. Features
+        with the shared empty garment of the model (`shared_uncond`) differ from
+        the exact ones and get their own keys.
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{model_type}/{category}/{image_garm.mode}/{image_garm.size[0]}x{image_garm.size[1]}".encode())
+        if shared_uncond:
+            digest.update(b"/shared_uncond")
+        digest.update(image_garm.tobytes())
+        return digest.hexdigest()
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, key + ".safetensors")
+
+    def get(self, key, device=None):
+        with self.lock:
+            features = self.entries.get(key)
+            if features is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return features
+
+        if self.cache_dir is not None and os.path.exists(self.disk_path(key)):
+            features = GarmentFeatures.from_state_dict(load_file(self.disk_path(key)))
+            if device is not None:
+                features = features.to(device)
+            with self.lock:
+                self.hits += 1
+            self.insert(key, features)
+            return features
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, features):
+        self.insert(key, features)
+        if self.cache_dir is not None:
+            # Write next to the final name first, so a crash never leaves a truncated entry
+            tmp_path = self.disk_path(key) + ".tmp"
+            save_file(features.state_dict(), tmp_path)
+            os.replace(tmp_path, self.disk_path(key))
+
+    def insert(self, key, features):
+        nbytes = features.nbytes
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            # An entry larger than the whole budget would evict everything and still not fit
+            if nbytes > self.max_bytes:
+                return
+            self.entries[key] = features
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def exists(self, key):
+        """
+        Whether `key` is cached, in memory or on disk, without loading it.
+        """
+        return key in self.entries or (self.cache_dir is not None and os.path.exists(self.disk_path(key)))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
@@ -14,9 +14,12 @@ import time
 import pdb
 
 from pipelines_ootd.pipeline_ootd import OotdPipeline
+from garment_cache import GarmentFeatures
+from batching import try_on_batch
+from preview import PREVIEW_SIZE, render_preview, refine_preview
+from scheduler_registry import DEFAULT_SCHEDULER, SchedulerSet
 from pipelines_ootd.unet_garm_2d_condition import UNetGarm2DConditionModel
 from pipelines_ootd.unet_vton_2d_condition import UNetVton2DConditionModel
-from diffusers import UniPCMultistepScheduler
 from diffusers import AutoencoderKL
 
 import torch.nn as nn
@@ -31,8 +34,12 @@ MODEL_PATH = "../checkpoints/ootd"
 
 class OOTDiffusionDC:
 
-    def __init__(self, gpu_id):
+    def __init__(self, gpu_id, garment_cache=None, shared_uncond=False):
         self.gpu_id = 'cuda:' + str(gpu_id)
+        self.garment_cache = garment_cache
+        # Empty garment features by (model_type, category, width, height), see empty_garment
+        self.shared_uncond = shared_uncond
+        self.empty_garments = {}
 
         vae = AutoencoderKL.from_pretrained(
             VAE_PATH,
@@ -65,7 +72,8 @@ class OOTDiffusionDC:
             requires_safety_checker=False,
         ).to(self.gpu_id)
 
-        self.pipe.scheduler = UniPCMultistepScheduler.from_config(self.pipe.scheduler.config)
+        # UniPC unless a call asks for another scheduler of scheduler_registry
+        self.schedulers = SchedulerSet(self.pipe)
         
         self.auto_processor = AutoProcessor.from_pretrained(VIT_PATH)
         self.image_encoder = CLIPVisionModelWithProjection.from_pretrained(VIT_PATH).to(self.gpu_id)
@@ -87,6 +95,80 @@ class OOTDiffusionDC:
         return inputs.input_ids
 
 
+    def encode_prompt(self, model_type, category, image_garm):
+        # A list of categories and garments encodes the whole batch at once
+        categories = category if isinstance(category, list) else [category]
+        prompt_image = self.auto_processor(images=image_garm, return_tensors="pt").to(self.gpu_id)
+        prompt_image = self.image_encoder(prompt_image.data['pixel_values']).image_embeds
+        prompt_image = prompt_image.unsqueeze(1)
+        if model_type == 'hd':
+            prompt_embeds = self.text_encoder(self.tokenize_captions([""] * len(categories), 2).to(self.gpu_id))[0]
+            prompt_embeds[:, 1:] = prompt_image[:]
+        elif model_type == 'dc':
+            prompt_embeds = self.text_encoder(self.tokenize_captions(categories, 3).to(self.gpu_id))[0]
+            prompt_embeds = torch.cat([prompt_embeds, prompt_image], dim=1)
+        else:
+            raise ValueError("model_type must be \'hd\' or \'dc\'!")
+        return prompt_embeds
+
+
+    def empty_garment(self, model_type, category, size):
+        """
+        The `unet_garm` features of the empty garment of classifier free guidance.
+
+        The pipeline prompts the empty garment with the CLIP embedding of the real
+        garment, so its features differ for every garment. With `shared_uncond`,
+        the embedding of a plain gray picture is used instead: the features only
+        depend on the model, the category and the resolution, and are computed once.
+        This changes the guidance slightly, so it is off by default.
+        """
+        key = (model_type, category) + tuple(size)
+        if key not in self.empty_garments:
+            with torch.no_grad():
+                prompt_embeds = self.encode_prompt(model_type, category, Image.new("RGB", size, (128, 128, 128)))
+                self.empty_garments[key] = self.pipe.encode_empty_garment(size[1], size[0], prompt_embeds)
+        return self.empty_garments[key]
+
+
+    def encode_garments(self, model_type, categories, images_garm):
+        uncond_spatial_attn_outputs = None
+        if self.shared_uncond:
+            empty_garments = [
+                self.empty_garment(model_type, category, image.size) for category, image in zip(categories, images_garm)
+            ]
+            uncond_spatial_attn_outputs = [torch.cat(features) for features in zip(*empty_garments)]
+
+        with torch.no_grad():
+            prompt_embeds = self.encode_prompt(model_type, categories, images_garm)
+            garm_latents, spatial_attn_outputs = self.pipe.encode_garment(
+                images_garm, prompt_embeds, uncond_spatial_attn_outputs
+            )
+
+        n_garments = len(images_garm)
+        if n_garments == 1:
+            return [GarmentFeatures(prompt_embeds, spatial_attn_outputs, garm_latents)]
+        # Copies, so that a cached garment does not keep the tensors of its whole batch alive
+        return [
+            GarmentFeatures(
+                prompt_embeds[idx:idx + 1].clone(),
+                [features[idx::n_garments].clone() for features in spatial_attn_outputs],
+                garm_latents[idx:idx + 1].clone(),
+            )
+            for idx in range(n_garments)
+        ]
+
+
+    def encode_garment(self, model_type, category, image_garm):
+        if self.garment_cache is None:
+            return self.encode_garments(model_type, [category], [image_garm])[0]
+        key = self.garment_cache.make_key(image_garm, model_type, category, self.shared_uncond)
+        garment = self.garment_cache.get(key, self.gpu_id)
+        if garment is None:
+            garment = self.encode_garments(model_type, [category], [image_garm])[0]
+            self.garment_cache.put(key, garment)
+        return garment
+
+
     def __call__(self,
                 model_type='hd',
                 category='upperbody',
@@ -98,25 +180,31 @@ class OOTDiffusionDC:
                 num_steps=20,
                 image_scale=1.0,
                 seed=-1,
+                image_ori_latents=None,
+                crop_to_mask=False,
+                guidance_stop_fraction=1.0,
+                guidance_stop_threshold=None,
+                deep_cache_interval=1,
+                deep_cache_depth=1,
+                scheduler=DEFAULT_SCHEDULER,
+                callback_on_step_end=None,
+                callback_on_step_end_tensor_inputs=("latents", "pred_original_sample"),
     ):
         if seed == -1:
             random.seed(time.time())
             seed = random.randint(0, 2147483647)
         print('Initial seed: ' + str(seed))
         generator = torch.manual_seed(seed)
+        self.schedulers.use(scheduler)
 
         with torch.no_grad():
-            prompt_image = self.auto_processor(images=image_garm, return_tensors="pt").to(self.gpu_id)
-            prompt_image = self.image_encoder(prompt_image.data['pixel_values']).image_embeds
-            prompt_image = prompt_image.unsqueeze(1)
-            if model_type == 'hd':
-                prompt_embeds = self.text_encoder(self.tokenize_captions([""], 2).to(self.gpu_id))[0]
-                prompt_embeds[:, 1:] = prompt_image[:]
-            elif model_type == 'dc':
-                prompt_embeds = self.text_encoder(self.tokenize_captions([category], 3).to(self.gpu_id))[0]
-                prompt_embeds = torch.cat([prompt_embeds, prompt_image], dim=1)
+            if self.garment_cache is None and not self.shared_uncond:
+                prompt_embeds = self.encode_prompt(model_type, category, image_garm)
+                spatial_attn_outputs = None
             else:
-                raise ValueError("model_type must be \'hd\' or \'dc\'!")
+                garment = self.encode_garment(model_type, category, image_garm)
+                prompt_embeds = garment.prompt_embeds
+                spatial_attn_outputs = garment.expand(num_samples, image_scale >= 1.0)
 
             images = self.pipe(prompt_embeds=prompt_embeds,
                         image_garm=image_garm,
@@ -127,6 +215,129 @@ class OOTDiffusionDC:
                         image_guidance_scale=image_scale,
                         num_images_per_prompt=num_samples,
                         generator=generator,
+                        spatial_attn_outputs=spatial_attn_outputs,
+                        image_ori_latents=image_ori_latents,
+                        crop_to_mask=crop_to_mask,
+                        guidance_stop_fraction=guidance_stop_fraction,
+                        guidance_stop_threshold=guidance_stop_threshold,
+                        deep_cache_interval=deep_cache_interval,
+                        deep_cache_depth=deep_cache_depth,
+                        callback_on_step_end=callback_on_step_end,
+                        callback_on_step_end_tensor_inputs=list(callback_on_step_end_tensor_inputs),
             ).images
 
         return images
+
+
+    def batch(self,
+                model_type='hd',
+                category='upperbody',
+                image_garm=None,
+                image_vton=None,
+                mask=None,
+                image_ori=None,
+                num_steps=20,
+                image_scale=1.0,
+                seed=-1,
+                memory_budget=None,
+                deep_cache_interval=1,
+                deep_cache_depth=1,
+                scheduler=DEFAULT_SCHEDULER,
+    ):
+        """
+        Several try-ons in batched pipeline runs, see batching.try_on_batch.
+        """
+        if seed == -1:
+            random.seed(time.time())
+            seed = random.randint(0, 2147483647)
+        print('Initial seed: ' + str(seed))
+        self.schedulers.use(scheduler)
+
+        return try_on_batch(self,
+                    model_type=model_type,
+                    category=category,
+                    image_garm=image_garm,
+                    image_vton=image_vton,
+                    mask=mask,
+                    image_ori=image_ori,
+                    num_steps=num_steps,
+                    image_scale=image_scale,
+                    seed=seed,
+                    memory_budget=memory_budget,
+                    deep_cache_interval=deep_cache_interval,
+                    deep_cache_depth=deep_cache_depth,
+        )
+
+
+    def preview(self,
+                model_type='hd',
+                category='upperbody',
+                image_garm=None,
+                image_vton=None,
+                mask=None,
+                image_ori=None,
+                num_samples=1,
+                num_steps=8,
+                image_scale=1.0,
+                seed=-1,
+                size=PREVIEW_SIZE,
+                deep_cache_interval=1,
+                deep_cache_depth=1,
+                scheduler=DEFAULT_SCHEDULER,
+    ):
+        """
+        A fast low resolution try-on to refine later, see preview.render_preview.
+        """
+        if seed == -1:
+            random.seed(time.time())
+            seed = random.randint(0, 2147483647)
+        print('Initial seed: ' + str(seed))
+        self.schedulers.use(scheduler)
+
+        with torch.no_grad():
+            return render_preview(self,
+                        model_type=model_type,
+                        category=category,
+                        image_garm=image_garm,
+                        image_vton=image_vton,
+                        mask=mask,
+                        image_ori=image_ori,
+                        num_samples=num_samples,
+                        num_steps=num_steps,
+                        image_scale=image_scale,
+                        seed=seed,
+                        size=size,
+                        deep_cache_interval=deep_cache_interval,
+                        deep_cache_depth=deep_cache_depth,
+            )
+
+
+    def refine(self,
+                preview,
+                image_vton=None,
+                mask=None,
+                image_ori=None,
+                num_steps=20,
+                strength=0.6,
+                image_ori_latents=None,
+                deep_cache_interval=1,
+                deep_cache_depth=1,
+                scheduler=DEFAULT_SCHEDULER,
+    ):
+        """
+        The full resolution try-on of a preview, see preview.refine_preview.
+        """
+        self.schedulers.use(scheduler)
+
+        with torch.no_grad():
+            return refine_preview(self,
+                        preview,
+                        image_vton=image_vton,
+                        mask=mask,
+                        image_ori=image_ori,
+                        num_steps=num_steps,
+                        strength=strength,
+                        image_ori_latents=image_ori_latents,
+                        deep_cache_interval=deep_cache_interval,
+                        deep_cache_depth=deep_cache_depth,
+            )
@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+
+import torch
+from PIL import Image
+
+
+# Linear map from the 4 latent channels of the Stable Diffusion 1.x VAE, as the denoising loop
+# holds them (multiplied by the scaling factor), to RGB in [-1, 1]. It is meant for clean latents,
+# on the noisy ones of the early steps it mostly shows the noise.
+LATENT_RGB_FACTORS = torch.tensor([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+])
+
+
+class LatentPreviewer:
+    """
+    Cheap pictures of the latents of the denoising loop, every `interval` steps.
+
+    A preview shows the denoised latents x0 that the step predicts, the
+    "pred_original_sample" of the pipeline callback, rather than the noisy
+    latents of the loop, which are mostly noise in the early steps. They go
+    through LATENT_RGB_FACTORS instead of the VAE decoder, so a preview
+    is one small matmul and a copy of a picture of the latent resolution
+    (1/8 of the output in each direction) to the host. `seconds` and
+    `num_previews` keep what the previews cost, to compare with the step time.
+    """
+
+    def __init__(self, interval=4):
+        self.interval = interval
+        self.factors = LATENT_RGB_FACTORS
+        self.seconds = 0.0
+        self.num_previews = 0
+
+    def to_images(self, latents):
+        if self.factors.device != latents.device:
+            self.factors = LATENT_RGB_FACTORS.to(latents.device)
+        rgb = torch.einsum("bchw,cr->bhwr", latents.float(), self.factors)
+        rgb = ((rgb + 1) * 127.5).clamp(0, 255).to(torch.uint8).cpu().numpy()
+        return [Image.fromarray(picture) for picture in rgb]
+
+    def stream(self, run):
+        """
+        Call `run(callback_on_step_end)` in a thread and yield what it gives as it goes:
+        ("preview", step, images) every `interval` steps, then ("images", None, images)
+        with the return value of `run`. The exceptions of `run` are raised here.
+
+        `callback_on_step_end` is for the pipeline, or any try-on that passes it on.
+        """
+        events = queue.Queue()
+
+        def callback_on_step_end(pipe, i, t, callback_kwargs):
+            # No preview after the last step, the decoded pictures follow
+            if (i + 1) % self.interval == 0 and i + 1 < pipe.num_timesteps:
+                start_time = time.time()
+                # The noisy latents when the pipeline does not give x0
+                latents = callback_kwargs.get("pred_original_sample", callback_kwargs["latents"])
+                images = self.to_images(latents)
+                self.seconds += time.time() - start_time
+                self.num_previews += 1
+                events.put(("preview", i + 1, images))
+            return {}
+
+        def target():
+            try:
+                events.put(("images", None, run(callback_on_step_end)))
+            except BaseException as e:
+                events.put(("error", None, e))
+
+        threading.Thread(target=target, daemon=True).start()
+        while True:
+            kind, step, value = events.get()
+            if kind == "error":
+                raise value
+            yield kind, step, value
+            if kind == "images":
+                return
@@ -16,17 +16,162 @@
 from typing import Any, Dict, Optional
 
 import torch
+import torch.nn.functional as F
 from torch import nn
 
 from diffusers.utils import USE_PEFT_BACKEND
 from diffusers.utils.torch_utils import maybe_allow_in_graph
 from diffusers.models.activations import GEGLU, GELU, ApproximateGELU
-from diffusers.models.attention_processor import Attention
+from diffusers.models.attention_processor import Attention, AttnProcessor2_0
 from diffusers.models.embeddings import SinusoidalPositionalEmbedding
 from diffusers.models.lora import LoRACompatibleLinear
 from diffusers.models.normalization import AdaLayerNorm, AdaLayerNormZero
 
 
+class SpatialAttnBuffers:
+    r"""
+    The `unet_garm` features of every transformer block, laid out for the spatial self-attention of `unet_vton`.
+
+    Each block attends over its hidden states followed by the garment features of the same block. Instead of
+    concatenating both at every denoising step, the block writes into a buffer allocated at the first step, whose
+    garment half is filled once and only the vton half is refreshed afterwards. The buffers hold the garment features
+    already through `norm1`, which is per token, so the concatenated raw hidden states are not needed at all.
+
+    Only for inference: the buffers are written in place across steps.
+
+    Parameters:
+        spatial_attn_outputs (`List[torch.FloatTensor]`): The features returned by `unet_garm`, in block order.
+    """
+
+    def __init__(self, spatial_attn_outputs):
+        self.spatial_attn_outputs = list(spatial_attn_outputs)
+        self.buffers = [None] * len(self.spatial_attn_outputs)
+        self.projection_buffers = [None] * len(self.spatial_attn_outputs)
+
+    def __len__(self):
+        return len(self.spatial_attn_outputs)
+
+    def __getitem__(self, idx):
+        return self.spatial_attn_outputs[idx]
+
+    def concat(self, idx, norm_hidden_states, norm):
+        r"""
+        The normalized hidden states of block `idx` followed by its normalized garment features, in a reused buffer.
+        `norm` is applied to the garment features when the buffer is (re)allocated.
+        """
+        features = self.spatial_attn_outputs[idx]
+        batch_size, seq_len, dim = norm_hidden_states.shape
+        buffer = self.buffers[idx]
+        if (
+            buffer is None
+            or buffer.shape != (batch_size, seq_len + features.shape[1], dim)
+            or buffer.dtype != norm_hidden_states.dtype
+        ):
+            buffer = norm_hidden_states.new_empty((batch_size, seq_len + features.shape[1], dim))
+            buffer[:, seq_len:].copy_(norm(features))
+            self.buffers[idx] = buffer
+        buffer[:, :seq_len].copy_(norm_hidden_states)
+        return buffer
+
+    def projections(self, idx, attn, norm, seq_len, scale=1.0):
+        r"""
+        Key and value buffers of block `idx` for [`GarmentKVAttnProcessor`], for `seq_len` vton tokens followed by the
+        garment tokens. The garment tokens go through `norm` and the projections of `attn` once, when the buffers are
+        (re)allocated, and the processor writes the vton projections in front at every step.
+        """
+        features = self.spatial_attn_outputs[idx]
+        projections = self.projection_buffers[idx]
+        if projections is None or projections[0].shape[1] != seq_len + features.shape[1]:
+            args = () if USE_PEFT_BACKEND else (scale,)
+            norm_features = norm(features)
+            projections = []
+            for linear in (attn.to_k, attn.to_v):
+                garment_projection = linear(norm_features, *args)
+                batch_size, garment_len, dim = garment_projection.shape
+                buffer = garment_projection.new_empty((batch_size, seq_len + garment_len, dim))
+                buffer[:, seq_len:].copy_(garment_projection)
+                projections.append(buffer)
+            self.projection_buffers[idx] = projections
+        return projections
+
+    def head(self, batch_size):
+        r"""
+        The first `batch_size` items of the batch, as buffers that share the memory and the garment halves already
+        written. Used to drop the unconditional half of classifier free guidance mid-loop.
+        """
+        head = SpatialAttnBuffers([features[:batch_size] for features in self.spatial_attn_outputs])
+        head.buffers = [None if buffer is None else buffer[:batch_size] for buffer in self.buffers]
+        head.projection_buffers = [
+            None if projections is None else [buffer[:batch_size] for buffer in projections]
+            for projections in self.projection_buffers
+        ]
+        return head
+
+    def clear(self):
+        self.buffers = [None] * len(self.spatial_attn_outputs)
+        self.projection_buffers = [None] * len(self.spatial_attn_outputs)
+
+
+class GarmentKVAttnProcessor:
+    r"""
+    Processor for the spatial self-attention of `unet_vton`, whose keys and values are the vton tokens followed by the
+    garment tokens. Only the vton tokens are queried, since the garment half of the output is dropped. Given the
+    `garment_projections` buffers of [`SpatialAttnBuffers.projections`], only the vton tokens are projected, the
+    garment keys and values come from the buffers. Without them, it is
+    [`~diffusers.models.attention_processor.AttnProcessor2_0`].
+    """
+
+    def __init__(self):
+        if not hasattr(F, "scaled_dot_product_attention"):
+            raise ImportError("GarmentKVAttnProcessor requires PyTorch 2.0, to use it, please upgrade PyTorch to 2.0.")
+        self.processor = AttnProcessor2_0()
+
+    def __call__(
+        self,
+        attn: Attention,
+        hidden_states: torch.FloatTensor,
+        encoder_hidden_states: Optional[torch.FloatTensor] = None,
+        attention_mask: Optional[torch.FloatTensor] = None,
+        temb: Optional[torch.FloatTensor] = None,
+        scale: float = 1.0,
+        garment_projections=None,
+    ) -> torch.FloatTensor:
+        if garment_projections is None:
+            return self.processor(attn, hidden_states, encoder_hidden_states, attention_mask, temb, scale)
+
+        args = () if USE_PEFT_BACKEND else (scale,)
+        batch_size, seq_len, _ = hidden_states.shape
+        key, value = garment_projections
+        query = attn.to_q(hidden_states, *args)
+        key[:, :seq_len].copy_(attn.to_k(hidden_states, *args))
+        value[:, :seq_len].copy_(attn.to_v(hidden_states, *args))
+
+        if attention_mask is not None:
+            attention_mask = attn.prepare_attention_mask(attention_mask, key.shape[1], batch_size)
+            attention_mask = attention_mask.view(batch_size, attn.heads, -1, attention_mask.shape[-1])
+
+        inner_dim = key.shape[-1]
+        head_dim = inner_dim // attn.heads
+
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        hidden_states = F.scaled_dot_product_attention(
+            query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
+        )
+
+        hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, attn.heads * head_dim)
+        hidden_states = hidden_states.to(query.dtype)
+
+        # linear proj
+        hidden_states = attn.to_out[0](hidden_states, *args)
+        # dropout
+        hidden_states = attn.to_out[1](hidden_states)
+
+        return hidden_states / attn.rescale_output_factor
+
+
 @maybe_allow_in_graph
 class GatedSelfAttentionDense(nn.Module):
     r"""
@@ -167,6 +312,7 @@ class BasicTransformerBlock(nn.Module):
             bias=attention_bias,
             cross_attention_dim=cross_attention_dim if only_cross_attention else None,
             upcast_attention=upcast_attention,
+            processor=GarmentKVAttnProcessor(),
         )
 
         # 2. Cross-Attn
@@ -231,11 +377,26 @@ class BasicTransformerBlock(nn.Module):
         # 0. Self-Attention
         batch_size = hidden_states.shape[0]
 
-        spatial_attn_input = spatial_attn_inputs[spatial_attn_idx]
-        spatial_attn_idx += 1
-        hidden_states = torch.cat((hidden_states, spatial_attn_input), dim=1)
+        seq_len = hidden_states.shape[1]
+        use_buffers = (
+            isinstance(spatial_attn_inputs, SpatialAttnBuffers) and self.use_layer_norm and self.pos_embed is None
+        )
+        # With the garment projections cached, attn1 only gets the vton half
+        use_projections = (
+            use_buffers
+            and not self.only_cross_attention
+            and isinstance(self.attn1.processor, GarmentKVAttnProcessor)
+        )
+        if not use_buffers:
+            spatial_attn_input = spatial_attn_inputs[spatial_attn_idx]
+            hidden_states = torch.cat((hidden_states, spatial_attn_input), dim=1)
 
-        if self.use_ada_layer_norm:
+        if use_projections:
+            norm_hidden_states = self.norm1(hidden_states)
+        elif use_buffers:
+            # Only the vton half is normalized, the garment half is already in the buffer
+            norm_hidden_states = spatial_attn_inputs.concat(spatial_attn_idx, self.norm1(hidden_states), self.norm1)
+        elif self.use_ada_layer_norm:
             norm_hidden_states = self.norm1(hidden_states, timestep)
         elif self.use_ada_layer_norm_zero:
             norm_hidden_states, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.norm1(
@@ -262,21 +423,33 @@ class BasicTransformerBlock(nn.Module):
         # 2. Prepare GLIGEN inputs
         cross_attention_kwargs = cross_attention_kwargs.copy() if cross_attention_kwargs is not None else {}
         gligen_kwargs = cross_attention_kwargs.pop("gligen", None)
+        # Only the vton tokens are queried, the garment half of the output would be dropped
+        garment_kwargs = {}
+        if use_projections:
+            garment_kwargs["garment_projections"] = spatial_attn_inputs.projections(
+                spatial_attn_idx, self.attn1, self.norm1, seq_len, lora_scale
+            )
+            query_states, attn1_encoder_hidden_states = norm_hidden_states, None
+        elif self.only_cross_attention:
+            query_states, attn1_encoder_hidden_states = norm_hidden_states, encoder_hidden_states
+        else:
+            query_states, attn1_encoder_hidden_states = norm_hidden_states[:, :seq_len], norm_hidden_states
+        spatial_attn_idx += 1
 
         attn_output = self.attn1(
-            norm_hidden_states,
-            encoder_hidden_states=encoder_hidden_states if self.only_cross_attention else None,
+            query_states,
+            encoder_hidden_states=attn1_encoder_hidden_states,
             attention_mask=attention_mask,
             **cross_attention_kwargs,
+            **garment_kwargs,
         )
         if self.use_ada_layer_norm_zero:
             attn_output = gate_msa.unsqueeze(1) * attn_output
         elif self.use_ada_layer_norm_single:
             attn_output = gate_msa * attn_output
 
-        
-        hidden_states = attn_output + hidden_states
-        hidden_states, _ = hidden_states.chunk(2, dim=1)
+        # Only the vton half goes on, the garment half of the sequence is dropped
+        hidden_states = attn_output[:, :seq_len] + hidden_states[:, :seq_len]
 
         if hidden_states.ndim == 4:
             hidden_states = hidden_states.squeeze(1)
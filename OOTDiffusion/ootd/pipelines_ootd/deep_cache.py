@@ -0,0 +1,51 @@
+import torch
+
+
+class DeepCache:
+    r"""
+    Reuse of the deep features of `unet_vton` across denoising steps. Consecutive steps give very close features in the
+    low resolution blocks, so a full step runs the whole UNet every `interval` steps and keeps the input of its last
+    `depth` up blocks. The steps in between only run the first `depth` down blocks and the last `depth` up blocks, on
+    the kept features.
+
+    The spatial attention inputs of the skipped blocks are skipped with them: a cheap step resumes `spatial_attn_idx`
+    where the full step entered the shallow up blocks.
+
+    A cache belongs to one denoising loop, [`OotdPipeline`] makes a new one for every call.
+
+    Args:
+        interval (`int`):
+            A full step every `interval` steps, 1 runs every step in full.
+        depth (`int`, *optional*, defaults to 1):
+            Number of down and up blocks run on the cheap steps, from the outside of the UNet.
+    """
+
+    def __init__(self, interval: int, depth: int = 1):
+        self.interval = interval
+        self.depth = depth
+        self.reuse = False
+        self.num_full_steps = 0
+        self.clear()
+
+    def schedule(self, step_index: int) -> bool:
+        r"""
+        Whether step `step_index` reuses the kept features, the first step of the loop is always a full one.
+        """
+        self.reuse = self.sample is not None and step_index % self.interval != 0
+        if not self.reuse:
+            self.num_full_steps += 1
+        return self.reuse
+
+    def store(self, sample: torch.FloatTensor, spatial_attn_idx: int):
+        self.sample = sample
+        self.spatial_attn_idx = spatial_attn_idx
+
+    def cached_sample(self, batch_size: int) -> torch.FloatTensor:
+        r"""
+        The kept features for a batch of `batch_size`, the conditional half once the guidance has stopped.
+        """
+        return self.sample[:batch_size]
+
+    def clear(self):
+        self.sample = None
+        self.spatial_attn_idx = None
@@ -14,11 +14,13 @@
 
 # Modified by Yuhao Xu for OOTDiffusion (https://github.com/levihsu/OOTDiffusion)
 import inspect
+import math
 from typing import Any, Callable, Dict, List, Optional, Union
 
 import numpy as np
 import PIL.Image
 import torch
+import torch.nn.functional as F
 from packaging import version
 from transformers import CLIPImageProcessor, CLIPTextModel, CLIPTokenizer
 
@@ -26,6 +28,9 @@ from transformers import AutoProcessor, CLIPVisionModelWithProjection
 
 from .unet_vton_2d_condition import UNetVton2DConditionModel
 from .unet_garm_2d_condition import UNetGarm2DConditionModel
+from .attention_vton import SpatialAttnBuffers
+from .repaint import RepaintBlender
+from .deep_cache import DeepCache
 
 from diffusers.configuration_utils import FrozenDict
 from diffusers.image_processor import PipelineImageInput, VaeImageProcessor
@@ -99,7 +104,7 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
     model_cpu_offload_seq = "text_encoder->unet->vae"
     _optional_components = ["safety_checker", "feature_extractor"]
     _exclude_from_cpu_offload = ["safety_checker"]
-    _callback_tensor_inputs = ["latents", "prompt_embeds", "vton_latents"]
+    _callback_tensor_inputs = ["latents", "prompt_embeds", "vton_latents", "pred_original_sample"]
 
     def __init__(
         self,
@@ -163,6 +168,16 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         latents: Optional[torch.FloatTensor] = None,
         prompt_embeds: Optional[torch.FloatTensor] = None,
         negative_prompt_embeds: Optional[torch.FloatTensor] = None,
+        spatial_attn_outputs: Optional[List[torch.FloatTensor]] = None,
+        image_ori_latents: Optional[torch.FloatTensor] = None,
+        crop_to_mask: bool = False,
+        crop_margin: int = 8,
+        guidance_stop_fraction: float = 1.0,
+        guidance_stop_threshold: Optional[float] = None,
+        deep_cache_interval: int = 1,
+        deep_cache_depth: int = 1,
+        init_latents: Optional[torch.FloatTensor] = None,
+        strength: float = 1.0,
         output_type: Optional[str] = "pil",
         return_dict: bool = True,
         callback_on_step_end: Optional[Callable[[int, int, Dict], None]] = None,
@@ -178,6 +193,9 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
             image (`torch.FloatTensor` `np.ndarray`, `PIL.Image.Image`, `List[torch.FloatTensor]`, `List[PIL.Image.Image]`, or `List[np.ndarray]`):
                 `Image` or tensor representing an image batch to be repainted according to `prompt`. Can also accept
                 image latents as `image`, but if passing latents directly it is not encoded again.
+            image_vton, image_ori (`PIL.Image.Image` or `torch.FloatTensor`):
+                The masked person picture and the original one. Either both pictures or both VAE latents (see
+                [`~OotdPipeline.encode_image`]), in which case they are not encoded again.
             num_inference_steps (`int`, *optional*, defaults to 100):
                 The number of denoising steps. More denoising steps usually lead to a higher quality image at the
                 expense of slower inference.
@@ -210,6 +228,37 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
             negative_prompt_embeds (`torch.FloatTensor`, *optional*):
                 Pre-generated negative text embeddings. Can be used to easily tweak text inputs (prompt weighting). If
                 not provided, `negative_prompt_embeds` are generated from the `negative_prompt` input argument.
+            spatial_attn_outputs (`List[torch.FloatTensor]`, *optional*):
+                Pre-computed garment features of `unet_garm`, already expanded to the batch of the denoising loop
+                (see [`~OotdPipeline.encode_garment`]). If provided, `image_garm` is not encoded and `unet_garm` is
+                not run.
+            image_ori_latents (`torch.FloatTensor`, *optional*):
+                VAE latents of `image_ori`, for a caller that already encoded the original picture. If provided,
+                `image_ori` is not encoded.
+            crop_to_mask (`bool`, *optional*, defaults to `False`):
+                Whether to run `unet_vton` only on the bounding box of the mask, grown by `crop_margin`, and paste the
+                result back into the frame. The region outside the mask is the original picture in any case, but the
+                UNet then sees less of its context, so the result differs slightly from a full frame run.
+            crop_margin (`int`, *optional*, defaults to 8):
+                Context around the mask when `crop_to_mask` is set, in latent pixels (8 picture pixels each).
+            guidance_stop_fraction (`float`, *optional*, defaults to 1.0):
+                Share of the steps that use classifier free guidance. The later steps only run the conditional branch,
+                at half the batch of `unet_vton`.
+            guidance_stop_threshold (`float`, *optional*):
+                Also stop the guidance after the first step where the difference between the conditional and the
+                unconditional noise predictions, relative to the conditional one, falls below this norm ratio.
+            deep_cache_interval (`int`, *optional*, defaults to 1):
+                Run `unet_vton` in full every `deep_cache_interval` steps only (see [`DeepCache`]). The steps in between
+                reuse the deep features of the last full step and only run the outer blocks. 1 runs every step in full.
+            deep_cache_depth (`int`, *optional*, defaults to 1):
+                Number of down and up blocks of `unet_vton` run on the steps that reuse the deep features.
+            init_latents (`torch.FloatTensor`, *optional*):
+                Denoised latents to start from instead of pure noise, for example the `"latent"` output of a low
+                resolution run. They are resized to the latents of `image_vton` if needed, and noised to the first
+                step kept by `strength`. One per generated image.
+            strength (`float`, *optional*, defaults to 1.0):
+                Share of the `num_inference_steps` steps run from `init_latents`, the noisiest ones are skipped.
+                Ignored without `init_latents`.
             output_type (`str`, *optional*, defaults to `"pil"`):
                 The output format of the generated image. Choose between `PIL.Image` or `np.array`.
             return_dict (`bool`, *optional*, defaults to `True`):
@@ -223,7 +272,8 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
             callback_on_step_end_tensor_inputs (`List`, *optional*):
                 The list of tensor inputs for the `callback_on_step_end` function. The tensors specified in the list
                 will be passed as `callback_kwargs` argument. You will only be able to include variables listed in the
-                `._callback_tensor_inputs` attribute of your pipeline class.
+                `._callback_tensor_inputs` attribute of your pipeline class. `"pred_original_sample"` is the denoised
+                latents that the guided prediction of the step points to, before the scheduler step.
 
         Returns:
             [`~pipelines.stable_diffusion.StableDiffusionPipelineOutput`] or `tuple`:
@@ -261,7 +311,7 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         self._guidance_scale = guidance_scale
         self._image_guidance_scale = image_guidance_scale
 
-        if (image_vton is None) or (image_garm is None):
+        if (image_vton is None) or (image_garm is None and spatial_attn_outputs is None):
             raise ValueError("`image` input cannot be undefined.")
 
         # 1. Define call parameters
@@ -274,7 +324,7 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
 
         device = self._execution_device
         # check if scheduler is in sigmas space
-        scheduler_is_in_sigma_space = hasattr(self.scheduler, "sigmas")
+        scheduler_is_in_sigma_space = self.scheduler_is_in_sigma_space()
 
         # 2. Encode input prompt
         prompt_embeds = self._encode_prompt(
@@ -288,9 +338,11 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         )
 
         # 3. Preprocess image
-        image_garm = self.image_processor.preprocess(image_garm)
+        if spatial_attn_outputs is None:
+            image_garm = self.image_processor.preprocess(image_garm)
         image_vton = self.image_processor.preprocess(image_vton)
-        image_ori = self.image_processor.preprocess(image_ori)
+        if image_ori_latents is None:
+            image_ori = self.image_processor.preprocess(image_ori)
         mask = np.array(mask)
         mask[mask < 127] = 0
         mask[mask >= 127] = 255
@@ -301,17 +353,26 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         # 4. set timesteps
         self.scheduler.set_timesteps(num_inference_steps, device=device)
         timesteps = self.scheduler.timesteps
+        if init_latents is not None:
+            num_steps_run = min(int(num_inference_steps * strength), num_inference_steps)
+            if num_steps_run < 1:
+                raise ValueError(
+                    f"`strength` {strength} leaves no step out of the {num_inference_steps} steps, it has to be"
+                    f" at least {1 / num_inference_steps}."
+                )
+            timesteps = timesteps[(num_inference_steps - num_steps_run) * self.scheduler.order :]
 
         # 5. Prepare Image latents
-        garm_latents = self.prepare_garm_latents(
-            image_garm,
-            batch_size,
-            num_images_per_prompt,
-            prompt_embeds.dtype,
-            device,
-            self.do_classifier_free_guidance,
-            generator,
-        )
+        if spatial_attn_outputs is None:
+            garm_latents = self.prepare_garm_latents(
+                image_garm,
+                batch_size,
+                num_images_per_prompt,
+                prompt_embeds.dtype,
+                device,
+                self.do_classifier_free_guidance,
+                generator,
+            )
 
         vton_latents, mask_latents, image_ori_latents = self.prepare_vton_latents(
             image_vton,
@@ -323,6 +384,7 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
             device,
             self.do_classifier_free_guidance,
             generator,
+            image_ori_latents,
         )
 
         height, width = vton_latents.shape[-2:]
@@ -342,7 +404,23 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
             latents,
         )
 
-        noise = latents.clone()
+        # Unit variance noise, prepare_latents scaled it by the init_noise_sigma of sigma space schedulers
+        noise = latents / self.scheduler.init_noise_sigma
+
+        if init_latents is not None:
+            # Start from init_latents noised to the first step kept
+            init_latents = init_latents.to(device=device, dtype=latents.dtype)
+            if init_latents.shape[-2:] != latents.shape[-2:]:
+                init_latents = F.interpolate(
+                    init_latents, size=latents.shape[-2:], mode="bilinear", align_corners=False
+                )
+            latents = self.scheduler.add_noise(init_latents, noise, timesteps[:1].repeat(latents.shape[0]))
+
+        # The original picture noised for every step, outside the mask
+        self._repaint_blender = RepaintBlender.from_pipeline(self, image_ori_latents, noise, mask_latents, timesteps)
+
+        # Region of the latents the UNet runs on, None for the whole frame
+        region = self.mask_region(mask_latents, crop_margin) if crop_to_mask else None
 
         # 8. Prepare extra step kwargs. TODO: Logic should ideally just be moved out of the pipeline
         extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
@@ -351,23 +429,56 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
         self._num_timesteps = len(timesteps)
 
-        _, spatial_attn_outputs = self.unet_garm(
-            garm_latents,
-            0,
-            encoder_hidden_states=prompt_embeds,
-            return_dict=False,
-        )
+        if spatial_attn_outputs is None:
+            _, spatial_attn_outputs = self.unet_garm(
+                garm_latents,
+                0,
+                encoder_hidden_states=prompt_embeds,
+                return_dict=False,
+            )
+        # The garment half of every spatial attention input is written once, at the first step
+        spatial_attn_inputs = SpatialAttnBuffers(spatial_attn_outputs)
+
+        do_classifier_free_guidance = self.do_classifier_free_guidance
+        guidance_stop_step = math.ceil(guidance_stop_fraction * len(timesteps))
+        self._num_guided_steps = 0
+
+        # Deep features of unet_vton kept across the steps, for this call only
+        if deep_cache_interval > 1:
+            if not 0 < deep_cache_depth < len(self.unet_vton.down_blocks):
+                raise ValueError(
+                    f"`deep_cache_depth` has to be between 1 and {len(self.unet_vton.down_blocks) - 1} but is"
+                    f" {deep_cache_depth}."
+                )
+            self._deep_cache = DeepCache(deep_cache_interval, deep_cache_depth)
+        else:
+            self._deep_cache = None
 
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
-                latent_model_input = torch.cat([latents] * 2) if self.do_classifier_free_guidance else latents
+                if do_classifier_free_guidance and i >= guidance_stop_step:
+                    # Single branch from here on, keep the conditional half of every batched input
+                    do_classifier_free_guidance = False
+                    prompt_embeds = prompt_embeds[: latents.shape[0]]
+                    vton_latents = vton_latents[: latents.shape[0]]
+                    spatial_attn_inputs = spatial_attn_inputs.head(latents.shape[0])
+
+                if region is None:
+                    region_latents, region_vton_latents = latents, vton_latents
+                else:
+                    region_latents = latents[..., region[0], region[1]]
+                    region_vton_latents = vton_latents[..., region[0], region[1]]
+                latent_model_input = (
+                    torch.cat([region_latents] * 2) if do_classifier_free_guidance else region_latents
+                )
 
                 # concat latents, image_latents in the channel dimension
                 scaled_latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
-                latent_vton_model_input = torch.cat([scaled_latent_model_input, vton_latents], dim=1)
+                latent_vton_model_input = torch.cat([scaled_latent_model_input, region_vton_latents], dim=1)
                 # latent_vton_model_input = scaled_latent_model_input + vton_latents
 
-                spatial_attn_inputs = spatial_attn_outputs.copy()
+                if self.deep_cache is not None:
+                    self.deep_cache.schedule(i)
 
                 # predict the noise residual
                 noise_pred = self.unet_vton(
@@ -376,6 +487,7 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
                     t,
                     encoder_hidden_states=prompt_embeds,
                     return_dict=False,
+                    deep_cache=self.deep_cache,
                 )[0]
 
                 # Hack:
@@ -383,17 +495,39 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
                 # predicted_original_sample instead of the noise_pred. So we need to compute the
                 # predicted_original_sample here if we are using a karras style scheduler.
                 if scheduler_is_in_sigma_space:
-                    step_index = (self.scheduler.timesteps == t).nonzero()[0].item()
+                    # Schedulers that count their steps know the index, also when timesteps repeat
+                    step_index = getattr(self.scheduler, "step_index", None)
+                    if step_index is None:
+                        step_index = (self.scheduler.timesteps == t).nonzero()[0].item()
                     sigma = self.scheduler.sigmas[step_index]
                     noise_pred = latent_model_input - sigma * noise_pred
 
                 # perform guidance
-                if self.do_classifier_free_guidance:
+                if do_classifier_free_guidance:
                     noise_pred_text_image, noise_pred_text = noise_pred.chunk(2)
-                    noise_pred = (
-                        noise_pred_text
-                        + self.image_guidance_scale * (noise_pred_text_image - noise_pred_text)
+                    noise_pred_delta = noise_pred_text_image - noise_pred_text
+                    noise_pred = noise_pred_text + self.image_guidance_scale * noise_pred_delta
+                    self._num_guided_steps += 1
+
+                    if guidance_stop_threshold is not None:
+                        # Relative to the conditional noise, which is sigma times noise in sigma space
+                        if scheduler_is_in_sigma_space:
+                            noise_pred_cond = region_latents - noise_pred_text_image
+                        else:
+                            noise_pred_cond = noise_pred_text_image
+                        ratio = noise_pred_delta.norm() / noise_pred_cond.norm()
+                        if ratio.item() < guidance_stop_threshold:
+                            guidance_stop_step = i + 1
+
+                if callback_on_step_end is not None and "pred_original_sample" in callback_on_step_end_tensor_inputs:
+                    pred_original_sample = self.predict_original_sample(
+                        noise_pred, region_latents, t, scheduler_is_in_sigma_space
                     )
+                    if region is not None:
+                        # The frame outside the region keeps its current latents
+                        region_pred_original_sample = pred_original_sample
+                        pred_original_sample = latents.clone()
+                        pred_original_sample[..., region[0], region[1]] = region_pred_original_sample
 
                 # Hack:
                 # For karras style schedulers the model does classifer free guidance using the
@@ -402,21 +536,21 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
                 # need to overwrite the noise_pred here such that the value of the computed
                 # predicted_original_sample is correct.
                 if scheduler_is_in_sigma_space:
-                    noise_pred = (noise_pred - latents) / (-sigma)
+                    noise_pred = (noise_pred - region_latents) / (-sigma)
 
                 # compute the previous noisy sample x_t -> x_t-1
-                latents = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs, return_dict=False)[0]
-
-                init_latents_proper = image_ori_latents * self.vae.config.scaling_factor
+                region_latents = self.scheduler.step(
+                    noise_pred, t, region_latents, **extra_step_kwargs, return_dict=False
+                )[0]
+                if region is None:
+                    latents = region_latents
+                else:
+                    # Not in place, the scheduler may keep the previous sample, a view of `latents`
+                    latents = latents.clone()
+                    latents[..., region[0], region[1]] = region_latents
 
                 # repainting
-                if i < len(timesteps) - 1:
-                    noise_timestep = timesteps[i + 1]
-                    init_latents_proper = self.scheduler.add_noise(
-                        init_latents_proper, noise, torch.tensor([noise_timestep])
-                    )
-
-                latents = (1 - mask_latents) * init_latents_proper + mask_latents * latents
+                latents = self.repaint_blender.blend(latents, i)
 
                 if callback_on_step_end is not None:
                     callback_kwargs = {}
@@ -620,6 +754,32 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
             extra_step_kwargs["generator"] = generator
         return extra_step_kwargs
 
+    def scheduler_is_in_sigma_space(self):
+        """
+        Whether the latents of the scheduler are x0 + sigma * noise, as for the Euler schedulers, rather than
+        variance preserving. Those start from noise scaled by an `init_noise_sigma` above 1. UniPC and
+        DPM-Solver also get `sigmas` in set_timesteps, so the attribute alone would change after their first run.
+        """
+        return float(self.scheduler.init_noise_sigma) > 1
+
+    def predict_original_sample(self, model_output, sample, timestep, in_sigma_space):
+        """
+        The denoised latents x0 that the guided `model_output` of a step points to, from the noisy `sample` x_t.
+        For the variance preserving schedulers (UniPC, DPM-Solver, DDIM) it comes from `alphas_cumprod`, also when
+        they have `sigmas`, see scheduler_is_in_sigma_space.
+        """
+        if in_sigma_space:
+            # Latents x0 + sigma * noise, the sigma space hack of the loop already turned the prediction into x0
+            return model_output
+        alpha_prod_t = self.scheduler.alphas_cumprod[int(timestep)].to(sample.device, sample.dtype)
+        beta_prod_t = 1 - alpha_prod_t
+        prediction_type = self.scheduler.config.prediction_type
+        if prediction_type == "sample":
+            return model_output
+        if prediction_type == "v_prediction":
+            return alpha_prod_t**0.5 * sample - beta_prod_t**0.5 * model_output
+        return (sample - beta_prod_t**0.5 * model_output) / alpha_prod_t**0.5
+
     # Copied from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion.StableDiffusionPipeline.decode_latents
     def decode_latents(self, latents):
         deprecation_message = "The decode_latents method is deprecated and will be removed in 1.0.0. Please use VaeImageProcessor.postprocess(...) instead"
@@ -698,6 +858,111 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         latents = latents * self.scheduler.init_noise_sigma
         return latents
 
+    def mask_region(self, mask_latents: torch.FloatTensor, margin: int):
+        r"""
+        The bounding box of `mask_latents` over the whole batch, grown by `margin` and aligned for the downsampling of
+        `unet_vton`, as a pair of slices of the latents. None when the mask is empty or the box is the whole frame.
+        """
+        height, width = mask_latents.shape[-2:]
+        rows = (mask_latents.amax(dim=(0, 1, 3)) > 0).nonzero()
+        columns = (mask_latents.amax(dim=(0, 1, 2)) > 0).nonzero()
+        if len(rows) == 0:
+            return None
+
+        align = 2 ** self.unet_vton.num_upsamplers
+        top = max(0, (rows[0].item() - margin) // align * align)
+        bottom = min(height, -(-(rows[-1].item() + 1 + margin) // align) * align)
+        left = max(0, (columns[0].item() - margin) // align * align)
+        right = min(width, -(-(columns[-1].item() + 1 + margin) // align) * align)
+        if (bottom - top, right - left) == (height, width):
+            return None
+        return slice(top, bottom), slice(left, right)
+
+    @torch.no_grad()
+    def encode_image(self, image: PipelineImageInput):
+        r"""
+        Encode a person picture into the VAE latents that `image_vton` and `image_ori` accept.
+        """
+        device = self._execution_device
+        image = self.image_processor.preprocess(image).to(device=device, dtype=self.vae.dtype)
+        return self.vae.encode(image).latent_dist.mode()
+
+    @torch.no_grad()
+    def encode_garment(
+        self,
+        image_garm: PipelineImageInput,
+        prompt_embeds: torch.FloatTensor,
+        uncond_spatial_attn_outputs: Optional[List[torch.FloatTensor]] = None,
+    ):
+        r"""
+        Run the garment branch for one or several garments, independently of the denoising loop.
+
+        `unet_garm` is only evaluated at timestep 0, so its features depend on nothing but the garment picture and
+        `prompt_embeds`, and can be reused across try-ons of the same garment.
+
+        Args:
+            image_garm (`PIL.Image.Image`, `List[PIL.Image.Image]` or `torch.FloatTensor`):
+                The garment pictures.
+            prompt_embeds (`torch.FloatTensor`):
+                The garment embeddings of shape `(num_garments, seq_len, dim)`.
+            uncond_spatial_attn_outputs (`List[torch.FloatTensor]`, *optional*):
+                Features of the empty garment for every garment (see [`~OotdPipeline.encode_empty_garment`]). If
+                provided, `unet_garm` only runs on the garments and these are used for classifier free guidance.
+
+        Returns:
+            `tuple`: The VAE latents of the garments, and the `spatial_attn_outputs` of `unet_garm` for a batch of
+            `2 * num_garments`: the garments first, then the empty garments used for classifier free guidance.
+        """
+        device = self._execution_device
+        num_garments = prompt_embeds.shape[0]
+        do_classifier_free_guidance = uncond_spatial_attn_outputs is None
+
+        prompt_embeds = prompt_embeds.to(dtype=self.text_encoder.dtype, device=device)
+        if do_classifier_free_guidance:
+            prompt_embeds = torch.cat([prompt_embeds, prompt_embeds])
+
+        image_garm = self.image_processor.preprocess(image_garm)
+        garm_latents = self.prepare_garm_latents(
+            image_garm, num_garments, 1, prompt_embeds.dtype, device, do_classifier_free_guidance
+        )
+
+        _, spatial_attn_outputs = self.unet_garm(
+            garm_latents,
+            0,
+            encoder_hidden_states=prompt_embeds,
+            return_dict=False,
+        )
+        if not do_classifier_free_guidance:
+            spatial_attn_outputs = [
+                torch.cat([features, uncond_features])
+                for features, uncond_features in zip(spatial_attn_outputs, uncond_spatial_attn_outputs)
+            ]
+        return garm_latents[:num_garments], spatial_attn_outputs
+
+    @torch.no_grad()
+    def encode_empty_garment(self, height: int, width: int, prompt_embeds: torch.FloatTensor):
+        r"""
+        Run `unet_garm` on the empty garment of classifier free guidance, all-zero latents of a `height` x `width`
+        picture, with `prompt_embeds` of shape `(1, seq_len, dim)`.
+
+        Returns:
+            `List[torch.FloatTensor]`: The `spatial_attn_outputs` of `unet_garm`, for a batch of 1.
+        """
+        device = self._execution_device
+        prompt_embeds = prompt_embeds.to(dtype=self.text_encoder.dtype, device=device)
+        garm_latents = torch.zeros(
+            (1, self.vae.config.latent_channels, height // self.vae_scale_factor, width // self.vae_scale_factor),
+            dtype=prompt_embeds.dtype,
+            device=device,
+        )
+        _, spatial_attn_outputs = self.unet_garm(
+            garm_latents,
+            0,
+            encoder_hidden_states=prompt_embeds,
+            return_dict=False,
+        )
+        return spatial_attn_outputs
+
     def prepare_garm_latents(
         self, image, batch_size, num_images_per_prompt, dtype, device, do_classifier_free_guidance, generator=None
     ):
@@ -713,17 +978,8 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         if image.shape[1] == 4:
             image_latents = image
         else:
-            if isinstance(generator, list) and len(generator) != batch_size:
-                raise ValueError(
-                    f"You have passed a list of generators of length {len(generator)}, but requested an effective batch"
-                    f" size of {batch_size}. Make sure the batch size matches the length of the generators."
-                )
-
-            if isinstance(generator, list):
-                image_latents = [self.vae.encode(image[i : i + 1]).latent_dist.mode() for i in range(batch_size)]
-                image_latents = torch.cat(image_latents, dim=0)
-            else:
-                image_latents = self.vae.encode(image).latent_dist.mode()
+            # Mode of the distribution, the same for every generator of a list
+            image_latents = self.vae.encode(image).latent_dist.mode()
 
         if batch_size > image_latents.shape[0] and batch_size % image_latents.shape[0] == 0:
             additional_image_per_prompt = batch_size // image_latents.shape[0]
@@ -742,7 +998,8 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         return image_latents
     
     def prepare_vton_latents(
-        self, image, mask, image_ori, batch_size, num_images_per_prompt, dtype, device, do_classifier_free_guidance, generator=None
+        self, image, mask, image_ori, batch_size, num_images_per_prompt, dtype, device, do_classifier_free_guidance, generator=None,
+        image_ori_latents=None,
     ):
         if not isinstance(image, (torch.Tensor, PIL.Image.Image, list)):
             raise ValueError(
@@ -750,28 +1007,25 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
             )
 
         image = image.to(device=device, dtype=dtype)
-        image_ori = image_ori.to(device=device, dtype=dtype)
+        if image_ori_latents is not None:
+            image_ori_latents = image_ori_latents.to(device=device, dtype=dtype)
+        else:
+            image_ori = image_ori.to(device=device, dtype=dtype)
 
         batch_size = batch_size * num_images_per_prompt
 
         if image.shape[1] == 4:
             image_latents = image
-            image_ori_latents = image_ori
+            if image_ori_latents is None:
+                image_ori_latents = image_ori
+        elif image_ori_latents is not None:
+            image_latents = self.vae.encode(image).latent_dist.mode()
         else:
-            if isinstance(generator, list) and len(generator) != batch_size:
-                raise ValueError(
-                    f"You have passed a list of generators of length {len(generator)}, but requested an effective batch"
-                    f" size of {batch_size}. Make sure the batch size matches the length of the generators."
-                )
-
-            if isinstance(generator, list):
-                image_latents = [self.vae.encode(image[i : i + 1]).latent_dist.mode() for i in range(batch_size)]
-                image_latents = torch.cat(image_latents, dim=0)
-                image_ori_latents = [self.vae.encode(image_ori[i : i + 1]).latent_dist.mode() for i in range(batch_size)]
-                image_ori_latents = torch.cat(image_ori_latents, dim=0)
-            else:
-                image_latents = self.vae.encode(image).latent_dist.mode()
-                image_ori_latents = self.vae.encode(image_ori).latent_dist.mode()
+            # The masked and the original pictures go through the encoder in one batch. The latents are the
+            # mode of the distribution, so a list of generators (checked by prepare_latents) needs no
+            # per-sample encode either.
+            latents = self.vae.encode(torch.cat([image, image_ori], dim=0)).latent_dist.mode()
+            image_latents, image_ori_latents = latents.split([image.shape[0], image_ori.shape[0]], dim=0)
 
         mask = torch.nn.functional.interpolate(
             mask, size=(image_latents.size(-2), image_latents.size(-1))
@@ -834,6 +1088,18 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
     def image_guidance_scale(self):
         return self._image_guidance_scale
 
+    @property
+    def repaint_blender(self):
+        return self._repaint_blender
+
+    @property
+    def deep_cache(self):
+        return self._deep_cache
+
+    @property
+    def num_guided_steps(self):
+        return self._num_guided_steps
+
     @property
     def num_timesteps(self):
         return self._num_timesteps
@@ -0,0 +1,68 @@
+from typing import Optional
+
+import torch
+
+
+class RepaintBlender:
+    r"""
+    Repainting of the inpainting loop: after every step, the latents outside the mask are replaced by the original
+    picture noised to the next timestep, and by the original itself after the last step.
+
+    All the noised originals are computed in one batched `add_noise` call when the blender is created, and kept on the
+    device of the latents. [`~RepaintBlender.blend`] is then a single in-place op per step.
+
+    Args:
+        scheduler:
+            The scheduler of the loop, for its `add_noise`.
+        image_latents (`torch.FloatTensor`):
+            The latents of the original picture, already multiplied by the VAE scaling factor.
+        noise (`torch.FloatTensor`):
+            The noise of the original, the initial latents of the loop.
+        mask (`torch.FloatTensor`):
+            The mask in latent resolution, 1 where the loop generates and 0 where the original is kept.
+        timesteps (`torch.Tensor`):
+            The timesteps of the loop, in order.
+    """
+
+    def __init__(self, scheduler, image_latents, noise, mask, timesteps):
+        num_steps = len(timesteps)
+        batch_size = image_latents.shape[0]
+        # The VAE may give channels last latents, the blend keeps the layout of the loop's latents
+        image_latents = image_latents.contiguous()
+        targets = image_latents.expand(num_steps, *image_latents.shape).clone()
+        if num_steps > 1:
+            # Step i blends with the original at timestep i + 1, batched as one sample per (step, image)
+            noised = scheduler.add_noise(
+                image_latents.repeat(num_steps - 1, 1, 1, 1),
+                noise.repeat(num_steps - 1, 1, 1, 1),
+                timesteps[1:].repeat_interleave(batch_size),
+            )
+            targets[:-1] = noised.view(num_steps - 1, *image_latents.shape)
+
+        self.mask = mask
+        # The noised originals, what the callbacks and custom loops may want to look at
+        self.targets = targets
+        # (1 - mask) * targets, so that the blend is a single multiply-add
+        self.masked_targets = (1 - mask) * targets
+
+    @classmethod
+    def from_pipeline(cls, pipe, image_ori_latents, noise, mask_latents, timesteps=None):
+        r"""
+        A blender for the loop of `pipe`, on the timesteps of its scheduler unless `timesteps` are given.
+        """
+        timesteps = pipe.scheduler.timesteps if timesteps is None else timesteps
+        return cls(pipe.scheduler, image_ori_latents * pipe.vae.config.scaling_factor, noise, mask_latents, timesteps)
+
+    def target(self, step_index: int) -> torch.FloatTensor:
+        r"""
+        The original picture noised for the blend after step `step_index`.
+        """
+        return self.targets[step_index]
+
+    def blend(self, latents: torch.FloatTensor, step_index: int, out: Optional[torch.FloatTensor] = None):
+        r"""
+        `(1 - mask) * target + mask * latents` for the blend after step `step_index`, in place in `latents` unless
+        `out` is given.
+        """
+        out = latents if out is None else out
+        return torch.addcmul(self.masked_targets[step_index], latents, self.mask, out=out)
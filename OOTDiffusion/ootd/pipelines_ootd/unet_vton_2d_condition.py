@@ -20,6 +20,7 @@ import torch
 import torch.nn as nn
 import torch.utils.checkpoint
 
+from .deep_cache import DeepCache
 from .unet_vton_2d_blocks import (
     UNetMidBlock2D,
     UNetMidBlock2DCrossAttn,
@@ -820,6 +821,7 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
         down_intrablock_additional_residuals: Optional[Tuple[torch.Tensor]] = None,
         encoder_attention_mask: Optional[torch.Tensor] = None,
         return_dict: bool = True,
+        deep_cache: Optional[DeepCache] = None,
     ) -> Union[UNet2DConditionOutput, Tuple]:
         r"""
         The [`UNet2DConditionModel`] forward method.
@@ -869,6 +871,9 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
                 additional residual to be added to UNet mid block output, for example from ControlNet side model
             down_intrablock_additional_residuals (`tuple` of `torch.Tensor`, *optional*):
                 additional residuals to be added within UNet down blocks, for example from T2I-Adapter side model(s)
+            deep_cache (`DeepCache`, *optional*):
+                Deep features kept across the denoising steps. When its current step reuses them, only the outer
+                `deep_cache.depth` down and up blocks are run, otherwise the features are kept for the next steps.
 
         Returns:
             [`~models.unet_2d_condition.UNet2DConditionOutput`] or `tuple`:
@@ -1069,8 +1074,13 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
             down_intrablock_additional_residuals = down_block_additional_residuals
             is_adapter = True
 
+        # Cheap step of the deep cache: only the outer blocks run, around the kept deep features
+        reuse_deep_features = deep_cache is not None and deep_cache.reuse
+        down_blocks = self.down_blocks[: deep_cache.depth] if reuse_deep_features else self.down_blocks
+        first_up_block = len(self.up_blocks) - deep_cache.depth if deep_cache is not None else 0
+
         down_block_res_samples = (sample,)
-        for downsample_block in self.down_blocks:
+        for downsample_block in down_blocks:
             if hasattr(downsample_block, "has_cross_attention") and downsample_block.has_cross_attention:
                 # For t2i-adapter CrossAttnDownBlock2D
                 additional_residuals = {}
@@ -1107,7 +1117,12 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
             down_block_res_samples = new_down_block_res_samples
 
         # 4. mid
-        if self.mid_block is not None:
+        if reuse_deep_features:
+            num_res_samples = sum(len(upsample_block.resnets) for upsample_block in self.up_blocks[first_up_block:])
+            down_block_res_samples = down_block_res_samples[:num_res_samples]
+            sample = deep_cache.cached_sample(sample.shape[0])
+            spatial_attn_idx = deep_cache.spatial_attn_idx
+        elif self.mid_block is not None:
             if hasattr(self.mid_block, "has_cross_attention") and self.mid_block.has_cross_attention:
                 sample, spatial_attn_inputs, spatial_attn_idx = self.mid_block(
                     sample,
@@ -1130,13 +1145,17 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
             ):
                 sample += down_intrablock_additional_residuals.pop(0)
 
-        if is_controlnet:
+        if is_controlnet and not reuse_deep_features:
             sample = sample + mid_block_additional_residual
 
         # 5. up
-        for i, upsample_block in enumerate(self.up_blocks):
+        up_blocks = self.up_blocks[first_up_block:] if reuse_deep_features else self.up_blocks
+        for i, upsample_block in enumerate(up_blocks, start=len(self.up_blocks) - len(up_blocks)):
             is_final_block = i == len(self.up_blocks) - 1
 
+            if deep_cache is not None and not reuse_deep_features and i == first_up_block:
+                deep_cache.store(sample, spatial_attn_idx)
+
             res_samples = down_block_res_samples[-len(upsample_block.resnets) :]
             down_block_res_samples = down_block_res_samples[: -len(upsample_block.resnets)]
 
@@ -0,0 +1,171 @@
+import time
+
+import torch
+from PIL import Image
+
+
+# Picture size of the preview pass, half the 768x1024 of the models in each direction
+PREVIEW_SIZE = (384, 512)
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+class Timer:
+    """
+    Wall times of the named phases of a try-on, in seconds, waiting for the
+    device at every boundary so that the kernels count in their own phase.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.timings = {}
+        synchronize(device)
+        self.start_time = self.last_time = time.time()
+
+    def lap(self, name):
+        synchronize(self.device)
+        now = time.time()
+        self.timings[name] = now - self.last_time
+        self.last_time = now
+
+    def stop(self):
+        self.timings["total"] = self.last_time - self.start_time
+        return self.timings
+
+
+class TryOnPreview:
+    """
+    A low resolution try-on and what its refine reuses: the garment features,
+    the denoised latents and the seed. `person` holds the full resolution
+    PreparedPerson (run/tryon_service.py) of callers that keep it with the preview.
+    """
+
+    def __init__(self, model_type, category, images, latents, garment, seed, image_scale, timings, person=None):
+        self.model_type = model_type
+        self.category = category
+        self.images = images
+        # Denoised latents of the preview, already multiplied by the VAE scaling factor
+        self.latents = latents
+        self.garment = garment
+        self.seed = seed
+        self.image_scale = image_scale
+        self.timings = timings
+        self.person = person
+
+    @property
+    def num_samples(self):
+        return self.latents.shape[0]
+
+
+def decode(pipe, latents):
+    image = pipe.vae.decode(latents / pipe.vae.config.scaling_factor, return_dict=False)[0]
+    return pipe.image_processor.postprocess(image, output_type="pil")
+
+
+def render_preview(model,
+                   model_type='hd',
+                   category='upperbody',
+                   image_garm=None,
+                   image_vton=None,
+                   mask=None,
+                   image_ori=None,
+                   num_samples=1,
+                   num_steps=8,
+                   image_scale=1.0,
+                   seed=0,
+                   size=PREVIEW_SIZE,
+                   deep_cache_interval=1,
+                   deep_cache_depth=1,
+):
+    """
+    Try the garment on the person at `size` with few steps.
+
+    The person pictures and the mask are full resolution pictures, resized here.
+    The garment is encoded at its own resolution, once for both phases: the
+    spatial attention of the preview attends over all of its tokens.
+
+    Returns:
+    TryOnPreview: The preview pictures, with timings of the garment encoding,
+    the denoising loop and the decoding.
+    """
+    pipe = model.pipe
+    timer = Timer(pipe._execution_device)
+
+    garment = model.encode_garment(model_type, category, image_garm)
+    timer.lap("garment")
+
+    latents = pipe(prompt_embeds=garment.prompt_embeds,
+                   spatial_attn_outputs=garment.expand(num_samples, image_scale >= 1.0),
+                   image_vton=image_vton.resize(size),
+                   mask=mask.resize(size, Image.NEAREST),
+                   image_ori=image_ori.resize(size),
+                   num_inference_steps=num_steps,
+                   image_guidance_scale=image_scale,
+                   num_images_per_prompt=num_samples,
+                   generator=torch.manual_seed(seed),
+                   deep_cache_interval=deep_cache_interval,
+                   deep_cache_depth=deep_cache_depth,
+                   output_type="latent",
+    ).images
+    timer.lap("denoise")
+
+    images = decode(pipe, latents)
+    timer.lap("decode")
+
+    return TryOnPreview(model_type, category, images, latents, garment, seed, image_scale, timer.stop())
+
+
+def refine_preview(model,
+                   preview,
+                   image_vton=None,
+                   mask=None,
+                   image_ori=None,
+                   num_steps=20,
+                   strength=0.6,
+                   image_ori_latents=None,
+                   deep_cache_interval=1,
+                   deep_cache_depth=1,
+):
+    """
+    The full resolution try-on of `preview`, with its garment features and seed.
+
+    With a `strength` below 1, the loop starts from the preview latents,
+    upscaled and noised to the matching step, and runs only that share of
+    `num_steps`. With None or 1, it is a fresh run from noise. The person is
+    given as for a single try-on, pictures or VAE latents.
+
+    Returns:
+    tuple: The PIL images, and the timings of the denoising loop and the decoding.
+    """
+    pipe = model.pipe
+    timer = Timer(pipe._execution_device)
+
+    init_latents = None
+    if strength is not None and strength < 1.0:
+        init_latents = preview.latents
+
+    latents = pipe(prompt_embeds=preview.garment.prompt_embeds,
+                   spatial_attn_outputs=preview.garment.expand(preview.num_samples, preview.image_scale >= 1.0),
+                   image_vton=image_vton,
+                   mask=mask,
+                   image_ori=image_ori,
+                   num_inference_steps=num_steps,
+                   image_guidance_scale=preview.image_scale,
+                   num_images_per_prompt=preview.num_samples,
+                   generator=torch.manual_seed(preview.seed),
+                   image_ori_latents=image_ori_latents,
+                   init_latents=init_latents,
+                   strength=1.0 if strength is None else strength,
+                   deep_cache_interval=deep_cache_interval,
+                   deep_cache_depth=deep_cache_depth,
+                   output_type="latent",
+    ).images
+    timer.lap("denoise")
+
+    images = decode(pipe, latents)
+    timer.lap("decode")
+
+    return images, timer.stop()
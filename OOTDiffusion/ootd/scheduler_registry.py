@@ -0,0 +1,61 @@
+from diffusers import (
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    UniPCMultistepScheduler,
+)
+
+
+# The schedulers a try-on can run with, by name: the scheduler class and the config values
+# it overrides in the config of the checkpoint. UniPC is the one the models were released with.
+SCHEDULERS = {
+    "unipc": (UniPCMultistepScheduler, {}),
+    "dpmpp_2m": (DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++", "solver_order": 2}),
+    "dpmpp_2m_karras": (
+        DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++", "solver_order": 2, "use_karras_sigmas": True}
+    ),
+    "dpmpp_2m_sde": (DPMSolverMultistepScheduler, {"algorithm_type": "sde-dpmsolver++", "solver_order": 2}),
+    "ddim": (DDIMScheduler, {}),
+    "euler": (EulerDiscreteScheduler, {}),
+    "euler_a": (EulerAncestralDiscreteScheduler, {}),
+}
+
+DEFAULT_SCHEDULER = "unipc"
+
+
+def make_scheduler(name, config):
+    """
+    A new scheduler `name` of SCHEDULERS, from the scheduler config of the checkpoint.
+    """
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler '{name}', choose from {', '.join(sorted(SCHEDULERS))}")
+    scheduler_class, overrides = SCHEDULERS[name]
+    return scheduler_class.from_config(config, **overrides)
+
+
+class SchedulerSet:
+    """
+    One scheduler of each name for a pipeline, made on first use. The schedulers
+    keep state within a denoising loop only, so one of each is enough as long as
+    the calls of the pipeline do not overlap.
+    """
+
+    def __init__(self, pipe, default=DEFAULT_SCHEDULER):
+        self.pipe = pipe
+        # The config the pipeline was loaded with, every scheduler derives from it
+        self.config = pipe.scheduler.config
+        self.schedulers = {}
+        self.use(default)
+
+    def get(self, name):
+        if name not in self.schedulers:
+            self.schedulers[name] = make_scheduler(name, self.config)
+        return self.schedulers[name]
+
+    def use(self, name):
+        """
+        Make scheduler `name` the scheduler of the pipeline.
+        """
+        self.pipe.scheduler = self.get(name)
+        return self.pipe.scheduler
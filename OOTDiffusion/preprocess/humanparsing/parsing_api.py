@@ -11,11 +11,16 @@ import cv2
 import torchvision.transforms as transforms
 from torch.utils.data import DataLoader
 from datasets.simple_extractor_dataset import SimpleFolderDataset
-from utils.transforms import transform_logits
+from utils.transforms import upsample_transform_argmax, get_affine_transform
 from tqdm import tqdm
 from PIL import Image
 
 
+# Normalization of the parsing models, in the BGR order of their inputs
+MEAN = np.array([0.406, 0.456, 0.485], dtype=np.float32)
+STD = np.array([0.225, 0.224, 0.229], dtype=np.float32)
+
+
 def get_palette(num_cls):
     """ Returns the color map for visualizing the segmentation mask.
     Args:
@@ -41,7 +46,15 @@ def get_palette(num_cls):
 
 
 def delete_irregular(logits_result):
-    parsing_result = np.argmax(logits_result, axis=2)
+    """
+    Drop the labels that do not fit the worn garment, from HxWxC logits or from
+    a label map such as upsample_transform_argmax gives. Without the logits, the
+    dropped pixels become background instead of their second best class.
+    """
+    if logits_result.ndim == 2:
+        parsing_result = logits_result.copy()
+    else:
+        parsing_result = np.argmax(logits_result, axis=2)
     upper_cloth = np.where(parsing_result == 4, 255, 0)
     contours, hierarchy = cv2.findContours(upper_cloth.astype(np.uint8),
                                            cv2.RETR_CCOMP, cv2.CHAIN_APPROX_TC89_L1)
@@ -69,12 +82,17 @@ def delete_irregular(logits_result):
     if len(area) != 0:
         if len(area_dress) != 0 and cY_dress > cY:
             irregular_list = np.array([4, 5, 6])
-            logits_result[:, :, irregular_list] = -1
+            irregular_rows = slice(None)
         else:
             irregular_list = np.array([5, 6, 7, 8, 9, 10, 12, 13])
-            logits_result[:cY, :, irregular_list] = -1
+            irregular_rows = slice(None, cY)
             wear_type = "cloth_pant"
-        parsing_result = np.argmax(logits_result, axis=2)
+        if logits_result.ndim == 2:
+            irregular = parsing_result[irregular_rows]
+            irregular[np.isin(irregular, irregular_list)] = 0
+        else:
+            logits_result[irregular_rows, :, irregular_list] = -1
+            parsing_result = np.argmax(logits_result, axis=2)
     # pad border
     parsing_result = np.pad(parsing_result, pad_width=1, mode='constant', constant_values=0)
     return parsing_result, wear_type
@@ -118,7 +136,41 @@ def refine_hole(parsing_result_filled, parsing_result, arm_mask):
             cv2.drawContours(refine_hole_mask, contours, i, color=255, thickness=-1)
     return refine_hole_mask + arm_mask
 
-def onnx_inference(session, lip_session, input_dir):
+def refine_atr(parsing_result):
+    parsing_result = np.pad(parsing_result, pad_width=1, mode='constant', constant_values=0)
+    # try holefilling the clothes part
+    arm_mask = (parsing_result == 14).astype(np.float32) \
+               + (parsing_result == 15).astype(np.float32)
+    upper_cloth_mask = (parsing_result == 4).astype(np.float32) + arm_mask
+    img = np.where(upper_cloth_mask, 255, 0)
+    dst = hole_fill(img.astype(np.uint8))
+    parsing_result_filled = (dst // 255 * 4).astype(parsing_result.dtype)
+    parsing_result_woarm = np.where(parsing_result_filled == 4, parsing_result_filled, parsing_result)
+    # add back arm and refined hole between arm and cloth
+    refine_hole_mask = refine_hole(parsing_result_filled.astype(np.uint8), parsing_result.astype(np.uint8),
+                                   arm_mask.astype(np.uint8))
+    parsing_result = np.where(refine_hole_mask, parsing_result, parsing_result_woarm)
+    # remove padding
+    return parsing_result[1:-1, 1:-1]
+
+
+def merge_neck(parsing_result, parsing_result_lip):
+    """
+    Label the ATR skin that LIP does not see as face as neck (18).
+
+    Returns:
+    tuple: The palette parse map, and the face mask as a float32 array.
+    """
+    neck_mask = np.logical_and(np.logical_not((parsing_result_lip == 13).astype(np.float32)),
+                               (parsing_result == 11).astype(np.float32))
+    parsing_result = np.where(neck_mask, 18, parsing_result)
+    palette = get_palette(19)
+    output_img = Image.fromarray(np.asarray(parsing_result, dtype=np.uint8))
+    output_img.putpalette(palette)
+    return output_img, (parsing_result == 11).astype(np.float32)
+
+
+def atr_inference(session, input_dir):
     transform = transforms.Compose([
         transforms.ToTensor(),
         transforms.Normalize(mean=[0.406, 0.456, 0.485], std=[0.225, 0.224, 0.229])
@@ -133,56 +185,127 @@ def onnx_inference(session, lip_session, input_dir):
             w = meta['width'].numpy()[0]
             h = meta['height'].numpy()[0]
             output = session.run(None, {"input.1": image.numpy().astype(np.float32)})
-            upsample = torch.nn.Upsample(size=[512, 512], mode='bilinear', align_corners=True)
-            upsample_output = upsample(torch.from_numpy(output[1][0]).unsqueeze(0))
-            upsample_output = upsample_output.squeeze()
-            upsample_output = upsample_output.permute(1, 2, 0)  # CHW -> HWC
-            logits_result = transform_logits(upsample_output.data.cpu().numpy(), c, s, w, h, input_size=[512, 512])
-            parsing_result = np.argmax(logits_result, axis=2)
-            parsing_result = np.pad(parsing_result, pad_width=1, mode='constant', constant_values=0)
-            # try holefilling the clothes part
-            arm_mask = (parsing_result == 14).astype(np.float32) \
-                       + (parsing_result == 15).astype(np.float32)
-            upper_cloth_mask = (parsing_result == 4).astype(np.float32) + arm_mask
-            img = np.where(upper_cloth_mask, 255, 0)
-            dst = hole_fill(img.astype(np.uint8))
-            parsing_result_filled = dst / 255 * 4
-            parsing_result_woarm = np.where(parsing_result_filled == 4, parsing_result_filled, parsing_result)
-            # add back arm and refined hole between arm and cloth
-            refine_hole_mask = refine_hole(parsing_result_filled.astype(np.uint8), parsing_result.astype(np.uint8),
-                                           arm_mask.astype(np.uint8))
-            parsing_result = np.where(refine_hole_mask, parsing_result, parsing_result_woarm)
-            # remove padding
-            parsing_result = parsing_result[1:-1, 1:-1]
-
-        dataset_lip = SimpleFolderDataset(root=input_dir, input_size=[473, 473], transform=transform)
-        dataloader_lip = DataLoader(dataset_lip)
-        with torch.no_grad():
-            for _, batch in enumerate(tqdm(dataloader_lip)):
-                image, meta = batch
-                c = meta['center'].numpy()[0]
-                s = meta['scale'].numpy()[0]
-                w = meta['width'].numpy()[0]
-                h = meta['height'].numpy()[0]
-
-                output_lip = lip_session.run(None, {"input.1": image.numpy().astype(np.float32)})
-                upsample = torch.nn.Upsample(size=[473, 473], mode='bilinear', align_corners=True)
-                upsample_output_lip = upsample(torch.from_numpy(output_lip[1][0]).unsqueeze(0))
-                upsample_output_lip = upsample_output_lip.squeeze()
-                upsample_output_lip = upsample_output_lip.permute(1, 2, 0)  # CHW -> HWC
-                logits_result_lip = transform_logits(upsample_output_lip.data.cpu().numpy(), c, s, w, h,
-                                                     input_size=[473, 473])
-                parsing_result_lip = np.argmax(logits_result_lip, axis=2)
-    # add neck parsing result
-    neck_mask = np.logical_and(np.logical_not((parsing_result_lip == 13).astype(np.float32)),
-                               (parsing_result == 11).astype(np.float32))
-    parsing_result = np.where(neck_mask, 18, parsing_result)
-    palette = get_palette(19)
-    output_img = Image.fromarray(np.asarray(parsing_result, dtype=np.uint8))
-    output_img.putpalette(palette)
-    face_mask = torch.from_numpy((parsing_result == 11).astype(np.float32))
+            parsing_result = upsample_transform_argmax(output[1][0], c, s, w, h, input_size=[512, 512])
+            parsing_result = refine_atr(parsing_result)
+    return parsing_result
 
-    return output_img, face_mask
 
+def lip_inference(lip_session, input_dir):
+    transform = transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.406, 0.456, 0.485], std=[0.225, 0.224, 0.229])
+    ])
+    dataset_lip = SimpleFolderDataset(root=input_dir, input_size=[473, 473], transform=transform)
+    dataloader_lip = DataLoader(dataset_lip)
+    with torch.no_grad():
+        for _, batch in enumerate(tqdm(dataloader_lip)):
+            image, meta = batch
+            c = meta['center'].numpy()[0]
+            s = meta['scale'].numpy()[0]
+            w = meta['width'].numpy()[0]
+            h = meta['height'].numpy()[0]
+
+            output_lip = lip_session.run(None, {"input.1": image.numpy().astype(np.float32)})
+            parsing_result_lip = upsample_transform_argmax(output_lip[1][0], c, s, w, h, input_size=[473, 473])
+    return parsing_result_lip
 
 
+def onnx_inference(session, lip_session, input_dir, executor=None):
+    """
+    Parse with the ATR model and take the neck from the LIP model.
+
+    With an `executor`, the LIP model runs in one of its threads while the ATR
+    model runs in the calling one. onnxruntime and the cv2 warps release
+    the GIL, so the two models overlap on the cores given to their sessions.
+    """
+    if executor is not None:
+        lip_future = executor.submit(lip_inference, lip_session, input_dir)
+        parsing_result = atr_inference(session, input_dir)
+        parsing_result_lip = lip_future.result()
+    else:
+        parsing_result = atr_inference(session, input_dir)
+        parsing_result_lip = lip_inference(lip_session, input_dir)
+
+    output_img, face_mask = merge_neck(parsing_result, parsing_result_lip)
+    return output_img, torch.from_numpy(face_mask)
+
+
+def preprocess(image, input_size):
+    """
+    The crop of a PIL image to the input of a parsing model, as SimpleFolderDataset
+    and the torchvision transforms do it: the whole picture, padded to the aspect
+    ratio of `input_size`, warped to it and normalized.
+
+    Returns:
+    tuple: The CHW float32 input, and the center, scale, width and height to warp
+    the logits back with.
+    """
+    img = np.asarray(image)[:, :, [2, 1, 0]]
+    h, w, _ = img.shape
+    # _box2cs of SimpleFolderDataset on the box [0, 0, w - 1, h - 1]
+    aspect_ratio = input_size[1] * 1.0 / input_size[0]
+    center = np.array([(w - 1) * 0.5, (h - 1) * 0.5], dtype=np.float32)
+    box_w, box_h = w - 1, h - 1
+    if box_w > aspect_ratio * box_h:
+        box_h = box_w * 1.0 / aspect_ratio
+    elif box_w < aspect_ratio * box_h:
+        box_w = box_h * aspect_ratio
+    scale = np.array([box_w, box_h], dtype=np.float32)
+    trans = get_affine_transform(center, scale, 0, np.asarray(input_size))
+    input = cv2.warpAffine(
+        img,
+        trans,
+        (int(input_size[1]), int(input_size[0])),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=(0, 0, 0))
+    input = (input.astype(np.float32) / 255 - MEAN) / STD
+    return input.transpose(2, 0, 1), (center, scale, w, h)
+
+
+def run_batch(session, inputs):
+    """
+    The fused parsing logits of stacked inputs, in one call when the model takes
+    a dynamic batch, else one call per input.
+    """
+    batch_size = session.get_inputs()[0].shape[0]
+    if not isinstance(batch_size, int) or batch_size == len(inputs):
+        return session.run(None, {"input.1": inputs})[1]
+    return np.concatenate([session.run(None, {"input.1": inputs[i:i + 1]})[1] for i in range(len(inputs))])
+
+
+def parse_batch(session, images, input_size):
+    inputs, metas = zip(*[preprocess(image, input_size) for image in images])
+    logits = run_batch(session, np.stack(inputs))
+    parsing_results = []
+    for logit, (c, s, w, h) in zip(logits, metas):
+        parsing_results.append(upsample_transform_argmax(logit, c, s, w, h, input_size=input_size))
+    return parsing_results
+
+
+def atr_batch(session, images):
+    return [refine_atr(parsing_result) for parsing_result in parse_batch(session, images, [512, 512])]
+
+
+def lip_batch(lip_session, images):
+    return parse_batch(lip_session, images, [473, 473])
+
+
+def onnx_inference_batch(session, lip_session, images, executor=None):
+    """
+    onnx_inference for a list of PIL images, without the dataset, the data
+    loader and torch: the crops are made in NumPy and stacked into one run of
+    each model. With an `executor`, the two models run at the same time.
+
+    Returns:
+    list: The palette parse map and the float32 face mask of every image.
+    """
+    if executor is not None:
+        lip_future = executor.submit(lip_batch, lip_session, images)
+        parsing_results = atr_batch(session, images)
+        parsing_results_lip = lip_future.result()
+    else:
+        parsing_results = atr_batch(session, images)
+        parsing_results_lip = lip_batch(lip_session, images)
+    return [merge_neck(parsing_result, parsing_result_lip)
+            for parsing_result, parsing_result_lip in zip(parsing_results, parsing_results_lip)]
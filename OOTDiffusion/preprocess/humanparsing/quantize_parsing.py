@@ -0,0 +1,89 @@
+from pathlib import Path
+import sys
+import os
+import argparse
+import tempfile
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, \
+    quantize_dynamic, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).absolute().parents[0].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+from parsing_api import preprocess
+from run_parsing import checkpoint_path
+
+
+# Makes the int8 parsing models that Parsing(precision="int8") loads, next to the fp32 ones.
+# Static quantization calibrates the activations on local person pictures, cropped as the
+# parsing does it; dynamic quantization only needs the weights. Check the result against fp32
+# with benchmarks/benchmark_parsing_int8.py before shipping it.
+
+INPUT_SIZES = {"atr": [512, 512], "lip": [473, 473]}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+
+def find_images(calibration_dir, n_images):
+    images = []
+    for root, _, files in os.walk(calibration_dir):
+        for file in files:
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(os.path.join(root, file))
+    return sorted(images)[:n_images]
+
+
+class ParsingCalibrationReader(CalibrationDataReader):
+    """
+    The inputs of a parsing model for the calibration, one picture per run,
+    at the 384x512 that the try-on parses.
+    """
+
+    def __init__(self, image_paths, input_size):
+        self.image_paths = image_paths
+        self.input_size = input_size
+        self.index = 0
+
+    def get_next(self):
+        if self.index >= len(self.image_paths):
+            return None
+        image = Image.open(self.image_paths[self.index]).convert("RGB").resize((384, 512))
+        self.index += 1
+        input, _ = preprocess(image, self.input_size)
+        return {"input.1": input[None]}
+
+    def rewind(self):
+        self.index = 0
+
+
+def quantize(name, mode, image_paths, per_channel):
+    model_input = checkpoint_path(name)
+    model_output = checkpoint_path(name, "int8")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Shape inference and graph optimizations first, as onnxruntime recommends for quantization
+        preprocessed = os.path.join(temp_dir, os.path.basename(model_input))
+        quant_pre_process(model_input, preprocessed)
+        if mode == "dynamic":
+            quantize_dynamic(preprocessed, model_output, per_channel=per_channel, weight_type=QuantType.QInt8)
+        else:
+            quantize_static(preprocessed, model_output, ParsingCalibrationReader(image_paths, INPUT_SIZES[name]),
+                            quant_format=QuantFormat.QDQ, per_channel=per_channel,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                            calibrate_method=CalibrationMethod.MinMax)
+    return model_output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='quantize the parsing models to int8')
+    parser.add_argument('--mode', type=str, default="static", choices=["static", "dynamic"], required=False)
+    parser.add_argument('--calibration_dir', type=str,
+                        default=str(PROJECT_ROOT.parents[1] / "run/examples/model"), required=False)
+    parser.add_argument('--n_images', type=int, default=64, required=False)
+    parser.add_argument('--per_channel', action='store_true', help='one weight scale per output channel')
+    parser.add_argument('--models', type=str, nargs='+', default=["atr", "lip"], choices=["atr", "lip"], required=False)
+    args = parser.parse_args()
+
+    image_paths = find_images(args.calibration_dir, args.n_images)
+    if args.mode == "static" and not image_paths:
+        sys.exit(f"no calibration pictures in {args.calibration_dir}")
+    for name in args.models:
+        print(f"{name}: {quantize(name, args.mode, image_paths, args.per_channel)}")
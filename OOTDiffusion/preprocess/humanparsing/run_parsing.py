@@ -2,28 +2,92 @@ import pdb
 from pathlib import Path
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 import onnxruntime as ort
 PROJECT_ROOT = Path(__file__).absolute().parents[0].absolute()
 sys.path.insert(0, str(PROJECT_ROOT))
-from parsing_api import onnx_inference
+from PIL import Image
+from parsing_api import onnx_inference, onnx_inference_batch
 import torch
 
 
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+# Suffix of the checkpoints of every precision, the int8 ones are made by quantize_parsing.py
+PRECISIONS = {"fp32": "", "int8": "_int8"}
+CHECKPOINT_DIR = os.path.join(Path(__file__).absolute().parents[2].absolute(), 'checkpoints/humanparsing')
+
+
+def checkpoint_path(name, precision="fp32"):
+    if precision not in PRECISIONS:
+        raise ValueError("precision must be one of " + ", ".join(PRECISIONS))
+    return os.path.join(CHECKPOINT_DIR, 'parsing_' + name + PRECISIONS[precision] + '.onnx')
+
+
 class Parsing:
-    def __init__(self, gpu_id: int):
+    """
+    The ATR and LIP parsing models on onnxruntime.
+
+    With `concurrent`, the two models run at the same time, the LIP one in a
+    worker thread, and by default each session gets half of the cores for its
+    intra-op threads so that they do not fight over them. `intra_op_num_threads`
+    and `inter_op_num_threads` are per session, 0 for the onnxruntime default.
+    `execution_mode` is "sequential" or "parallel", the latter runs independent
+    nodes of a graph at the same time on the inter-op threads. Without
+    `allow_spinning`, idle threads sleep instead of spinning, which helps when
+    the sessions share the cores.
+
+    `precision` "int8" loads the quantized models of quantize_parsing.py, see
+    benchmarks/benchmark_parsing_int8.py for their mIoU against fp32.
+
+    parse_batch() parses a list of in-memory pictures with one run of each
+    model, without the dataset and torch. Calls on a PIL image go through it.
+    """
+
+    def __init__(self, gpu_id: int, concurrent=True, intra_op_num_threads=None, inter_op_num_threads=0,
+                 execution_mode="sequential", allow_spinning=True, precision="fp32"):
         self.gpu_id = gpu_id
         torch.cuda.set_device(gpu_id)
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError("execution_mode must be one of " + ", ".join(EXECUTION_MODES))
+        atr_path, lip_path = checkpoint_path('atr', precision), checkpoint_path('lip', precision)
+        for path in (atr_path, lip_path):
+            if precision != "fp32" and not os.path.exists(path):
+                raise FileNotFoundError(f"{path} not found, the {precision} parsing models are made by quantize_parsing.py")
+        self.precision = precision
+        if intra_op_num_threads is None:
+            intra_op_num_threads = max(1, (os.cpu_count() or 2) // 2) if concurrent else 0
         session_options = ort.SessionOptions()
         session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-        session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        session_options.execution_mode = EXECUTION_MODES[execution_mode]
+        session_options.intra_op_num_threads = intra_op_num_threads
+        session_options.inter_op_num_threads = inter_op_num_threads
         session_options.add_session_config_entry('gpu_id', str(gpu_id))
-        self.session = ort.InferenceSession(os.path.join(Path(__file__).absolute().parents[2].absolute(), 'checkpoints/humanparsing/parsing_atr.onnx'),
-                                            sess_options=session_options, providers=['CPUExecutionProvider'])
-        self.lip_session = ort.InferenceSession(os.path.join(Path(__file__).absolute().parents[2].absolute(), 'checkpoints/humanparsing/parsing_lip.onnx'),
-                                                sess_options=session_options, providers=['CPUExecutionProvider'])
-        
+        session_options.add_session_config_entry('session.intra_op.allow_spinning', '1' if allow_spinning else '0')
+        session_options.add_session_config_entry('session.inter_op.allow_spinning', '1' if allow_spinning else '0')
+        self.session = ort.InferenceSession(atr_path, sess_options=session_options, providers=['CPUExecutionProvider'])
+        self.lip_session = ort.InferenceSession(lip_path, sess_options=session_options, providers=['CPUExecutionProvider'])
+        self.executor = ThreadPoolExecutor(max_workers=1) if concurrent else None
+
 
     def __call__(self, input_image):
+        if isinstance(input_image, Image.Image):
+            parsed_image, face_mask = self.parse_batch([input_image])[0]
+            return parsed_image, torch.from_numpy(face_mask)
         torch.cuda.set_device(self.gpu_id)
-        parsed_image, face_mask = onnx_inference(self.session, self.lip_session, input_image)
+        parsed_image, face_mask = onnx_inference(self.session, self.lip_session, input_image, self.executor)
         return parsed_image, face_mask
+
+    def parse_batch(self, images):
+        """
+        Parse PIL images of any size, stacked into one run of each model.
+
+        Returns:
+        list: The palette parse map and the float32 face mask (a NumPy array) of
+        every image.
+        """
+        if len(images) == 0:
+            return []
+        return onnx_inference_batch(self.session, self.lip_session, images, self.executor)
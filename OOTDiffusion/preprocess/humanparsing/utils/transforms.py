@@ -78,23 +78,113 @@ def transform_parsing(pred, center, scale, width, height, input_size):
 
     return target_pred
 
-def transform_logits(logits, center, scale, width, height, input_size):
+# Channels per cv2.warpAffine call, the most that its interpolation handles in one pass
+WARP_CHANNELS = 4
 
+
+def transform_logits(logits, center, scale, width, height, input_size, argmax_only=False):
+    """
+    Warp HxWxC logits back to the width x height picture, 4 channels per warp.
+
+    With `argmax_only`, return only the argmax over the channels, kept as a
+    running maximum over the groups of channels: the full resolution logits
+    are never stacked. The labels are the ones of np.argmax on the full warp,
+    ties going to the first channel.
+    """
     trans = get_affine_transform(center, scale, 0, input_size, inv=1)
     channel = logits.shape[2]
-    target_logits = []
-    for i in range(channel):
-        target_logit = cv2.warpAffine(
-            logits[:,:,i],
+
+    def warp(start):
+        return cv2.warpAffine(
+            np.ascontiguousarray(logits[:, :, start:start + WARP_CHANNELS]),
             trans,
             (int(width), int(height)), #(int(width), int(height)),
             flags=cv2.INTER_LINEAR,
             borderMode=cv2.BORDER_CONSTANT,
-            borderValue=(0))
-        target_logits.append(target_logit)
-    target_logits = np.stack(target_logits,axis=2)
+            borderValue=(0)).reshape(int(height), int(width), -1)
+
+    if not argmax_only:
+        target_logits = np.empty((int(height), int(width), channel), dtype=logits.dtype)
+        for start in range(0, channel, WARP_CHANNELS):
+            target_logits[:, :, start:start + WARP_CHANNELS] = warp(start)
+        return target_logits
+
+    target_max = np.full((int(height), int(width)), -np.inf, dtype=logits.dtype)
+    target_argmax = np.zeros((int(height), int(width)), dtype=np.int64)
+    for start in range(0, channel, WARP_CHANNELS):
+        update_argmax(target_max, target_argmax, warp(start), start)
+    return target_argmax
+
 
-    return target_logits
+def update_argmax(target_max, target_argmax, target_logit, start):
+    # Running argmax over HxWxK logits of the channels start to start + K, in place
+    for i in range(target_logit.shape[2]):
+        better = target_logit[:, :, i] > target_max
+        np.copyto(target_max, target_logit[:, :, i], where=better)
+        target_argmax[better] = start + i
+
+
+def bilinear_grid(n_in, n_out):
+    # Source indices and weights of a resize with aligned corners, as torch.nn.Upsample(align_corners=True)
+    step = (n_in - 1) / (n_out - 1) if n_out > 1 else 0
+    position = np.arange(n_out, dtype=np.float32) * np.float32(step)
+    low = np.minimum(np.floor(position).astype(np.int64), n_in - 1)
+    high = np.minimum(low + 1, n_in - 1)
+    return low, high, (position - low).astype(np.float32)
+
+
+def upsample_transform_argmax(logits, center, scale, width, height, input_size, rows=64):
+    """
+    The labels of the CHW logits of a parsing model as a width x height uint8 map:
+    the logits upsampled to `input_size` (bilinear, aligned corners), warped back
+    as transform_logits does it and argmaxed, in one pass.
+
+    The map is made `rows` rows at a time. A band upsamples only the rows of the
+    input size that its warp reads, so neither the upsampled nor the warped
+    logits exist in full.
+    """
+    channel, in_h, in_w = logits.shape
+    width, height = int(width), int(height)
+    trans = get_affine_transform(center, scale, 0, input_size, inv=1)
+    y_low, y_high, y_weight = bilinear_grid(in_h, int(input_size[0]))
+    x_low, x_high, x_weight = bilinear_grid(in_w, int(input_size[1]))
+    # Upsample the columns once, they are small at the model resolution: in_h x input width x C
+    logits = np.ascontiguousarray(logits.transpose(1, 2, 0))  # CHW -> HWC
+    columns = logits[:, x_low] * (1 - x_weight)[:, None] + logits[:, x_high] * x_weight[:, None]
+
+    # warpAffine maps the source to the picture with `trans`, the picture goes back with its inverse
+    inverse = cv2.invertAffineTransform(trans)
+    labels = np.zeros((height, width), dtype=np.uint8)
+    corners_x = np.array([0, width - 1, 0, width - 1], dtype=np.float64)
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        # Source rows read by the band, with a margin for the interpolation
+        corners_y = np.array([y0, y0, y1 - 1, y1 - 1], dtype=np.float64)
+        source_y = inverse[1, 0] * corners_x + inverse[1, 1] * corners_y + inverse[1, 2]
+        r0 = max(int(np.floor(source_y.min())) - 1, 0)
+        r1 = min(int(np.ceil(source_y.max())) + 2, int(input_size[0]))
+        if r0 >= r1:
+            # Only border, all the logits are 0 and the label is the first class
+            continue
+        band = columns[y_low[r0:r1]] * (1 - y_weight[r0:r1])[:, None, None] \
+               + columns[y_high[r0:r1]] * y_weight[r0:r1][:, None, None]
+        # The band reads from source row r0 and writes from picture row y0
+        band_trans = trans.copy()
+        band_trans[:, 2] += trans[:, 1] * r0
+        band_trans[1, 2] -= y0
+        band_max = np.full((y1 - y0, width), -np.inf, dtype=band.dtype)
+        band_argmax = np.zeros((y1 - y0, width), dtype=np.uint8)
+        for start in range(0, channel, WARP_CHANNELS):
+            target_logit = cv2.warpAffine(
+                np.ascontiguousarray(band[:, :, start:start + WARP_CHANNELS]),
+                band_trans,
+                (width, y1 - y0),
+                flags=cv2.INTER_LINEAR,
+                borderMode=cv2.BORDER_CONSTANT,
+                borderValue=(0)).reshape(y1 - y0, width, -1)
+            update_argmax(band_max, band_argmax, target_logit, start)
+        labels[y0:y1] = band_argmax
+    return labels
 
 
 def get_affine_transform(center,
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+
+from PIL import Image
+from safetensors.torch import load_file, save_file
+
+
+class Avatar:
+    """
+    Everything a try-on computes from the person picture alone: the OpenPose
+    keypoints, the parse map, the masks of every (model_type, category) and
+    the VAE latents of the picture and of each masked picture.
+
+    `category` is one of the names of get_mask_location: 'upper_body',
+    'lower_body' or 'dresses'.
+    """
+
+    def __init__(self, keypoints, model_parse, masks=None, latents=None):
+        self.keypoints = keypoints
+        self.model_parse = model_parse
+        # (model_type, category) -> (mask, mask_gray), at 768x1024
+        self.masks = masks if masks is not None else {}
+        # "image_ori" and "image_vton/{model_type}/{category}" -> VAE latents
+        self.latents = latents if latents is not None else {}
+
+    @staticmethod
+    def vton_name(model_type, category):
+        return f"image_vton/{model_type}/{category}"
+
+    def has(self, model_type, category):
+        return (
+            (model_type, category) in self.masks
+            and "image_ori" in self.latents
+            and self.vton_name(model_type, category) in self.latents
+        )
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "keypoints.json"), "w") as f:
+            json.dump(self.keypoints, f, default=float)
+        self.model_parse.save(os.path.join(directory, "parse.png"))
+        for (model_type, category), (mask, mask_gray) in self.masks.items():
+            mask.save(os.path.join(directory, f"mask_{model_type}_{category}.png"))
+            mask_gray.save(os.path.join(directory, f"mask_gray_{model_type}_{category}.png"))
+        latents = {name: tensor.contiguous().cpu() for name, tensor in self.latents.items()}
+        save_file(latents, os.path.join(directory, "latents.safetensors"))
+
+    @classmethod
+    def load(cls, directory, device=None):
+        with open(os.path.join(directory, "keypoints.json")) as f:
+            keypoints = json.load(f)
+        model_parse = Image.open(os.path.join(directory, "parse.png"))
+        model_parse.load()
+
+        latents = load_file(os.path.join(directory, "latents.safetensors"))
+        if device is not None:
+            latents = {name: tensor.to(device) for name, tensor in latents.items()}
+
+        masks = {}
+        for name in latents:
+            if name.startswith("image_vton/"):
+                _, model_type, category = name.split("/")
+                mask = Image.open(os.path.join(directory, f"mask_{model_type}_{category}.png"))
+                mask_gray = Image.open(os.path.join(directory, f"mask_gray_{model_type}_{category}.png"))
+                mask.load()
+                mask_gray.load()
+                masks[(model_type, category)] = (mask, mask_gray)
+        return cls(keypoints, model_parse, masks, latents)
+
+
+class AvatarCache:
+    """
+    Precomputed avatars by content hash of the 768x1024 person picture.
+
+    Only avatars written by precompute_avatars.py are served, so uploaded
+    pictures never grow the cache. Each avatar is a folder of `cache_dir`,
+    all of them are loaded in memory when the cache is created.
+    """
+
+    def __init__(self, cache_dir, device=None):
+        self.cache_dir = cache_dir
+        self.device = device
+        self.avatars = {}
+        if os.path.isdir(cache_dir):
+            for key in os.listdir(cache_dir):
+                if os.path.exists(os.path.join(cache_dir, key, "latents.safetensors")):
+                    self.avatars[key] = Avatar.load(os.path.join(cache_dir, key), device)
+
+    @staticmethod
+    def make_key(model_img):
+        digest = hashlib.sha256()
+        digest.update(f"{model_img.mode}/{model_img.size[0]}x{model_img.size[1]}".encode())
+        digest.update(model_img.tobytes())
+        return digest.hexdigest()
+
+    def get(self, model_img):
+        return self.avatars.get(self.make_key(model_img))
+
+    def put(self, model_img, avatar):
+        key = self.make_key(model_img)
+        avatar.save(os.path.join(self.cache_dir, key))
+        self.avatars[key] = avatar
+        return key
+
+    def __len__(self):
+        return len(self.avatars)
@@ -15,6 +15,9 @@ from preprocess.openpose.run_openpose import OpenPose
 from preprocess.humanparsing.run_parsing import Parsing
 from ootd.inference_ootd_hd import OOTDiffusionHD
 from ootd.inference_ootd_dc import OOTDiffusionDC
+from ootd.scheduler_registry import SCHEDULERS, DEFAULT_SCHEDULER
+from ootd.latent_preview import LatentPreviewer
+from tryon_service import PreparedPerson
 
 
 openpose_model_hd = OpenPose(0)
@@ -29,6 +32,9 @@ ootd_model_dc = OOTDiffusionDC(1)
 category_dict = ['upperbody', 'lowerbody', 'dress']
 category_dict_utils = ['upper_body', 'lower_body', 'dresses']
 
+# Steps between two latent previews in the output gallery
+PREVIEW_INTERVAL = 4
+
 
 example_path = os.path.join(os.path.dirname(__file__), 'examples')
 model_hd = os.path.join(example_path, 'model/model_1.png')
@@ -36,7 +42,7 @@ garment_hd = os.path.join(example_path, 'garment/03244_00.jpg')
 model_dc = os.path.join(example_path, 'model/model_8.png')
 garment_dc = os.path.join(example_path, 'garment/048554_1.jpg')
 
-def process_hd(vton_img, garm_img, n_samples, n_steps, image_scale, seed):
+def process_hd(vton_img, garm_img, n_samples, n_steps, image_scale, seed, scheduler):
     model_type = 'hd'
     category = 0 # 0:upperbody; 1:lowerbody; 2:dress
 
@@ -52,7 +58,9 @@ def process_hd(vton_img, garm_img, n_samples, n_steps, image_scale, seed):
         
         masked_vton_img = Image.composite(mask_gray, vton_img, mask)
 
-        images = ootd_model_hd(
+    # Rough pictures of the latents while the model denoises, then the output
+    events = LatentPreviewer(PREVIEW_INTERVAL).stream(
+        lambda callback_on_step_end: ootd_model_hd(
             model_type=model_type,
             category=category_dict[category],
             image_garm=garm_img,
@@ -63,11 +71,69 @@ def process_hd(vton_img, garm_img, n_samples, n_steps, image_scale, seed):
             num_steps=n_steps,
             image_scale=image_scale,
             seed=seed,
+            scheduler=scheduler,
+            callback_on_step_end=callback_on_step_end,
+        )
+    )
+    for kind, step, images in events:
+        yield images
+
+def preview_hd(vton_img, garm_img, n_samples, n_preview_steps, image_scale, seed, scheduler):
+    model_type = 'hd'
+    category = 0 # 0:upperbody; 1:lowerbody; 2:dress
+
+    with torch.no_grad():
+        garm_img = Image.open(garm_img).resize((768, 1024))
+        vton_img = Image.open(vton_img).resize((768, 1024))
+        keypoints = openpose_model_hd(vton_img.resize((384, 512)))
+        model_parse, _ = parsing_model_hd(vton_img.resize((384, 512)))
+
+        mask, mask_gray = get_mask_location(model_type, category_dict_utils[category], model_parse, keypoints)
+        mask = mask.resize((768, 1024), Image.NEAREST)
+        mask_gray = mask_gray.resize((768, 1024), Image.NEAREST)
+        
+        masked_vton_img = Image.composite(mask_gray, vton_img, mask)
+
+        preview = ootd_model_hd.preview(
+            model_type=model_type,
+            category=category_dict[category],
+            image_garm=garm_img,
+            image_vton=masked_vton_img,
+            mask=mask,
+            image_ori=vton_img,
+            num_samples=n_samples,
+            num_steps=n_preview_steps,
+            image_scale=image_scale,
+            seed=seed,
+            scheduler=scheduler,
         )
+    # The refine reuses the masks along with the garment features of the preview
+    preview.person = PreparedPerson(vton_img, mask, mask_gray)
+    print('Preview timings: ' + str(preview.timings))
+
+    return preview.images, preview
+
+def refine_hd(preview, n_steps, strength, scheduler):
+    if preview is None:
+        raise gr.Error("Run a preview first")
+    image_vton, mask, image_ori, image_ori_latents = preview.person.inputs()
+
+    with torch.no_grad():
+        images, timings = ootd_model_hd.refine(
+            preview,
+            image_vton=image_vton,
+            mask=mask,
+            image_ori=image_ori,
+            num_steps=n_steps,
+            strength=strength,
+            image_ori_latents=image_ori_latents,
+            scheduler=scheduler,
+        )
+    print('Refine timings: ' + str(timings))
 
     return images
 
-def process_dc(vton_img, garm_img, category, n_samples, n_steps, image_scale, seed):
+def process_dc(vton_img, garm_img, category, n_samples, n_steps, image_scale, seed, scheduler):
     model_type = 'dc'
     if category == 'Upper-body':
         category = 0
@@ -88,7 +154,9 @@ def process_dc(vton_img, garm_img, category, n_samples, n_steps, image_scale, se
         
         masked_vton_img = Image.composite(mask_gray, vton_img, mask)
 
-        images = ootd_model_dc(
+    # Rough pictures of the latents while the model denoises, then the output
+    events = LatentPreviewer(PREVIEW_INTERVAL).stream(
+        lambda callback_on_step_end: ootd_model_dc(
             model_type=model_type,
             category=category_dict[category],
             image_garm=garm_img,
@@ -99,7 +167,70 @@ def process_dc(vton_img, garm_img, category, n_samples, n_steps, image_scale, se
             num_steps=n_steps,
             image_scale=image_scale,
             seed=seed,
+            scheduler=scheduler,
+            callback_on_step_end=callback_on_step_end,
+        )
+    )
+    for kind, step, images in events:
+        yield images
+
+def preview_dc(vton_img, garm_img, category, n_samples, n_preview_steps, image_scale, seed, scheduler):
+    model_type = 'dc'
+    if category == 'Upper-body':
+        category = 0
+    elif category == 'Lower-body':
+        category = 1
+    else:
+        category =2
+
+    with torch.no_grad():
+        garm_img = Image.open(garm_img).resize((768, 1024))
+        vton_img = Image.open(vton_img).resize((768, 1024))
+        keypoints = openpose_model_dc(vton_img.resize((384, 512)))
+        model_parse, _ = parsing_model_dc(vton_img.resize((384, 512)))
+
+        mask, mask_gray = get_mask_location(model_type, category_dict_utils[category], model_parse, keypoints)
+        mask = mask.resize((768, 1024), Image.NEAREST)
+        mask_gray = mask_gray.resize((768, 1024), Image.NEAREST)
+        
+        masked_vton_img = Image.composite(mask_gray, vton_img, mask)
+
+        preview = ootd_model_dc.preview(
+            model_type=model_type,
+            category=category_dict[category],
+            image_garm=garm_img,
+            image_vton=masked_vton_img,
+            mask=mask,
+            image_ori=vton_img,
+            num_samples=n_samples,
+            num_steps=n_preview_steps,
+            image_scale=image_scale,
+            seed=seed,
+            scheduler=scheduler,
+        )
+    # The refine reuses the masks along with the garment features of the preview
+    preview.person = PreparedPerson(vton_img, mask, mask_gray)
+    print('Preview timings: ' + str(preview.timings))
+
+    return preview.images, preview
+
+def refine_dc(preview, n_steps, strength, scheduler):
+    if preview is None:
+        raise gr.Error("Run a preview first")
+    image_vton, mask, image_ori, image_ori_latents = preview.person.inputs()
+
+    with torch.no_grad():
+        images, timings = ootd_model_dc.refine(
+            preview,
+            image_vton=image_vton,
+            mask=mask,
+            image_ori=image_ori,
+            num_steps=n_steps,
+            strength=strength,
+            image_ori_latents=image_ori_latents,
+            scheduler=scheduler,
         )
+    print('Refine timings: ' + str(timings))
 
     return images
 
@@ -159,14 +290,24 @@ with block:
             result_gallery = gr.Gallery(label='Output', show_label=False, elem_id="gallery", preview=True, scale=1)   
     with gr.Column():
         run_button = gr.Button(value="Run")
+        with gr.Row():
+            preview_button = gr.Button(value="Preview")
+            refine_button = gr.Button(value="Refine")
         n_samples = gr.Slider(label="Images", minimum=1, maximum=4, value=1, step=1)
-        n_steps = gr.Slider(label="Steps", minimum=20, maximum=40, value=20, step=1)
+        n_steps = gr.Slider(label="Steps", minimum=4, maximum=40, value=20, step=1)
+        scheduler = gr.Dropdown(label="Scheduler", choices=sorted(SCHEDULERS), value=DEFAULT_SCHEDULER)
         # scale = gr.Slider(label="Scale", minimum=1.0, maximum=12.0, value=5.0, step=0.1)
         image_scale = gr.Slider(label="Guidance scale", minimum=1.0, maximum=5.0, value=2.0, step=0.1)
         seed = gr.Slider(label="Seed", minimum=-1, maximum=2147483647, step=1, value=-1)
+        n_preview_steps = gr.Slider(label="Preview steps", minimum=4, maximum=20, value=8, step=1)
+        strength = gr.Slider(label="Refine strength (1 for a fresh run)", minimum=0.1, maximum=1.0, value=0.6, step=0.05)
+        preview_state = gr.State()
         
-    ips = [vton_img, garm_img, n_samples, n_steps, image_scale, seed]
+    ips = [vton_img, garm_img, n_samples, n_steps, image_scale, seed, scheduler]
     run_button.click(fn=process_hd, inputs=ips, outputs=[result_gallery])
+    ips_preview = [vton_img, garm_img, n_samples, n_preview_steps, image_scale, seed, scheduler]
+    preview_button.click(fn=preview_hd, inputs=ips_preview, outputs=[result_gallery, preview_state])
+    refine_button.click(fn=refine_hd, inputs=[preview_state, n_steps, strength, scheduler], outputs=[result_gallery])
 
 
     with gr.Row():
@@ -248,13 +389,25 @@ with block:
             result_gallery_dc = gr.Gallery(label='Output', show_label=False, elem_id="gallery", preview=True, scale=1)   
     with gr.Column():
         run_button_dc = gr.Button(value="Run")
+        with gr.Row():
+            preview_button_dc = gr.Button(value="Preview")
+            refine_button_dc = gr.Button(value="Refine")
         n_samples_dc = gr.Slider(label="Images", minimum=1, maximum=4, value=1, step=1)
-        n_steps_dc = gr.Slider(label="Steps", minimum=20, maximum=40, value=20, step=1)
+        n_steps_dc = gr.Slider(label="Steps", minimum=4, maximum=40, value=20, step=1)
+        scheduler_dc = gr.Dropdown(label="Scheduler", choices=sorted(SCHEDULERS), value=DEFAULT_SCHEDULER)
         # scale_dc = gr.Slider(label="Scale", minimum=1.0, maximum=12.0, value=5.0, step=0.1)
         image_scale_dc = gr.Slider(label="Guidance scale", minimum=1.0, maximum=5.0, value=2.0, step=0.1)
         seed_dc = gr.Slider(label="Seed", minimum=-1, maximum=2147483647, step=1, value=-1)
+        n_preview_steps_dc = gr.Slider(label="Preview steps", minimum=4, maximum=20, value=8, step=1)
+        strength_dc = gr.Slider(label="Refine strength (1 for a fresh run)", minimum=0.1, maximum=1.0, value=0.6, step=0.05)
+        preview_state_dc = gr.State()
         
-    ips_dc = [vton_img_dc, garm_img_dc, category_dc, n_samples_dc, n_steps_dc, image_scale_dc, seed_dc]
+    ips_dc = [vton_img_dc, garm_img_dc, category_dc, n_samples_dc, n_steps_dc, image_scale_dc, seed_dc, scheduler_dc]
     run_button_dc.click(fn=process_dc, inputs=ips_dc, outputs=[result_gallery_dc])
+    ips_preview_dc = [vton_img_dc, garm_img_dc, category_dc, n_samples_dc, n_preview_steps_dc, image_scale_dc, seed_dc,
+                      scheduler_dc]
+    preview_button_dc.click(fn=preview_dc, inputs=ips_preview_dc, outputs=[result_gallery_dc, preview_state_dc])
+    refine_button_dc.click(fn=refine_dc, inputs=[preview_state_dc, n_steps_dc, strength_dc, scheduler_dc],
+                           outputs=[result_gallery_dc])
 
 block.launch(server_name='0.0.0.0', server_port=7865)
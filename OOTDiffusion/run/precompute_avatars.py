@@ -0,0 +1,58 @@
+from pathlib import Path
+import sys
+import os
+import time
+import argparse
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from tryon_service import TryOnService
+from avatar_cache import AvatarCache
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+# get_mask_location categories of every model type, hd only supports upperbody
+MODEL_CATEGORIES = {"hd": ["upper_body"], "dc": ["upper_body", "lower_body", "dresses"]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='precompute the avatars for the avatar try-on path')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--avatars_path', type=str, default=str(PROJECT_ROOT.parent / "ApplicationFlow" / "avatars"), required=False)
+    parser.add_argument('--cache_dir', type=str, default="./avatar_cache", required=False)
+    parser.add_argument('--model_types', type=str, nargs='+', default=["hd", "dc"], required=False)
+    parser.add_argument('--overwrite', action='store_true', required=False)
+    args = parser.parse_args()
+
+    for model_type in args.model_types:
+        if model_type not in MODEL_CATEGORIES:
+            raise ValueError("model_type must be \'hd\' or \'dc\'!")
+
+    service = TryOnService(args.gpu_id, preload=args.model_types, garment_cache_bytes=0)
+    cache = AvatarCache(args.cache_dir)
+
+    files = sorted(file for file in os.listdir(args.avatars_path) if file.lower().endswith(IMAGE_EXTENSIONS))
+    for file in files:
+        # Same resize as TryOnService, so that the keys match the ones computed at request time
+        with Image.open(os.path.join(args.avatars_path, file)) as image:
+            model_img = image.resize((768, 1024))
+
+        avatar = cache.get(model_img)
+        if avatar is not None and not args.overwrite and all(
+            avatar.has(model_type, category)
+            for model_type in args.model_types
+            for category in MODEL_CATEGORIES[model_type]
+        ):
+            print(f"{file}: up to date")
+            continue
+
+        start_time = time.time()
+        avatar = service.analyze_person(model_img)
+        for model_type in args.model_types:
+            for category in MODEL_CATEGORIES[model_type]:
+                service.add_mask(avatar, model_type, category)
+                service.add_latents(avatar, model_img, model_type, category)
+        key = cache.put(model_img, avatar)
+        print(f"{file}: {key} in {time.time() - start_time:.2f} s")
@@ -0,0 +1,182 @@
+from pathlib import Path
+import sys
+import os
+import json
+import time
+import hashlib
+import argparse
+import torch
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from ootd.inference_ootd_hd import OOTDiffusionHD
+from ootd.inference_ootd_dc import OOTDiffusionDC
+from ootd.garment_cache import GarmentCache
+from tryon_service import category_dict
+
+
+# Category of every garment_database folder, as in ApplicationFlow/category_number.py
+CATEGORY_FOLDERS = {"topwear": 0, "bottomwear": 1, "dresses": 2}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+MANIFEST_NAME = "manifest.json"
+
+
+def find_garments(database_path):
+    """
+    List the garments of the catalog with their category number, sorted by path.
+    Garments in sub-folders belong to the category of their top folder.
+    """
+    garments = []
+    for folder, category in CATEGORY_FOLDERS.items():
+        for root, _, files in os.walk(os.path.join(database_path, folder)):
+            for file in files:
+                if file.lower().endswith(IMAGE_EXTENSIONS):
+                    garments.append((os.path.join(root, file), category))
+    return sorted(garments)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    # Replace the manifest atomically, an interruption keeps the previous one
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def load_garment(path):
+    # Same resize as TryOnService, so that the keys match the ones computed at request time
+    with Image.open(path) as image:
+        return image.resize((768, 1024))
+
+
+def key_name(model_type, shared_uncond):
+    # Name of the cache key of a garment in the manifest, the shared empty garment gives other features
+    return model_type + "/shared_uncond" if shared_uncond else model_type
+
+
+def plan(garments, manifest, model_types, cache, database_path, shared_uncond=False):
+    """
+    Find the garments and model types that still have to be computed.
+
+    Files whose mtime and size match the manifest are not read again. When they
+    changed but the content hash did not, only the manifest is refreshed.
+    """
+    todo = []
+    skipped = 0
+    for path, category in garments:
+        name = os.path.relpath(path, database_path)
+        entry = manifest.get(name)
+        stat = os.stat(path)
+
+        if entry is None:
+            sha256 = file_sha256(path)
+        elif entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            sha256 = entry["sha256"]
+        else:
+            sha256 = file_sha256(path)
+            if entry["sha256"] == sha256:
+                entry["mtime"] = stat.st_mtime
+                entry["size"] = stat.st_size
+            else:
+                entry = None
+
+        # hd only supports upperbody garments
+        types = [model_type for model_type in model_types if model_type == 'dc' or category == 0]
+        missing = [
+            model_type for model_type in types
+            if entry is None
+            or key_name(model_type, shared_uncond) not in entry["keys"]
+            or not cache.exists(entry["keys"][key_name(model_type, shared_uncond)])
+        ]
+        if not missing:
+            skipped += 1
+            continue
+
+        todo.append({
+            "name": name,
+            "path": path,
+            "category": category,
+            "model_types": missing,
+            "sha256": sha256,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+        })
+    return todo, skipped
+
+
+def precompute(model, model_type, garments, cache, manifest, manifest_path, batch_size):
+    garments = [garment for garment in garments if model_type in garment["model_types"]]
+    for start in range(0, len(garments), batch_size):
+        batch = garments[start:start + batch_size]
+        images = [load_garment(garment["path"]) for garment in batch]
+        categories = [category_dict[garment["category"]] for garment in batch]
+
+        start_time = time.time()
+        features = model.encode_garments(model_type, categories, images)
+        for garment, image, category, feature in zip(batch, images, categories, features):
+            key = cache.make_key(image, model_type, category, model.shared_uncond)
+            cache.put(key, feature)
+
+            entry = manifest.setdefault(garment["name"], {"keys": {}})
+            if entry.get("sha256") != garment["sha256"]:
+                entry["keys"] = {}
+            entry.update(sha256=garment["sha256"], mtime=garment["mtime"], size=garment["size"])
+            entry["keys"][key_name(model_type, model.shared_uncond)] = key
+
+        # Saved after every batch, an interrupted run resumes from here
+        save_manifest(manifest, manifest_path)
+        print(f"[{model_type}] {start + len(batch)}/{len(garments)} garments, "
+              f"{time.time() - start_time:.2f} s for the last batch")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='precompute the garment features of the catalog')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--database_path', type=str, default=str(PROJECT_ROOT.parent / "ApplicationFlow" / "garment_database"), required=False)
+    parser.add_argument('--cache_dir', type=str, default="./garment_cache", required=False)
+    parser.add_argument('--model_types', type=str, nargs='+', default=["hd", "dc"], required=False)
+    parser.add_argument('--batch_size', '-b', type=int, default=8, required=False)
+    parser.add_argument('--shared_uncond', action='store_true', help='use the shared empty garment of each category')
+    args = parser.parse_args()
+
+    for model_type in args.model_types:
+        if model_type not in ("hd", "dc"):
+            raise ValueError("model_type must be \'hd\' or \'dc\'!")
+
+    # Disk only, the entries are not needed in memory here
+    cache = GarmentCache(max_bytes=0, cache_dir=args.cache_dir)
+    manifest_path = os.path.join(args.cache_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    garments = find_garments(args.database_path)
+    todo, skipped = plan(garments, manifest, args.model_types, cache, args.database_path, args.shared_uncond)
+    save_manifest(manifest, manifest_path)
+    print(f"{len(garments)} garments in the catalog, {skipped} up to date, {len(todo)} to compute")
+
+    for model_type in args.model_types:
+        if not any(model_type in garment["model_types"] for garment in todo):
+            continue
+        # One model on the device at a time
+        if model_type == "hd":
+            model = OOTDiffusionHD(args.gpu_id, shared_uncond=args.shared_uncond)
+        else:
+            model = OOTDiffusionDC(args.gpu_id, shared_uncond=args.shared_uncond)
+        precompute(model, model_type, todo, cache, manifest, manifest_path, args.batch_size)
+        del model
+        torch.cuda.empty_cache()
@@ -0,0 +1,241 @@
+import argparse
+import base64
+import io
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+from tryon_service import TryOnService, SCHEDULERS, DEFAULT_SCHEDULER
+
+
+# POST /tryon takes a JSON body with either "model_path"/"cloth_path" (files on this machine)
+# or "model_image"/"cloth_image" (base64 encoded image files), plus the optional
+# "model_type", "category", "scale", "step", "sample", "seed" and "scheduler" fields of run_ootd.py.
+# The answer is the PNG files of all the samples one after another; their sizes are
+# listed in the X-Image-Lengths header.
+#
+# POST /preview takes the same fields ("step" defaults to 8) and answers a low resolution
+# try-on the same way, with an X-Preview-Id header. POST /refine takes that "preview_id",
+# "step", "strength" (null for a fresh run) and "scheduler", and answers the full resolution
+# pictures. Both also send the seconds of every phase as JSON in the X-Timings header.
+#
+# POST /tryon_stream takes the fields of /tryon plus "preview_interval", and answers a
+# series of messages as the try-on goes: a JSON line with "kind" ("preview", "images"
+# or "error"), "step" and the "lengths" of the PNG files that follow the line. The
+# previews are rough pictures of the latents, at 1/8 of the output size.
+
+service = None
+
+
+def decode_image(request, name):
+    # Unreadable images are errors of the request, as ValueError
+    try:
+        if request.get(name + "_image") is not None:
+            return Image.open(io.BytesIO(base64.b64decode(request[name + "_image"])))
+        if request.get(name + "_path") is not None:
+            return Image.open(request[name + "_path"])
+    except OSError as e:
+        raise ValueError(f"Cannot read the {name} image: {e}")
+    raise ValueError(f"Either '{name}_image' or '{name}_path' has to be given")
+
+
+def request_flag(request, name, default=False):
+    # Only JSON booleans, a string such as "false" would otherwise count as true
+    value = request.get(name, default)
+    if not isinstance(value, bool):
+        raise ValueError(f"'{name}' must be true or false")
+    return value
+
+
+def tryon_arguments(request):
+    # The optional fields of POST /tryon, as arguments of TryOnService
+    guidance_stop_threshold = request.get("guidance_stop_threshold")
+    if guidance_stop_threshold is not None:
+        guidance_stop_threshold = float(guidance_stop_threshold)
+    return dict(
+        model_type=request.get("model_type", "dc"),
+        category=int(request.get("category", 0)),
+        image_scale=float(request.get("scale", 2.0)),
+        n_steps=int(request.get("step", 20)),
+        n_samples=int(request.get("sample", 1)),
+        seed=int(request.get("seed", -1)),
+        crop_to_mask=request_flag(request, "crop_to_mask"),
+        guidance_stop_fraction=float(request.get("guidance_stop_fraction", 1.0)),
+        guidance_stop_threshold=guidance_stop_threshold,
+        deep_cache_interval=int(request.get("deep_cache_interval", 1)),
+        deep_cache_depth=int(request.get("deep_cache_depth", 1)),
+        scheduler=request.get("scheduler", DEFAULT_SCHEDULER),
+    )
+
+
+def encode_timings(timings):
+    return json.dumps({name: round(seconds, 3) for name, seconds in timings.items()})
+
+
+def encode_images(images):
+    chunks = []
+    for image in images:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        chunks.append(buffer.getvalue())
+    return chunks
+
+
+class TryOnHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_error(404)
+            return
+        status = {"status": "ok", "models": sorted(service.models), "schedulers": sorted(SCHEDULERS)}
+        if service.garment_cache is not None:
+            status["garment_cache"] = {
+                "entries": len(service.garment_cache),
+                "bytes": service.garment_cache.nbytes,
+                "hits": service.garment_cache.hits,
+                "misses": service.garment_cache.misses,
+            }
+        if service.avatar_cache is not None:
+            status["avatars"] = len(service.avatar_cache)
+        self.send_json(200, status)
+
+    def do_POST(self):
+        routes = {"/tryon": self.tryon, "/preview": self.preview, "/refine": self.refine}
+        if self.path not in routes and self.path != "/tryon_stream":
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+        except Exception as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        if self.path == "/tryon_stream":
+            self.tryon_stream(request)
+            return
+
+        try:
+            start_time = time.time()
+            images, headers = routes[self.path](request)
+            elapsed = time.time() - start_time
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+
+        chunks = encode_images(images)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(sum(len(chunk) for chunk in chunks)))
+        self.send_header("X-Image-Lengths", ",".join(str(len(chunk)) for chunk in chunks))
+        self.send_header("X-Elapsed-Seconds", f"{elapsed:.3f}")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def tryon(self, request):
+        return service(decode_image(request, "model"), decode_image(request, "cloth"), **tryon_arguments(request)), {}
+
+    def tryon_stream(self, request):
+        try:
+            model_img = decode_image(request, "model")
+            cloth_img = decode_image(request, "cloth")
+            arguments = tryon_arguments(request)
+            events = service.stream(model_img, cloth_img, int(request.get("preview_interval", 4)), **arguments)
+            # Up to the first preview, so that the errors of the request still get a status code
+            first_event = next(events)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+
+        # No Content-Length: the answer ends when the connection closes
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.end_headers()
+        try:
+            self.send_event(*first_event)
+            for event in events:
+                self.send_event(*event)
+        except Exception as e:
+            self.send_message({"kind": "error", "error": str(e)}, [])
+
+    def send_event(self, kind, step, images):
+        self.send_message({"kind": kind, "step": step}, encode_images(images))
+
+    def send_message(self, header, chunks):
+        header["lengths"] = [len(chunk) for chunk in chunks]
+        self.wfile.write(json.dumps(header).encode("utf-8") + b"\n")
+        for chunk in chunks:
+            self.wfile.write(chunk)
+        self.wfile.flush()
+
+    def preview(self, request):
+        preview_id, preview = service.preview(
+            decode_image(request, "model"),
+            decode_image(request, "cloth"),
+            model_type=request.get("model_type", "dc"),
+            category=int(request.get("category", 0)),
+            image_scale=float(request.get("scale", 2.0)),
+            n_steps=int(request.get("step", 8)),
+            n_samples=int(request.get("sample", 1)),
+            seed=int(request.get("seed", -1)),
+            scheduler=request.get("scheduler", DEFAULT_SCHEDULER),
+        )
+        return preview.images, {"X-Preview-Id": preview_id, "X-Timings": encode_timings(preview.timings)}
+
+    def refine(self, request):
+        if request.get("preview_id") is None:
+            raise ValueError("'preview_id' has to be given")
+        strength = request.get("strength", 0.6)
+        images, timings = service.refine(
+            request["preview_id"],
+            n_steps=int(request.get("step", 20)),
+            strength=None if strength is None else float(strength),
+            scheduler=request.get("scheduler", DEFAULT_SCHEDULER),
+        )
+        return images, {"X-Timings": encode_timings(timings)}
+
+    def send_json(self, code, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run the ootd try-on server')
+    parser.add_argument('--gpu_id', '-g', type=int, default=0, required=False)
+    parser.add_argument('--host', type=str, default="127.0.0.1", required=False)
+    parser.add_argument('--port', type=int, default=7866, required=False)
+    parser.add_argument('--preload', type=str, nargs='*', default=["dc"], required=False)
+    parser.add_argument('--garment_cache_mb', type=int, default=2048, required=False)
+    parser.add_argument('--garment_cache_dir', type=str, default=None, required=False)
+    parser.add_argument('--avatar_cache_dir', type=str, default=None, required=False)
+    parser.add_argument('--shared_uncond', action='store_true', help='encode the empty garment once per category')
+    parser.add_argument('--parsing_precision', type=str, default="fp32", choices=["fp32", "int8"], required=False)
+    args = parser.parse_args()
+
+    service = TryOnService(
+        args.gpu_id,
+        preload=args.preload,
+        garment_cache_bytes=args.garment_cache_mb * 1024 ** 2,
+        garment_cache_dir=args.garment_cache_dir,
+        avatar_cache_dir=args.avatar_cache_dir,
+        shared_uncond=args.shared_uncond,
+        parsing_precision=args.parsing_precision,
+    )
+
+    server = ThreadingHTTPServer((args.host, args.port), TryOnHandler)
+    print(f"Try-on server listening on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,362 @@
+from pathlib import Path
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from PIL import Image
+from utils_ootd import get_mask_location
+
+PROJECT_ROOT = Path(__file__).absolute().parents[1].absolute()
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from preprocess.openpose.run_openpose import OpenPose
+from preprocess.humanparsing.run_parsing import Parsing
+from ootd.inference_ootd_hd import OOTDiffusionHD
+from ootd.inference_ootd_dc import OOTDiffusionDC
+from ootd.garment_cache import GarmentCache
+from ootd.scheduler_registry import SCHEDULERS, DEFAULT_SCHEDULER
+from ootd.latent_preview import LatentPreviewer
+from avatar_cache import Avatar, AvatarCache
+
+
+category_dict = ['upperbody', 'lowerbody', 'dress']
+category_dict_utils = ['upper_body', 'lower_body', 'dresses']
+
+# Previews kept for a refine, the oldest are dropped first
+MAX_PREVIEWS = 16
+
+
+class PreparedPerson:
+    """
+    A 768x1024 person picture with its masks, and the VAE latents of the masked
+    and of the original picture when the avatar cache has them.
+    """
+
+    def __init__(self, model_img, mask, mask_gray, vton_latents=None, image_ori_latents=None):
+        self.model_img = model_img
+        self.mask = mask
+        self.mask_gray = mask_gray
+        self.vton_latents = vton_latents
+        self.image_ori_latents = image_ori_latents
+
+    @property
+    def masked_img(self):
+        return Image.composite(self.mask_gray, self.model_img, self.mask)
+
+    def inputs(self):
+        """
+        The image_vton, mask, image_ori and image_ori_latents arguments of a try-on.
+        """
+        if self.vton_latents is not None:
+            return self.vton_latents, self.mask, self.image_ori_latents, None
+        return self.masked_img, self.mask, self.model_img, self.image_ori_latents
+
+
+class TryOnService:
+    """
+    Keeps OpenPose, Parsing and the OOTDiffusion models resident so that
+    only the first try-on pays the model load.
+
+    The diffusion models are loaded on first use of each model_type, unless
+    they are listed in `preload`. Calls are serialized with a lock, since all
+    the models share one device.
+
+    The garment features are cached by content hash, up to `garment_cache_bytes`
+    in memory and without limit in `garment_cache_dir` when it is given.
+    The cache is off by default, since one-shot callers such as run_ootd.py
+    never hit it, tryon_server.py turns it on with `--garment_cache_mb`.
+
+    With `avatar_cache_dir`, the person pictures precomputed there by
+    precompute_avatars.py skip OpenPose, Parsing, the masks and the VAE
+    encoding of the person.
+
+    With `shared_uncond`, the empty garment of classifier free guidance is
+    encoded once per category and resolution instead of with every garment,
+    see OOTDiffusionDC.empty_garment.
+
+    `parsing_precision` "int8" parses with the quantized models of
+    quantize_parsing.py.
+
+    preview() renders a fast low resolution try-on and keeps it, with the
+    person masks and the garment features, for a later refine() at full
+    resolution.
+    """
+
+    def __init__(self, gpu_id=0, preload=(), garment_cache_bytes=0, garment_cache_dir=None,
+                 avatar_cache_dir=None, shared_uncond=False, parsing_precision="fp32"):
+        self.gpu_id = gpu_id
+        self.openpose_model = OpenPose(gpu_id)
+        self.parsing_model = Parsing(gpu_id, precision=parsing_precision)
+        self.models = {}
+        self.shared_uncond = shared_uncond
+        self.garment_cache = None
+        if garment_cache_bytes > 0 or garment_cache_dir is not None:
+            self.garment_cache = GarmentCache(garment_cache_bytes, garment_cache_dir)
+        self.avatar_cache = None
+        if avatar_cache_dir is not None:
+            self.avatar_cache = AvatarCache(avatar_cache_dir, 'cuda:' + str(gpu_id))
+        self.previews = OrderedDict()
+        self.lock = threading.Lock()
+        for model_type in preload:
+            self.get_model(model_type)
+
+    def get_model(self, model_type):
+        if model_type not in self.models:
+            if model_type == "hd":
+                self.models[model_type] = OOTDiffusionHD(self.gpu_id, self.garment_cache, self.shared_uncond)
+            elif model_type == "dc":
+                self.models[model_type] = OOTDiffusionDC(self.gpu_id, self.garment_cache, self.shared_uncond)
+            else:
+                raise ValueError("model_type must be \'hd\' or \'dc\'!")
+        return self.models[model_type]
+
+    def analyze_person(self, model_img):
+        """
+        Run OpenPose and Parsing on a 768x1024 person picture.
+
+        Returns:
+        Avatar: The keypoints and the parse map, without masks or latents yet.
+        """
+        keypoints = self.openpose_model(model_img.resize((384, 512)))
+        model_parse, _ = self.parsing_model(model_img.resize((384, 512)))
+        return Avatar(keypoints, model_parse)
+
+    def add_mask(self, avatar, model_type, category):
+        mask, mask_gray = get_mask_location(model_type, category, avatar.model_parse, avatar.keypoints)
+        mask = mask.resize((768, 1024), Image.NEAREST)
+        mask_gray = mask_gray.resize((768, 1024), Image.NEAREST)
+        avatar.masks[(model_type, category)] = (mask, mask_gray)
+        return mask, mask_gray
+
+    def add_latents(self, avatar, model_img, model_type, category):
+        pipe = self.get_model(model_type).pipe
+        mask, mask_gray = avatar.masks[(model_type, category)]
+        masked_vton_img = Image.composite(mask_gray, model_img, mask)
+        if "image_ori" not in avatar.latents:
+            avatar.latents["image_ori"] = pipe.encode_image(model_img)
+        avatar.latents[Avatar.vton_name(model_type, category)] = pipe.encode_image(masked_vton_img)
+
+    def prepare_person(self, model_img, model_type, category):
+        """
+        The masks and the person inputs of the pipeline for a 768x1024 person picture,
+        from the avatar cache when the picture is a precomputed avatar.
+
+        Returns:
+        PreparedPerson: The pictures, and the latents when they were precomputed.
+        """
+        avatar = None
+        if self.avatar_cache is not None:
+            avatar = self.avatar_cache.get(model_img)
+
+        if avatar is not None and avatar.has(model_type, category_dict_utils[category]):
+            # Precomputed avatar, only the denoising loop and the decoding are left
+            mask, mask_gray = avatar.masks[(model_type, category_dict_utils[category])]
+            return PreparedPerson(model_img, mask, mask_gray,
+                                  avatar.latents[Avatar.vton_name(model_type, category_dict_utils[category])],
+                                  avatar.latents["image_ori"])
+
+        image_ori_latents = None
+        if avatar is None:
+            avatar = self.analyze_person(model_img)
+        else:
+            # Precomputed pose, parse map and picture latents, but not for this model type and category
+            image_ori_latents = avatar.latents.get("image_ori")
+            avatar = Avatar(avatar.keypoints, avatar.model_parse)
+        mask, mask_gray = self.add_mask(avatar, model_type, category_dict_utils[category])
+        return PreparedPerson(model_img, mask, mask_gray, image_ori_latents=image_ori_latents)
+
+    def __call__(self,
+                model_img,
+                cloth_img,
+                model_type='dc',
+                category=0,
+                image_scale=2.0,
+                n_steps=20,
+                n_samples=1,
+                seed=-1,
+                mask_path=None,
+                crop_to_mask=False,
+                guidance_stop_fraction=1.0,
+                guidance_stop_threshold=None,
+                deep_cache_interval=1,
+                deep_cache_depth=1,
+                scheduler=DEFAULT_SCHEDULER,
+                callback_on_step_end=None,
+    ):
+        """
+        Run a single try-on.
+
+        Args:
+        model_img (PIL.Image or str): Picture of the person, or a path to it.
+        cloth_img (PIL.Image or str): Picture of the garment, or a path to it.
+        category (int): 0 upperbody, 1 lowerbody, 2 dress.
+        mask_path (str): Optional path where the masked person picture is saved.
+        crop_to_mask (bool): Denoise only around the mask, see OotdPipeline.
+        guidance_stop_fraction (float): Share of the steps with classifier free guidance.
+        guidance_stop_threshold (float): Optional adaptive stop of the guidance, see OotdPipeline.
+        deep_cache_interval (int): Run unet_vton in full every that many steps, and reuse its deep features between.
+        deep_cache_depth (int): Number of outer down and up blocks that run at every step, see DeepCache.
+        scheduler (str): Name of the scheduler, one of SCHEDULERS.
+        callback_on_step_end (callable): Called after every denoising step, see OotdPipeline.
+
+        Returns:
+        list: The generated PIL images.
+        """
+        check_request(model_type, category, scheduler)
+
+        if isinstance(model_img, str):
+            model_img = Image.open(model_img)
+        if isinstance(cloth_img, str):
+            cloth_img = Image.open(cloth_img)
+
+        with self.lock:
+            model = self.get_model(model_type)
+
+            cloth_img = cloth_img.resize((768, 1024))
+            model_img = model_img.resize((768, 1024))
+            person = self.prepare_person(model_img, model_type, category)
+            image_vton, mask, image_ori, image_ori_latents = person.inputs()
+
+            if mask_path is not None:
+                person.masked_img.save(mask_path)
+
+            images = model(
+                model_type=model_type,
+                category=category_dict[category],
+                image_garm=cloth_img,
+                image_vton=image_vton,
+                mask=mask,
+                image_ori=image_ori,
+                num_samples=n_samples,
+                num_steps=n_steps,
+                image_scale=image_scale,
+                seed=seed,
+                image_ori_latents=image_ori_latents,
+                crop_to_mask=crop_to_mask,
+                guidance_stop_fraction=guidance_stop_fraction,
+                guidance_stop_threshold=guidance_stop_threshold,
+                deep_cache_interval=deep_cache_interval,
+                deep_cache_depth=deep_cache_depth,
+                scheduler=scheduler,
+                callback_on_step_end=callback_on_step_end,
+            )
+
+        return images
+
+    def stream(self, model_img, cloth_img, preview_interval=4, previewer=None, **kwargs):
+        """
+        Run a single try-on, giving rough pictures of the latents while it denoises.
+        The other arguments are those of __call__.
+
+        Yields:
+        tuple: ("preview", step, images) every `preview_interval` steps, then
+        ("images", None, images) with the generated PIL images. See LatentPreviewer.
+        """
+        previewer = previewer if previewer is not None else LatentPreviewer(preview_interval)
+        return previewer.stream(
+            lambda callback_on_step_end: self(model_img, cloth_img, callback_on_step_end=callback_on_step_end, **kwargs)
+        )
+
+    def preview(self,
+                model_img,
+                cloth_img,
+                model_type='dc',
+                category=0,
+                image_scale=2.0,
+                n_steps=8,
+                n_samples=1,
+                seed=-1,
+                scheduler=DEFAULT_SCHEDULER,
+    ):
+        """
+        Run a fast low resolution try-on, kept for a later refine().
+
+        The arguments are those of a single try-on, see __call__.
+
+        Returns:
+        str: The id of the preview for refine().
+        TryOnPreview: The preview, with its PIL images in `images` and the seconds
+        of every phase in `timings`.
+        """
+        check_request(model_type, category, scheduler)
+
+        if isinstance(model_img, str):
+            model_img = Image.open(model_img)
+        if isinstance(cloth_img, str):
+            cloth_img = Image.open(cloth_img)
+
+        with self.lock:
+            model = self.get_model(model_type)
+
+            cloth_img = cloth_img.resize((768, 1024))
+            model_img = model_img.resize((768, 1024))
+            start_time = time.time()
+            person = self.prepare_person(model_img, model_type, category)
+            person_time = time.time() - start_time
+
+            preview = model.preview(
+                model_type=model_type,
+                category=category_dict[category],
+                image_garm=cloth_img,
+                image_vton=person.masked_img,
+                mask=person.mask,
+                image_ori=model_img,
+                num_samples=n_samples,
+                num_steps=n_steps,
+                image_scale=image_scale,
+                seed=seed,
+                scheduler=scheduler,
+            )
+            preview.person = person
+            preview.timings["person"] = person_time
+
+            preview_id = uuid.uuid4().hex
+            self.previews[preview_id] = preview
+            while len(self.previews) > MAX_PREVIEWS:
+                self.previews.popitem(last=False)
+
+        return preview_id, preview
+
+    def refine(self, preview_id, n_steps=20, strength=0.6, scheduler=DEFAULT_SCHEDULER):
+        """
+        Render a kept preview at full resolution, with its person, garment and seed.
+
+        Args:
+        strength (float): Share of `n_steps` run from the upscaled preview latents,
+            None or 1 for a fresh run, see preview.refine_preview.
+
+        Returns:
+        list: The generated PIL images.
+        dict: The seconds of every phase.
+        """
+        check_scheduler(scheduler)
+
+        with self.lock:
+            preview = self.previews.get(preview_id)
+            if preview is None:
+                raise ValueError(f"Unknown or expired preview '{preview_id}'")
+            model = self.get_model(preview.model_type)
+            image_vton, mask, image_ori, image_ori_latents = preview.person.inputs()
+
+            return model.refine(
+                preview,
+                image_vton=image_vton,
+                mask=mask,
+                image_ori=image_ori,
+                num_steps=n_steps,
+                strength=strength,
+                image_ori_latents=image_ori_latents,
+                scheduler=scheduler,
+            )
+
+
+def check_request(model_type, category, scheduler):
+    if model_type == 'hd' and category != 0:
+        raise ValueError("model_type \'hd\' requires category == 0 (upperbody)!")
+    check_scheduler(scheduler)
+
+
+def check_scheduler(scheduler):
+    if scheduler not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler '{scheduler}', choose from {', '.join(sorted(SCHEDULERS))}")
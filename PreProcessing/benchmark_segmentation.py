@@ -0,0 +1,81 @@
+import argparse
+import time
+import numpy as np
+from PIL import Image, ImageDraw
+from image_processing import composite_person
+
+
+# Megapixels of the benchmarked pictures, all in a 3:4 portrait ratio
+DEFAULT_SIZES = [1, 4, 12]
+
+
+def composite_person_loop(img, mask_img):
+  # The pixel by pixel implementation segmentation() used before composite_person
+  mask_img = mask_img.resize(img.size)
+  bbox = mask_img.getbbox()
+  if bbox is None:
+    return None
+
+  person_width = bbox[2] - bbox[0]
+  person_height = bbox[3] - bbox[1]
+  bg_width = int(person_height * 3 / 4)
+  bg_height = person_height
+  offset_x = int((bg_width - person_width) // 2)
+  offset_y = int((bg_height - person_height) // 2)
+
+  person_img = Image.new("RGB", (bg_width, bg_height), (255, 255, 255))
+  for x in range(img.width):
+    for y in range(img.height):
+      pixel_value = mask_img.getpixel((x, y))
+      if pixel_value >= 128:
+        new_x = x - bbox[0] + offset_x
+        new_y = y - bbox[1] + offset_y
+        if 0 <= new_x < bg_width and 0 <= new_y < bg_height:
+          person_img.putpixel((new_x, new_y), img.getpixel((x, y)))
+  return person_img
+
+
+def make_inputs(megapixels, seed=0):
+  """
+  Random picture of the requested size and a person-like mask at the YOLO output resolution,
+  as segmentation() reads it back from masks() (mode "I;16", 0 or 65535).
+  """
+  width = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+  height = int(width * 4 / 3)
+  rng = np.random.default_rng(seed)
+  img = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+  mask = Image.new("L", (480, 640), 0)
+  draw = ImageDraw.Draw(mask)
+  draw.ellipse((170, 40, 310, 160), fill=255)
+  draw.rectangle((120, 150, 360, 620), fill=255)
+  mask_img = Image.fromarray((np.asarray(mask) > 0).astype(np.uint16) * 65535)
+  return img, mask_img
+
+
+def measure(function, img, mask_img, repeat):
+  best = float("inf")
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = function(img, mask_img)
+    best = min(best, time.perf_counter() - start)
+  return best, result
+
+
+def main():
+  parser = argparse.ArgumentParser(description="compare the pixel loop and the array path of segmentation")
+  parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="Megapixels of the inputs")
+  parser.add_argument("--repeat", type=int, default=3, help="Runs of the array path, the best one is reported")
+  args = parser.parse_args()
+
+  print(f"{'MP':>6} {'loop (s)':>10} {'array (s)':>10} {'speedup':>9}  identical")
+  for megapixels in args.sizes:
+    img, mask_img = make_inputs(megapixels)
+    loop_time, loop_result = measure(composite_person_loop, img, mask_img, 1)
+    array_time, array_result = measure(composite_person, img, mask_img, args.repeat)
+    identical = np.array_equal(np.asarray(loop_result), np.asarray(array_result))
+    print(f"{megapixels:>6.1f} {loop_time:>10.3f} {array_time:>10.4f} {loop_time / array_time:>8.0f}x  {identical}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,6 +1,7 @@
 import cv2
 import numpy as np
 import os
+import threading
 # import tensorflow as tf
 # import tensorflow_hub as hub
 from ultralytics import YOLO
@@ -15,6 +16,14 @@ def get_project_root():
 # Define data directory path
 data_dir = os.path.join(get_project_root(), "PreProcessing/images")
 
+# Segmentation weights used when no other model is asked for
+SEGMENTATION_MODEL = "yolov8m-seg.pt"
+
+# Loaded YOLO models by weights file, with a lock each since predict() is not thread-safe
+_MODELS = {}
+_MODEL_LOCKS = {}
+_REGISTRY_LOCK = threading.Lock()
+
 
 '''
 def superresolution_image(image_path, model_url, output_path):
@@ -48,20 +57,48 @@ def superresolution_image(image_path, model_url, output_path):
 '''
 
 
+def get_model(weights=SEGMENTATION_MODEL):
+  """
+  Return the YOLO model for `weights`, loading it on first use.
+
+  The model stays resident, so only the first call of the process pays the load.
+  """
+  model = _MODELS.get(weights)
+  if model is None:
+    with _REGISTRY_LOCK:
+      model = _MODELS.get(weights)
+      if model is None:
+        model = YOLO(weights)
+        _MODEL_LOCKS[weights] = threading.Lock()
+        _MODELS[weights] = model
+  return model
+
+
+def person_mask(image, weights=SEGMENTATION_MODEL):
+  """
+  Segment the first detected instance of `image` (a PIL image or a path).
+
+  Returns the mask as a mode "I;16" image holding 0 or 65535, which is what reading back the
+  PNG of masks() gives, or None when nothing is detected.
+  """
+  model = get_model(weights)
+  with _MODEL_LOCKS[weights]:
+    results = model.predict(image)
+  masks = results[0].masks
+  if masks is None or len(masks) == 0:
+    return None
+  mask = masks[0].data[0].cpu().numpy()
+  return Image.fromarray((mask > 0).astype(np.uint16) * 65535)
+
+
 ## Instance segmentation and then paste it onto white bg 3:4
 def masks(image_path, output_path):
   try:
-    # Use the model
-    model = YOLO("yolov8m-seg.pt")
-    results = model.predict(image_path)
-    result = results[0]
-    masks = result.masks
-    len(masks)
-    mask1 = masks[0]
-    mask = mask1.data[0].cpu().numpy()
-    polygon = mask1.xy[0]
-
-    mask_img = Image.fromarray(mask,"I")
+    mask_img = person_mask(image_path)
+    if mask_img is None:
+      print("No person detected")
+      return
+
     mask_img.save(output_path)
 
   except Exception as e:
@@ -69,44 +106,67 @@ def masks(image_path, output_path):
     print(f"No person detected: {e}")
 
 
-def segmentation(image_path, masks_path, output_path):
-  try:
-    # Load the original image and the person's mask
-    img = Image.open(image_path)
-    mask_img1 = Image.open(masks_path)
+def composite_person(img, mask_img):
+  """
+  Cut the person out of `img` with `mask_img` and center it on a white 3:4 background.
+
+  Mask pixels >= 128 belong to the person. Returns None when the mask is empty.
+  """
+  # The canvas is RGB, so other modes (RGBA uploads, greyscale) are converted first
+  if img.mode != "RGB":
+    img = img.convert("RGB")
+
+  # Resize the mask so that it has the same dimensions as the original image
+  mask_img = mask_img.resize(img.size)
+
+  # Calculate the bounding rectangle of the person in the mask
+  bbox = mask_img.getbbox()
+  if bbox is None:
+    return None
+
+  # Calculate the dimensions of the detected person
+  person_width = bbox[2] - bbox[0]
+  person_height = bbox[3] - bbox[1]
+
+  # Calculate the dimensions of the white background image in a 3:4 ratio with respect to the person
+  bg_width = int(person_height * 3 / 4)
+  bg_height = person_height
+
+  # Calculate the offset needed to center the person in the white background image
+  offset_x = int((bg_width - person_width) // 2)
+  offset_y = int((bg_height - person_height) // 2)
 
-    # Resize the mask so that it has the same dimensions as the original image
-    mask_img1 = mask_img1.resize(img.size)
+  # Create a new RGB image to store the cropped person, initialized with white background
+  person = np.full((bg_height, bg_width, 3), 255, dtype=np.uint8)
 
-    # Calculate the bounding rectangle of the person in the mask
-    bbox = mask_img1.getbbox()
+  # Part of the image that lands inside the background (wide poses get cropped at the sides).
+  # It is not clipped to the bounding box, since getbbox() of 16 bit masks can miss faint pixels
+  left = max(0, bbox[0] - offset_x)
+  top = max(0, bbox[1] - offset_y)
+  right = min(img.width, bbox[0] - offset_x + bg_width)
+  bottom = min(img.height, bbox[1] - offset_y + bg_height)
 
-    if bbox is not None:
-        # Calculate the dimensions of the detected person
-        person_width = bbox[2] - bbox[0]
-        person_height = bbox[3] - bbox[1]
+  if left < right and top < bottom:
+    person_mask = np.asarray(mask_img)[top:bottom, left:right] >= 128
+    pixels = np.asarray(img)[top:bottom, left:right]
+    new_left = left - bbox[0] + offset_x
+    new_top = top - bbox[1] + offset_y
+    target = person[new_top:new_top + (bottom - top), new_left:new_left + (right - left)]
+    # Keep the original color wherever the pixel corresponds to the person
+    np.copyto(target, pixels, where=person_mask[:, :, None])
 
-        # Calculate the dimensions of the white background image in a 3:4 ratio with respect to the person
-        bg_width = int(person_height* 3 / 4)
-        bg_height = person_height
+  return Image.fromarray(person)
 
-        # Calculate the offset needed to center the person in the white background image
-        offset_x = int((bg_width - person_width) // 2)
-        offset_y = int((bg_height - person_height) // 2)
 
-        # Create a new RGB image to store the cropped person
-        person_img = Image.new("RGB", (bg_width, bg_height), (255, 255, 255))  # Initialize with white background
+def segmentation(image_path, masks_path, output_path):
+  try:
+    # Load the original image and the person's mask
+    img = Image.open(image_path)
+    mask_img1 = Image.open(masks_path)
 
-        # Combine original image with transparency mask
-        for x in range(img.width):
-            for y in range(img.height):
-                pixel_value = mask_img1.getpixel((x, y))
-                if pixel_value >= 128:  # If the pixel corresponds to the person
-                    new_x = x - bbox[0] + offset_x
-                    new_y = y - bbox[1] + offset_y
-                    if 0 <= new_x < bg_width and 0 <= new_y < bg_height:
-                        person_img.putpixel((new_x, new_y), img.getpixel((x, y)))  # Keep the original color
+    person_img = composite_person(img, mask_img1)
 
+    if person_img is not None:
         # Save final result
         person_img.save(output_path)
     else:
@@ -114,4 +174,35 @@ def segmentation(image_path, masks_path, output_path):
 
   except Exception as e:
         # Handle any unexpected errors
-        print(f"No person detected: {e}")
\ No newline at end of file
+        print(f"No person detected: {e}")
+
+
+def preprocess_person(image):
+  """
+  Segment the person in `image` (a PIL image or a path) and center it on a white 3:4 background.
+
+  Same result as masks() followed by segmentation(), without writing the mask and the final picture.
+
+  Returns:
+  PIL.Image: The composited person, or None when no person is detected.
+  """
+  try:
+    if isinstance(image, str):
+      image = Image.open(image)
+    # Decode once, predict() and composite_person() both read the pixels
+    image = image.convert("RGB")
+
+    mask_img = person_mask(image)
+    if mask_img is None:
+      print("WARNING! No person was detected in the mask.")
+      return None
+
+    person_img = composite_person(image, mask_img)
+    if person_img is None:
+      print("WARNING! No person was detected in the mask.")
+    return person_img
+
+  except Exception as e:
+    # Handle any unexpected errors
+    print(f"No person detected: {e}")
+    return None
\ No newline at end of file